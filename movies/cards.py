@@ -0,0 +1,208 @@
+"""
+电影卡片
+
+首页、列表、搜索和详情页中的每张电影卡片原本都要在请求中经过 views._process_movie_data，
+对 rating、genres、directors、actor、tags、images 逐行做 json.loads、ast.literal_eval
+和正则回退，还可能检查本地海报文件是否存在。这里把同样的解析结果预先保存到 movie_card 表:
+浮点评分、类型和标签列表、前几位导演和演员、封面URL以及是否使用本地海报。
+
+导入电影数据后调用 refresh_movie_cards，只重新解析 record_time 变化的行。
+视图通过 get_movie_cards 按主键批量读取，读到的卡片缓存在进程内；
+刷新后更新共享缓存中的代数，各进程最多 CARD_CHECK_INTERVAL 秒后丢弃旧卡片。
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from django.core.cache import cache
+from django.db import connection, transaction
+from .models import MovieCard
+
+logger = logging.getLogger(__name__)
+
+# 卡片中保留的导演和演员数量，比模板展示的数量(3和5)多一位，模板据此显示"等"
+CARD_DIRECTORS = 4
+CARD_ACTORS = 6
+
+# 每批重新解析的电影数量
+REFRESH_BATCH_SIZE = 1000
+
+# 每个进程缓存的卡片数量
+CARD_CACHE_SIZE = 20000
+
+# 检查卡片代数的间隔（秒）
+CARD_CHECK_INTERVAL = 60
+
+GENERATION_CACHE_KEY = 'movie_cards:generation'
+
+# 卡片字典的字段，与 _process_movie_data 的输出同名
+CARD_FIELDS = (
+    'movie_id', 'title', 'original_title', 'year', 'rating', 'genres', 'tags',
+    'directors', 'actor', 'cover_image', 'local_poster', 'collect_count',
+)
+
+_cards = OrderedDict()
+_cards_lock = threading.Lock()
+_generation = None
+_checked_at = 0.0
+
+
+def _people(value, limit):
+    """把解析后的导演或演员整理为最多 limit 个 {'name': ...}"""
+    if isinstance(value, dict):
+        value = [value]
+    if not isinstance(value, list):
+        return []
+    names = [person.get('name') for person in value if isinstance(person, dict) and person.get('name')]
+    return [{'name': name} for name in names[:limit]]
+
+
+def _card_from_row(row):
+    """用 _process_movie_data 解析一行 movie_collectmoviedb，返回 MovieCard 的字段"""
+    from .views import _process_movie_data
+
+    movie = _process_movie_data(row)
+    cover_image = movie.get('cover_image') or ''
+    return {
+        'movie_id': row['movie_id'],
+        'title': movie.get('title') or '',
+        'original_title': movie.get('original_title') or '',
+        'year': movie.get('year') or 0,
+        'rating': float(movie.get('rating') or 0),
+        'genres': movie.get('genres') or [],
+        'tags': movie.get('tags') or [],
+        'directors': _people(movie.get('directors'), CARD_DIRECTORS),
+        'actors': _people(movie.get('actor'), CARD_ACTORS),
+        'cover_image': cover_image,
+        'local_poster': cover_image.startswith('/media/movie_posters/'),
+        'collect_count': movie.get('collect_count') or 0,
+        'record_time': row.get('record_time'),
+    }
+
+
+def _changed_movie_ids(full=False):
+    """没有卡片或 record_time 与卡片不一致的电影ID"""
+    with connection.cursor() as cursor:
+        if full:
+            cursor.execute("SELECT movie_id FROM movie_collectmoviedb")
+        else:
+            cursor.execute(f"""
+                SELECT m.movie_id
+                FROM movie_collectmoviedb m
+                LEFT JOIN {MovieCard._meta.db_table} c ON c.movie_id = m.movie_id
+                WHERE c.movie_id IS NULL OR NOT (c.record_time <=> m.record_time)
+            """)
+        return [row[0] for row in cursor.fetchall()]
+
+
+def _fetch_source_rows(movie_ids):
+    """读取生成卡片所需的原始列，每部电影一行"""
+    placeholders = ', '.join(['%s'] * len(movie_ids))
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+            SELECT m.movie_id, m.title, m.original_title, m.year, m.rating, m.genres, m.tags,
+                   m.directors, m.actor, m.images, m.collect_count, m.record_time,
+                   IFNULL(mr.rating, 0) as avg_rating
+            FROM movie_collectmoviedb m
+            LEFT JOIN movie_movieratingdb mr ON m.movie_id = mr.movie_id_id
+            WHERE m.movie_id IN ({placeholders})
+        """, list(movie_ids))
+        columns = [col[0] for col in cursor.description]
+        rows = {}
+        for values in cursor.fetchall():
+            row = dict(zip(columns, values))
+            rows.setdefault(row['movie_id'], row)
+    return list(rows.values())
+
+
+def refresh_movie_cards(full=False, movie_ids=None):
+    """
+    重新生成新增或 record_time 变化的电影卡片，并删除源数据已不存在的卡片
+
+    参数:
+        full: 重新解析全部电影
+        movie_ids: 只刷新指定的电影（如海报下载完成后），不比较 record_time
+
+    返回:
+        {'refreshed', 'removed'}
+    """
+    start_time = time.time()
+    movie_ids = _changed_movie_ids(full) if movie_ids is None else list(movie_ids)
+    refreshed = 0
+    for start in range(0, len(movie_ids), REFRESH_BATCH_SIZE):
+        chunk = movie_ids[start:start + REFRESH_BATCH_SIZE]
+        cards = []
+        for row in _fetch_source_rows(chunk):
+            try:
+                cards.append(MovieCard(**_card_from_row(row)))
+            except Exception as e:
+                logger.error(f"[电影卡片] 解析电影 {row.get('movie_id')} 时出错: {str(e)}")
+        with transaction.atomic():
+            MovieCard.objects.filter(movie_id__in=chunk).delete()
+            MovieCard.objects.bulk_create(cards)
+        refreshed += len(cards)
+
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+            DELETE c FROM {MovieCard._meta.db_table} c
+            LEFT JOIN movie_collectmoviedb m ON m.movie_id = c.movie_id
+            WHERE m.movie_id IS NULL
+        """)
+        removed = cursor.rowcount
+
+    if refreshed or removed:
+        cache.set(GENERATION_CACHE_KEY, time.time(), timeout=None)
+        with _cards_lock:
+            _cards.clear()
+    logger.info(f"[电影卡片] 刷新完成: 重新生成 {refreshed} 张，删除 {removed} 张，耗时 {time.time() - start_time:.2f}秒")
+    return {'refreshed': refreshed, 'removed': removed}
+
+
+def _check_generation():
+    """每隔 CARD_CHECK_INTERVAL 秒检查一次卡片代数，有变化时清空进程内缓存，调用方持有锁"""
+    global _generation, _checked_at
+    now = time.monotonic()
+    if now - _checked_at < CARD_CHECK_INTERVAL:
+        return
+    _checked_at = now
+    generation = cache.get(GENERATION_CACHE_KEY)
+    if generation != _generation:
+        _cards.clear()
+        _generation = generation
+
+
+def get_movie_cards(movie_ids):
+    """
+    按主键批量读取电影卡片
+
+    返回:
+        {movie_id: 卡片字典}，字段见 CARD_FIELDS；没有卡片的电影不在结果中。
+        卡片字典由各请求共享，调用方不应原地修改
+    """
+    cards = {}
+    missing = []
+    with _cards_lock:
+        _check_generation()
+        for movie_id in movie_ids:
+            card = _cards.get(movie_id)
+            if card is None:
+                missing.append(movie_id)
+            else:
+                _cards.move_to_end(movie_id)
+                cards[movie_id] = card
+    if not missing:
+        return cards
+
+    loaded = {}
+    for row in MovieCard.objects.filter(movie_id__in=set(missing)).values(
+        'movie_id', 'title', 'original_title', 'year', 'rating', 'genres', 'tags',
+        'directors', 'actors', 'cover_image', 'local_poster', 'collect_count',
+    ):
+        row['actor'] = row.pop('actors')
+        loaded[row['movie_id']] = row
+    with _cards_lock:
+        _cards.update(loaded)
+        while len(_cards) > CARD_CACHE_SIZE:
+            _cards.popitem(last=False)
+    cards.update(loaded)
+    return cards
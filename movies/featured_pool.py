@@ -0,0 +1,118 @@
+"""
+首页精选电影的候选池
+
+原来的精选查询用 ORDER BY RAND()，每次访问都要为满足条件的每一行生成随机数并排序。
+这里每隔 POOL_REFRESH_SECONDS 秒把满足条件的电影ID及其抽样权重从 movie_card 表读入进程内存，
+每次请求按累计权重二分抽取 k 部(O(k log n))，卡片再由 get_movie_cards 按主键读取。
+
+抽样权重为 max(评分, 1) × ln(1 + 收藏人数)，评分高且看过的人多的电影更容易被选中。
+传入 seed 时同一候选池内结果固定，候选池刷新后才会变化。
+"""
+import bisect
+import itertools
+import logging
+import math
+import random
+import threading
+import time
+from django.db.models import Q
+from .models import MovieCard
+
+logger = logging.getLogger(__name__)
+
+# 各候选池的入选条件，与原来精选查询的 WHERE 条件一致
+POOLS = {
+    'member': Q(collect_count__gt=1000),
+    'guest': Q(rating__gte=9) | Q(collect_count__gt=10000),
+}
+
+# 候选池的刷新间隔（秒）
+POOL_REFRESH_SECONDS = 10 * 60
+
+FEATURED_COUNT = 6
+
+# 加权抽样最多抽取 k 的多少倍次，少数电影权重过大凑不满 k 部时返回已抽到的电影
+MAX_DRAW_FACTOR = 8
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def featured_weight(rating, collect_count):
+    return max(rating or 0.0, 1.0) * math.log1p(max(collect_count or 0, 0))
+
+
+class FeaturedPool:
+    """一个候选池: 电影ID及其累计抽样权重"""
+
+    def __init__(self, rows):
+        self.movie_ids = [movie_id for movie_id, _, _ in rows]
+        self.cumulative = list(itertools.accumulate(
+            featured_weight(rating, collect_count) for _, rating, collect_count in rows
+        ))
+        self.loaded_at = time.monotonic()
+        self.generation = int(time.time())
+
+    def __len__(self):
+        return len(self.movie_ids)
+
+    def sample(self, k, rng, weighted=True):
+        """不放回地抽取至多 k 个电影ID"""
+        n = len(self.movie_ids)
+        if not weighted or n <= k or not self.cumulative[-1]:
+            return [self.movie_ids[i] for i in rng.sample(range(n), min(k, n))]
+        total = self.cumulative[-1]
+        chosen = {}
+        for _ in range(k * MAX_DRAW_FACTOR):
+            index = min(bisect.bisect_right(self.cumulative, rng.random() * total), n - 1)
+            chosen.setdefault(index, None)
+            if len(chosen) >= k:
+                break
+        return [self.movie_ids[i] for i in chosen]
+
+
+def _load_pool(name):
+    start_time = time.time()
+    rows = list(MovieCard.objects.filter(POOLS[name]).values_list('movie_id', 'rating', 'collect_count'))
+    pool = FeaturedPool(rows)
+    logger.info(f"[精选电影] 候选池 {name} 已加载 {len(pool)} 部电影，耗时 {time.time() - start_time:.2f}秒")
+    return pool
+
+
+def get_featured_pool(name):
+    """读取进程内的候选池，过期时由一个线程刷新，其他线程继续使用旧池"""
+    pool = _pools.get(name)
+    if pool is not None and time.monotonic() - pool.loaded_at < POOL_REFRESH_SECONDS:
+        return pool
+    if not _pools_lock.acquire(blocking=pool is None):
+        return pool
+    try:
+        current = _pools.get(name)
+        if current is not None and time.monotonic() - current.loaded_at < POOL_REFRESH_SECONDS:
+            return current
+        try:
+            _pools[name] = _load_pool(name)
+        except Exception as e:
+            if current is None:
+                raise
+            logger.error(f"[精选电影] 刷新候选池 {name} 出错，继续使用旧数据: {str(e)}")
+            current.loaded_at = time.monotonic()
+            return current
+        return _pools[name]
+    finally:
+        _pools_lock.release()
+
+
+def sample_featured_ids(name, k=FEATURED_COUNT, seed=None, weighted=True):
+    """
+    从候选池中抽取精选电影ID
+
+    参数:
+        name: 候选池名，见 POOLS
+        k: 抽取数量
+        seed: 随机种子(如用户ID)，同一候选池内相同种子的结果相同
+        weighted: 是否按评分和收藏人数加权
+    """
+    pool = get_featured_pool(name)
+    rng = random.Random(f'{seed}:{pool.generation}') if seed is not None else random.Random()
+    return pool.sample(k, rng, weighted)
@@ -0,0 +1,93 @@
+"""
+类型榜单
+
+首页每个类型分区原本各执行一次 WHERE m.genres LIKE '%类型%' 的全表扫描。这里在导入电影后
+从 movie_card 一次读出所有电影的类型列表，按与原查询相同的顺序(本站评分降序、没有评分的排在最后，
+再按收藏数降序)为每个类型保留前 GENRE_TOPLIST_SIZE 部，写入 movie_genre_top 表。
+首页按 (genre, rank) 索引一次查询所需类型的榜单。
+
+类型按卡片中解析出的类型列表精确匹配，不再像 LIKE 那样匹配到名称包含该类型的其他类型。
+本站评分变化后需要重新运行 build_movie_cards 才会反映到榜单中。
+"""
+import heapq
+import json
+import logging
+import time
+from django.db import connection, transaction
+from .models import GenreTopMovie, MovieCard
+
+logger = logging.getLogger(__name__)
+
+# 每个类型保留的电影数量
+GENRE_TOPLIST_SIZE = 50
+
+# 读取电影卡片时每次取回的行数
+FETCH_SIZE = 5000
+
+
+def _rank_key(rating, collect_count, movie_id):
+    """与 ORDER BY mr.rating DESC, m.collect_count DESC 一致的排序键，越大越靠前"""
+    return (rating is not None, rating or 0.0, collect_count or 0, -movie_id)
+
+
+def build_genre_toplists(top_n=GENRE_TOPLIST_SIZE):
+    """
+    重建全部类型榜单
+
+    返回:
+        {'genres', 'movies'}
+    """
+    start_time = time.time()
+    heaps = {}
+    seen = set()
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+            SELECT c.movie_id, c.genres, mr.rating, c.collect_count
+            FROM {MovieCard._meta.db_table} c
+            LEFT JOIN movie_movieratingdb mr ON mr.movie_id_id = c.movie_id
+        """)
+        while True:
+            rows = cursor.fetchmany(FETCH_SIZE)
+            if not rows:
+                break
+            for movie_id, genres, rating, collect_count in rows:
+                if movie_id in seen:
+                    continue
+                seen.add(movie_id)
+                if isinstance(genres, str):
+                    try:
+                        genres = json.loads(genres)
+                    except json.JSONDecodeError:
+                        continue
+                entry = (_rank_key(rating, collect_count, movie_id), movie_id)
+                for genre in set(genres or []):
+                    if not genre:
+                        continue
+                    heap = heaps.setdefault(genre, [])
+                    if len(heap) < top_n:
+                        heapq.heappush(heap, entry)
+                    elif entry > heap[0]:
+                        heapq.heapreplace(heap, entry)
+
+    toplist = [
+        GenreTopMovie(genre=genre, rank=rank, movie_id=movie_id)
+        for genre, heap in heaps.items()
+        for rank, (_, movie_id) in enumerate(sorted(heap, reverse=True), start=1)
+    ]
+    with transaction.atomic():
+        GenreTopMovie.objects.all().delete()
+        GenreTopMovie.objects.bulk_create(toplist, batch_size=1000)
+    logger.info(f"[类型榜单] 已重建 {len(heaps)} 个类型的榜单，共 {len(toplist)} 条，耗时 {time.time() - start_time:.2f}秒")
+    return {'genres': len(heaps), 'movies': len(toplist)}
+
+
+def genre_top_movie_ids(genres, limit=GENRE_TOPLIST_SIZE):
+    """一次查询多个类型的榜单，返回 {类型: [电影ID]}，没有榜单的类型为空列表"""
+    toplists = {genre: [] for genre in genres}
+    rows = (GenreTopMovie.objects
+            .filter(genre__in=list(toplists), rank__lte=limit)
+            .order_by('genre', 'rank')
+            .values_list('genre', 'movie_id'))
+    for genre, movie_id in rows:
+        toplists[genre].append(movie_id)
+    return toplists
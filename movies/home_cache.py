@@ -0,0 +1,116 @@
+"""
+首页分区缓存
+
+首页的精选、热门、高分、最新和类型推荐分区按各自的有效期缓存在Django缓存中，
+所有游客和登录用户共用；只有个人推荐和最近评分按用户分别缓存。
+
+缓存值附带新鲜期限，缓存项本身再多保留 STALE_SECONDS 秒:
+
+    - 新鲜期内直接返回
+    - 已过期但还在缓存中时，只有抢到刷新锁(cache.add)的请求重新查询，其他请求继续返回旧值
+    - 完全没有缓存时(冷启动或被淘汰)，抢到锁的请求查询，其他请求最多等待
+      LOCK_WAIT_SECONDS 秒，仍未等到结果才自行查询
+
+这样一个分区到期时，并发请求中只有一个会访问MySQL。FileBasedCache 的 add 在多进程间
+不是严格原子的，极少数情况下会有两个进程同时刷新同一分区，不影响结果。
+"""
+import logging
+import random
+import time
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+# 各分区的有效期（秒）
+SECTION_TTLS = {
+    'featured': 5 * 60,
+    'popular': 10 * 60,
+    'top_rated': 30 * 60,
+    'latest': 30 * 60,
+    'genres': 15 * 60,
+    'personal': 5 * 60,
+    'recently_rated': 2 * 60,
+}
+
+# 按用户缓存的分区
+USER_SECTIONS = ('personal', 'recently_rated')
+
+# 过期后旧值继续保留的时间（秒），期间由一个请求刷新，其他请求返回旧值
+STALE_SECONDS = 10 * 60
+
+# 刷新锁的超时时间（秒），持锁的请求异常退出时锁会自动释放
+LOCK_SECONDS = 30
+
+# 冷启动时等待其他请求查询结果的最长时间和轮询间隔（秒）
+LOCK_WAIT_SECONDS = 2.0
+LOCK_POLL_SECONDS = 0.05
+
+KEY_PREFIX = 'home_section'
+
+
+def _section_key(section, variant=None, user_id=None):
+    parts = [KEY_PREFIX, section]
+    if variant:
+        parts.append(variant)
+    if user_id is not None:
+        parts.append(f'user{user_id}')
+    return ':'.join(parts)
+
+
+def _store(key, section, value):
+    ttl = SECTION_TTLS[section]
+    # 新鲜期限加入少量随机抖动，同时写入的分区不会在同一时刻一起过期
+    fresh_until = time.time() + ttl * random.uniform(0.9, 1.0)
+    cache.set(key, {'value': value, 'fresh_until': fresh_until}, timeout=ttl + STALE_SECONDS)
+
+
+def get_home_section(section, loader, variant=None, user_id=None):
+    """
+    读取首页分区，缓存缺失或过期时用 loader() 重新查询
+
+    参数:
+        section: 分区名，见 SECTION_TTLS
+        loader: 无参数的查询函数，抛出的异常不会被缓存
+        variant: 同一分区的不同查询(如游客和登录用户的精选电影)
+        user_id: USER_SECTIONS 中的分区必须提供
+    """
+    if section not in SECTION_TTLS:
+        raise ValueError(f'未知的首页分区: {section}')
+    if section in USER_SECTIONS and user_id is None:
+        raise ValueError(f'首页分区 {section} 需要提供 user_id')
+
+    key = _section_key(section, variant, user_id)
+    entry = cache.get(key)
+    if entry is not None and entry['fresh_until'] > time.time():
+        return entry['value']
+
+    lock_key = f'{key}:lock'
+    if cache.add(lock_key, 1, timeout=LOCK_SECONDS):
+        try:
+            value = loader()
+        except Exception as e:
+            if entry is None:
+                raise
+            logger.error(f"[首页缓存] 刷新分区 {key} 出错，继续使用旧数据: {str(e)}")
+            return entry['value']
+        finally:
+            cache.delete(lock_key)
+        _store(key, section, value)
+        return value
+
+    # 其他请求正在刷新
+    if entry is not None:
+        return entry['value']
+    deadline = time.monotonic() + LOCK_WAIT_SECONDS
+    while time.monotonic() < deadline:
+        time.sleep(LOCK_POLL_SECONDS)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry['value']
+    logger.warning(f"[首页缓存] 等待分区 {key} 超时，直接查询")
+    return loader()
+
+
+def invalidate_user_sections(user_id):
+    """用户评分或收藏变化后清除其个人分区"""
+    cache.delete_many([_section_key(section, user_id=user_id) for section in USER_SECTIONS])
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from movies.memberships import sync_movie_memberships, MEMBERSHIP_BATCH_SIZE
+import time
+
+
+class Command(BaseCommand):
+    help = '从 movie_collectmoviedb 的 genres 和 tags 列分批重建电影与类型、标签的对应表'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=MEMBERSHIP_BATCH_SIZE, help='每批处理的电影数量')
+
+    def handle(self, *args, **options):
+        start_time = time.time()
+        self.stdout.write('重建电影类型和标签对应关系...')
+        try:
+            stats = sync_movie_memberships(batch_size=options['batch_size'])
+        except Exception as e:
+            self.stdout.write(self.style.ERROR(f'重建对应关系失败: {str(e)}'))
+            return
+        self.stdout.write(
+            f"处理 {stats['movies']} 部电影，写入 {stats['genre_links']} 条类型关系、{stats['tag_links']} 条标签关系，"
+            f"删除 {stats['removed']} 条已不存在电影的关系"
+        )
+        self.stdout.write(self.style.SUCCESS(f"完成，耗时: {time.time() - start_time:.2f}秒"))
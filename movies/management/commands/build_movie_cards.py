@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from movies.cards import refresh_movie_cards
+from movies.genre_index import build_genre_toplists, GENRE_TOPLIST_SIZE
+import time
+
+
+class Command(BaseCommand):
+    help = '生成电影卡片(预先解析好的评分、类型、导演、演员和封面)并重建类型榜单，默认只处理新增或 record_time 变化的电影'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='重新解析全部电影，修改解析逻辑或下载海报后使用')
+        parser.add_argument('--top-n', type=int, default=GENRE_TOPLIST_SIZE, help='类型榜单中每个类型保留的电影数量')
+
+    def handle(self, *args, **options):
+        start_time = time.time()
+        self.stdout.write('重新生成全部电影卡片...' if options['full'] else '更新变化的电影卡片...')
+        try:
+            stats = refresh_movie_cards(full=options['full'])
+            toplists = build_genre_toplists(top_n=options['top_n'])
+        except Exception as e:
+            self.stdout.write(self.style.ERROR(f'生成电影卡片失败: {str(e)}'))
+            return
+        self.stdout.write(f"已重建 {toplists['genres']} 个类型的榜单，共 {toplists['movies']} 条")
+        self.stdout.write(self.style.SUCCESS(
+            f"重新生成 {stats['refreshed']} 张电影卡片，删除 {stats['removed']} 张，耗时: {time.time() - start_time:.2f}秒"
+        ))
@@ -3,6 +3,9 @@ import datetime
 from django.core.management.base import BaseCommand
 from django.db import connection
 from movies.models import Movie, Genre
+from movies.cards import refresh_movie_cards
+from movies.genre_index import build_genre_toplists
+from movies.memberships import sync_movie_memberships
 from django.utils.text import slugify
 import logging
 import ast
@@ -33,6 +36,18 @@ class Command(BaseCommand):
         # 最后建立电影和类型的关联
         self.link_movies_to_genres()
         
+        # 为新增或 record_time 变化的电影重新生成电影卡片
+        stats = refresh_movie_cards()
+        self.stdout.write(self.style.SUCCESS(f"重新生成 {stats['refreshed']} 张电影卡片，删除 {stats['removed']} 张"))
+        
+        # 用新的电影卡片重建类型榜单
+        stats = build_genre_toplists()
+        self.stdout.write(self.style.SUCCESS(f"已重建 {stats['genres']} 个类型的榜单"))
+        
+        # 重建电影与类型、标签的对应表
+        stats = sync_movie_memberships()
+        self.stdout.write(self.style.SUCCESS(f"已写入 {stats['genre_links']} 条类型关系、{stats['tag_links']} 条标签关系"))
+        
         self.stdout.write(self.style.SUCCESS('电影数据导入完成！'))
     
     def dictfetchall(self, cursor):
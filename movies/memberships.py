@@ -0,0 +1,135 @@
+"""
+电影与类型、标签的对应表
+
+movie_collectmoviedb 的 genres、tags 是文本列，按类型筛选只能用 LIKE '%类型%' 全表扫描，
+还会匹配到名称包含该类型的其他类型。这里把它们拆成两张对应表:
+
+    movie_genre_link (genre_id, movie_id)   类型字典为 movies_genre
+    movie_tag_link   (tag_id, movie_id)     标签字典为 movie_tag
+
+(genre_id, movie_id) 上的唯一索引使按类型查电影成为索引范围扫描，
+另有 movie_id 索引用于查询一部电影的类型或标签。
+
+sync_movie_memberships 按 movie_id 分批读取源表，每批在一个事务中删除并重新写入这批电影的对应关系，
+最后删除源表中已不存在的电影的对应关系。movies_genre 中同名的多条记录以ID最小的一条为准。
+"""
+import logging
+import time
+from django.db import connection, transaction
+from recommender.utils import parse_literal, parse_str_list, unique_values
+from .models import Genre, Tag, MovieGenreLink, MovieTagLink
+
+logger = logging.getLogger(__name__)
+
+# 每批处理的电影数量
+MEMBERSHIP_BATCH_SIZE = 1000
+
+GENRE_NAME_MAX_LENGTH = Genre._meta.get_field('name').max_length
+TAG_NAME_MAX_LENGTH = Tag._meta.get_field('name').max_length
+
+
+def parse_labels(value):
+    """解析 genres、tags 列，支持JSON、Python列表字符串和逗号分隔的字符串"""
+    data = value if isinstance(value, list) else parse_literal(value)
+    if isinstance(data, list):
+        return unique_values(str(item).strip() for item in data)
+    if not value:
+        return []
+    if not value.startswith('['):
+        return unique_values(item.strip() for item in value.split(','))
+    return parse_str_list(value)
+
+
+def genre_ids(names, create=False):
+    """类型名 -> 类型ID，create=True 时补建缺少的类型"""
+    names = {name for name in names if len(name) <= GENRE_NAME_MAX_LENGTH}
+    ids = {}
+    # 按ID降序遍历，同名记录最终保留最小的ID
+    for genre_id, name in Genre.objects.filter(name__in=names).order_by('-id').values_list('id', 'name'):
+        ids[name] = genre_id
+    missing = names - set(ids)
+    if create and missing:
+        Genre.objects.bulk_create([Genre(name=name) for name in missing])
+        return genre_ids(names)
+    return ids
+
+
+def tag_ids(names, create=False):
+    """标签名 -> 标签ID，create=True 时补建缺少的标签"""
+    names = {name for name in names if len(name) <= TAG_NAME_MAX_LENGTH}
+    ids = dict(Tag.objects.filter(name__in=names).values_list('name', 'id'))
+    missing = names - set(ids)
+    if create and missing:
+        Tag.objects.bulk_create([Tag(name=name) for name in missing], ignore_conflicts=True)
+        return tag_ids(names)
+    return ids
+
+
+def _sync_batch(rows):
+    """重建一批电影的对应关系，返回 (类型关系数, 标签关系数)"""
+    parsed = [(movie_id, parse_labels(genres), parse_labels(tags)) for movie_id, genres, tags in rows]
+    genre_map = genre_ids({name for _, names, _ in parsed for name in names}, create=True)
+    tag_map = tag_ids({name for _, _, names in parsed for name in names}, create=True)
+    genre_links = [
+        MovieGenreLink(genre_id=genre_map[name], movie_id=movie_id)
+        for movie_id, names, _ in parsed for name in names if name in genre_map
+    ]
+    tag_links = [
+        MovieTagLink(tag_id=tag_map[name], movie_id=movie_id)
+        for movie_id, _, names in parsed for name in names if name in tag_map
+    ]
+    movie_ids = [movie_id for movie_id, _, _ in parsed]
+    with transaction.atomic():
+        MovieGenreLink.objects.filter(movie_id__in=movie_ids).delete()
+        MovieTagLink.objects.filter(movie_id__in=movie_ids).delete()
+        MovieGenreLink.objects.bulk_create(genre_links)
+        MovieTagLink.objects.bulk_create(tag_links)
+    return len(genre_links), len(tag_links)
+
+
+def sync_movie_memberships(batch_size=MEMBERSHIP_BATCH_SIZE):
+    """
+    从 movie_collectmoviedb 重建全部电影的类型和标签对应关系
+
+    返回:
+        {'movies', 'genre_links', 'tag_links', 'removed'}
+    """
+    start_time = time.time()
+    stats = {'movies': 0, 'genre_links': 0, 'tag_links': 0, 'removed': 0}
+    last_movie_id = None
+    while True:
+        with connection.cursor() as cursor:
+            if last_movie_id is None:
+                cursor.execute(
+                    "SELECT movie_id, genres, tags FROM movie_collectmoviedb ORDER BY movie_id LIMIT %s",
+                    [batch_size],
+                )
+            else:
+                cursor.execute(
+                    "SELECT movie_id, genres, tags FROM movie_collectmoviedb WHERE movie_id > %s ORDER BY movie_id LIMIT %s",
+                    [last_movie_id, batch_size],
+                )
+            rows = cursor.fetchall()
+        if not rows:
+            break
+        last_movie_id = rows[-1][0]
+        genre_count, tag_count = _sync_batch(rows)
+        stats['movies'] += len(rows)
+        stats['genre_links'] += genre_count
+        stats['tag_links'] += tag_count
+        logger.info(f"[类型标签] 已处理 {stats['movies']} 部电影")
+
+    with connection.cursor() as cursor:
+        for table in (MovieGenreLink._meta.db_table, MovieTagLink._meta.db_table):
+            cursor.execute(f"""
+                DELETE l FROM {table} l
+                LEFT JOIN movie_collectmoviedb m ON m.movie_id = l.movie_id
+                WHERE m.movie_id IS NULL
+            """)
+            stats['removed'] += cursor.rowcount
+
+    logger.info(
+        f"[类型标签] 对应关系重建完成: {stats['movies']} 部电影，{stats['genre_links']} 条类型关系，"
+        f"{stats['tag_links']} 条标签关系，删除 {stats['removed']} 条，耗时 {time.time() - start_time:.2f}秒"
+    )
+    return stats
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.20 on 2026-10-18 16:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0005_collectmoviedb_collectmovietypedb_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MovieCard',
+            fields=[
+                ('movie_id', models.IntegerField(primary_key=True, serialize=False, verbose_name='电影ID')),
+                ('title', models.CharField(max_length=1000, verbose_name='标题')),
+                ('original_title', models.CharField(blank=True, max_length=1000, verbose_name='原始标题')),
+                ('year', models.IntegerField(default=0, verbose_name='年份')),
+                ('rating', models.FloatField(default=0, verbose_name='评分')),
+                ('genres', models.JSONField(default=list, verbose_name='类型')),
+                ('tags', models.JSONField(default=list, verbose_name='标签')),
+                ('directors', models.JSONField(default=list, verbose_name='导演')),
+                ('actors', models.JSONField(default=list, verbose_name='主演')),
+                ('cover_image', models.CharField(blank=True, max_length=1000, verbose_name='封面URL')),
+                ('local_poster', models.BooleanField(default=False, verbose_name='使用本地海报')),
+                ('collect_count', models.IntegerField(default=0, verbose_name='收藏数')),
+                ('record_time', models.DateTimeField(blank=True, null=True, verbose_name='源数据记录时间')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新时间')),
+            ],
+            options={
+                'verbose_name': '电影卡片',
+                'verbose_name_plural': '电影卡片',
+                'db_table': 'movie_card',
+            },
+        ),
+    ]
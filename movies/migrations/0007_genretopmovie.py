@@ -0,0 +1,28 @@
+# Generated by Django 4.2.20 on 2026-10-18 18:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0006_moviecard'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GenreTopMovie',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('genre', models.CharField(max_length=100, verbose_name='类型')),
+                ('rank', models.PositiveSmallIntegerField(verbose_name='名次')),
+                ('movie_id', models.IntegerField(verbose_name='电影ID')),
+            ],
+            options={
+                'verbose_name': '类型榜单',
+                'verbose_name_plural': '类型榜单',
+                'db_table': 'movie_genre_top',
+                'unique_together': {('genre', 'rank')},
+            },
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 4.2.20 on 2026-10-18 20:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0007_genretopmovie'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True, verbose_name='标签名')),
+            ],
+            options={
+                'verbose_name': '标签',
+                'verbose_name_plural': '标签',
+                'db_table': 'movie_tag',
+            },
+        ),
+        migrations.CreateModel(
+            name='MovieGenreLink',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('movie_id', models.IntegerField(verbose_name='电影ID')),
+                ('genre', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='movie_links', to='movies.genre', verbose_name='类型')),
+            ],
+            options={
+                'verbose_name': '电影类型关系',
+                'verbose_name_plural': '电影类型关系',
+                'db_table': 'movie_genre_link',
+                'indexes': [models.Index(fields=['movie_id'], name='movie_genre_link_movie_idx')],
+                'unique_together': {('genre', 'movie_id')},
+            },
+        ),
+        migrations.CreateModel(
+            name='MovieTagLink',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('movie_id', models.IntegerField(verbose_name='电影ID')),
+                ('tag', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='movie_links', to='movies.tag', verbose_name='标签')),
+            ],
+            options={
+                'verbose_name': '电影标签关系',
+                'verbose_name_plural': '电影标签关系',
+                'db_table': 'movie_tag_link',
+                'indexes': [models.Index(fields=['movie_id'], name='movie_tag_link_movie_idx')],
+                'unique_together': {('tag', 'movie_id')},
+            },
+        ),
+    ]
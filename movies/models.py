@@ -102,6 +102,92 @@ class MovieImageCache(models.Model):
     def __str__(self):
         return f"电影图片缓存 #{self.movie_id}"
 
+class MovieCard(models.Model):
+    """电影卡片，movie_collectmoviedb 中列表展示所需字段的预解析结果"""
+    movie_id = models.IntegerField('电影ID', primary_key=True)
+    title = models.CharField('标题', max_length=1000)
+    original_title = models.CharField('原始标题', max_length=1000, blank=True)
+    year = models.IntegerField('年份', default=0)
+    rating = models.FloatField('评分', default=0)
+    genres = models.JSONField('类型', default=list)
+    tags = models.JSONField('标签', default=list)
+    directors = models.JSONField('导演', default=list)
+    actors = models.JSONField('主演', default=list)
+    cover_image = models.CharField('封面URL', max_length=1000, blank=True)
+    local_poster = models.BooleanField('使用本地海报', default=False)
+    collect_count = models.IntegerField('收藏数', default=0)
+    record_time = models.DateTimeField('源数据记录时间', null=True, blank=True)
+    updated_at = models.DateTimeField('更新时间', auto_now=True)
+    
+    class Meta:
+        verbose_name = '电影卡片'
+        verbose_name_plural = verbose_name
+        db_table = 'movie_card'
+        
+    def __str__(self):
+        return f"电影卡片 #{self.movie_id} {self.title}"
+
+class GenreTopMovie(models.Model):
+    """类型榜单，每个类型按本站评分和收藏数排序的前若干部电影"""
+    genre = models.CharField('类型', max_length=100)
+    rank = models.PositiveSmallIntegerField('名次')
+    movie_id = models.IntegerField('电影ID')
+    
+    class Meta:
+        verbose_name = '类型榜单'
+        verbose_name_plural = verbose_name
+        db_table = 'movie_genre_top'
+        unique_together = ('genre', 'rank')
+        
+    def __str__(self):
+        return f"{self.genre} #{self.rank}: {self.movie_id}"
+
+class Tag(models.Model):
+    """电影标签字典"""
+    name = models.CharField('标签名', max_length=100, unique=True)
+    
+    class Meta:
+        verbose_name = '标签'
+        verbose_name_plural = verbose_name
+        db_table = 'movie_tag'
+        
+    def __str__(self):
+        return self.name
+
+class MovieGenreLink(models.Model):
+    """电影与类型的对应关系，由 movie_collectmoviedb.genres 生成"""
+    genre = models.ForeignKey(Genre, on_delete=models.CASCADE, related_name='movie_links', verbose_name='类型')
+    movie_id = models.IntegerField('电影ID')
+    
+    class Meta:
+        verbose_name = '电影类型关系'
+        verbose_name_plural = verbose_name
+        db_table = 'movie_genre_link'
+        unique_together = ('genre', 'movie_id')
+        indexes = [
+            models.Index(fields=['movie_id'], name='movie_genre_link_movie_idx'),  # 查询一部电影的类型
+        ]
+        
+    def __str__(self):
+        return f"{self.movie_id} - {self.genre_id}"
+
+class MovieTagLink(models.Model):
+    """电影与标签的对应关系，由 movie_collectmoviedb.tags 生成"""
+    tag = models.ForeignKey(Tag, on_delete=models.CASCADE, related_name='movie_links', verbose_name='标签')
+    movie_id = models.IntegerField('电影ID')
+    
+    class Meta:
+        verbose_name = '电影标签关系'
+        verbose_name_plural = verbose_name
+        db_table = 'movie_tag_link'
+        unique_together = ('tag', 'movie_id')
+        indexes = [
+            models.Index(fields=['movie_id'], name='movie_tag_link_movie_idx'),  # 查询一部电影的标签
+        ]
+        
+    def __str__(self):
+        return f"{self.movie_id} - {self.tag_id}"
+
 class CollectMovieDB(models.Model):
     movie_id = models.IntegerField(unique=True, verbose_name='电影ID')
     original_title = models.CharField(max_length=1000, verbose_name='原始标题')
@@ -1,3 +1,196 @@
-from django.test import TestCase
-
-# Create your tests here.
+import os
+import random
+import tempfile
+import time
+from collections import OrderedDict
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from . import cards, home_cache
+from .cards import GENERATION_CACHE_KEY, _card_from_row, get_movie_cards
+from .featured_pool import FeaturedPool
+from .genre_index import _rank_key
+from .home_cache import get_home_section, invalidate_user_sections
+from .memberships import _sync_batch, parse_labels
+from .models import Genre, MovieCard, MovieGenreLink, MovieTagLink, Tag
+
+
+class ParseLabelsTests(SimpleTestCase):
+
+    def test_supported_formats(self):
+        self.assertEqual(parse_labels('["剧情", "爱情"]'), ['剧情', '爱情'])
+        self.assertEqual(parse_labels("['剧情', '爱情', '剧情']"), ['剧情', '爱情'])
+        self.assertEqual(parse_labels('剧情, 爱情,'), ['剧情', '爱情'])
+        self.assertEqual(parse_labels([' 剧情', '', '犯罪']), ['剧情', '犯罪'])
+        self.assertEqual(parse_labels(''), [])
+        self.assertEqual(parse_labels(None), [])
+
+
+class SyncBatchTests(TestCase):
+
+    def links(self, model, field, movie_id):
+        return sorted(model.objects.filter(movie_id=movie_id).values_list(f'{field}__name', f'{field}_id'))
+
+    def test_links_are_rebuilt_per_movie(self):
+        drama = Genre.objects.create(name='剧情')
+        Genre.objects.create(name='剧情')
+        long_name = '类' * 30
+        counts = _sync_batch([(1, "['剧情', '爱情']", '经典, 京剧'), (2, f'["剧情", "{long_name}"]', '')])
+        self.assertEqual(counts, (3, 2))
+
+        # 同名类型以ID最小的一条为准，超长的类型名被跳过，缺少的类型和标签被创建
+        romance = Genre.objects.get(name='爱情')
+        self.assertEqual(self.links(MovieGenreLink, 'genre', 1), sorted([('剧情', drama.id), ('爱情', romance.id)]))
+        self.assertEqual(self.links(MovieGenreLink, 'genre', 2), [('剧情', drama.id)])
+        self.assertFalse(Genre.objects.filter(name=long_name).exists())
+        self.assertEqual(sorted(Tag.objects.values_list('name', flat=True)), ['京剧', '经典'])
+
+        _sync_batch([(1, '喜剧', '经典')])
+        self.assertEqual([name for name, _ in self.links(MovieGenreLink, 'genre', 1)], ['喜剧'])
+        self.assertEqual([name for name, _ in self.links(MovieTagLink, 'tag', 1)], ['经典'])
+        self.assertEqual(self.links(MovieGenreLink, 'genre', 2), [('剧情', drama.id)])
+
+
+class CardFromRowTests(SimpleTestCase):
+
+    def test_parses_source_row(self):
+        card = _card_from_row({
+            'movie_id': 1291546, 'title': '霸王别姬', 'original_title': '霸王别姬', 'year': 1993,
+            'rating': '{"average": 9.6, "max": 10}', 'genres': "['剧情', '爱情']", 'tags': '经典, 京剧',
+            'directors': "[{'name': '陈凯歌'}]", 'actor': str([{'name': f'演员{i}'} for i in range(7)]),
+            'images': "{'medium': 'https://img.example.com/p1910813120.jpg'}",
+            'collect_count': 1200, 'record_time': None, 'avg_rating': 0,
+        })
+        self.assertEqual(card['rating'], 9.6)
+        self.assertEqual((card['genres'], card['tags']), (['剧情', '爱情'], ['经典', '京剧']))
+        self.assertEqual(card['directors'], [{'name': '陈凯歌'}])
+        # 比模板展示的数量多保留一位
+        self.assertEqual(card['actors'], [{'name': f'演员{i}'} for i in range(cards.CARD_ACTORS)])
+        self.assertEqual(card['cover_image'], 'https://img.example.com/p1910813120.jpg')
+        self.assertFalse(card['local_poster'])
+        self.assertEqual((card['year'], card['collect_count']), (1993, 1200))
+
+    def test_site_rating_and_local_poster(self):
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            os.makedirs(os.path.join(media_root, 'movie_posters'))
+            open(os.path.join(media_root, 'movie_posters', '42.jpg'), 'wb').close()
+            card = _card_from_row({
+                'movie_id': 42, 'title': '无名', 'original_title': '', 'year': None, 'rating': '0',
+                'genres': '', 'tags': '', 'directors': '', 'actor': '', 'images': '{}',
+                'collect_count': None, 'record_time': None, 'avg_rating': 8.1,
+            })
+        # 没有豆瓣评分时使用本站评分，没有图片URL时使用已下载的海报
+        self.assertEqual(card['rating'], 8.1)
+        self.assertEqual((card['genres'], card['directors'], card['actors']), ([], [], []))
+        self.assertEqual(card['cover_image'], '/media/movie_posters/42.jpg')
+        self.assertTrue(card['local_poster'])
+        self.assertEqual((card['year'], card['collect_count']), (0, 0))
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class GetMovieCardsTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        for name, value in (('_cards', OrderedDict()), ('_generation', None), ('_checked_at', 0.0)):
+            patcher = mock.patch.object(cards, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        MovieCard.objects.create(movie_id=1, title='旧标题', genres=['剧情'], actors=[{'name': '张国荣'}])
+
+    def test_cards_are_reloaded_after_generation_changes(self):
+        with mock.patch('time.monotonic', return_value=1000.0):
+            loaded = get_movie_cards([1, 2])
+            self.assertEqual(list(loaded), [1])
+            self.assertEqual((loaded[1]['title'], loaded[1]['actor']), ('旧标题', [{'name': '张国荣'}]))
+
+            MovieCard.objects.filter(movie_id=1).update(title='新标题')
+            self.assertEqual(get_movie_cards([1])[1]['title'], '旧标题')
+            cache.set(GENERATION_CACHE_KEY, 1.0)
+
+        # 代数变化后，进程内缓存最多 CARD_CHECK_INTERVAL 秒后被丢弃
+        with mock.patch('time.monotonic', return_value=1000.0 + cards.CARD_CHECK_INTERVAL / 2):
+            self.assertEqual(get_movie_cards([1])[1]['title'], '旧标题')
+        with mock.patch('time.monotonic', return_value=1001.0 + cards.CARD_CHECK_INTERVAL):
+            self.assertEqual(get_movie_cards([1])[1]['title'], '新标题')
+
+
+class FeaturedPoolTests(SimpleTestCase):
+
+    def setUp(self):
+        self.pool = FeaturedPool([(movie_id, 5.0 + movie_id % 5, 100 * movie_id) for movie_id in range(1, 201)])
+
+    def test_sample_returns_distinct_movies_from_pool(self):
+        sample = self.pool.sample(6, random.Random(0))
+        self.assertEqual(len(sample), 6)
+        self.assertEqual(len(set(sample)), 6)
+        self.assertTrue(set(sample) <= set(self.pool.movie_ids))
+
+    def test_same_seed_gives_same_sample(self):
+        self.assertEqual(self.pool.sample(6, random.Random('7:1')), self.pool.sample(6, random.Random('7:1')))
+
+    def test_weighted_sampling_prefers_heavier_movies(self):
+        rng = random.Random(0)
+        drawn = [movie_id for _ in range(200) for movie_id in self.pool.sample(6, rng)]
+        # 收藏人数越多权重越大，后一半电影被抽中的次数明显更多
+        self.assertGreater(sum(movie_id > 100 for movie_id in drawn), sum(movie_id <= 100 for movie_id in drawn))
+
+    def test_small_or_unweighted_pool(self):
+        pool = FeaturedPool([(1, None, 0), (2, None, 0), (3, 8.0, 0)])
+        self.assertEqual(sorted(pool.sample(6, random.Random(0))), [1, 2, 3])
+        self.assertEqual(len(set(pool.sample(2, random.Random(0)))), 2)
+        self.assertEqual(FeaturedPool([]).sample(6, random.Random(0)), [])
+
+
+class GenreRankKeyTests(SimpleTestCase):
+
+    def test_matches_rating_then_collect_count_order(self):
+        movies = [(1, None, 500), (2, 8.5, 10), (3, 9.0, 5), (4, 8.5, 20), (5, 8.5, 20), (6, None, 900)]
+        ranked = sorted(movies, key=lambda movie: _rank_key(movie[1], movie[2], movie[0]), reverse=True)
+        # 评分降序，没有评分的排在最后，再按收藏数降序，同分时电影ID小的在前
+        self.assertEqual([movie_id for movie_id, _, _ in ranked], [3, 4, 5, 2, 6, 1])
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class HomeCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_fresh_section_is_loaded_once(self):
+        loader = mock.Mock(return_value=[1, 2, 3])
+        self.assertEqual(get_home_section('popular', loader), [1, 2, 3])
+        self.assertEqual(get_home_section('popular', loader), [1, 2, 3])
+        loader.assert_called_once_with()
+
+    def test_expired_section_is_refreshed_by_lock_holder(self):
+        get_home_section('popular', lambda: 'old')
+        expired = time.time() + home_cache.SECTION_TTLS['popular'] + 1
+        with mock.patch('time.time', return_value=expired):
+            # 其他请求持有刷新锁时继续返回旧值
+            cache.add(f"{home_cache._section_key('popular')}:lock", 1)
+            self.assertEqual(get_home_section('popular', lambda: 'new'), 'old')
+            cache.delete(f"{home_cache._section_key('popular')}:lock")
+            self.assertEqual(get_home_section('popular', lambda: 'new'), 'new')
+
+    def test_loader_errors_are_not_cached(self):
+        failing = mock.Mock(side_effect=RuntimeError('db down'))
+        with self.assertRaises(RuntimeError):
+            get_home_section('latest', failing)
+
+        get_home_section('latest', lambda: 'old')
+        expired = time.time() + home_cache.SECTION_TTLS['latest'] + 1
+        with mock.patch('time.time', return_value=expired):
+            self.assertEqual(get_home_section('latest', failing), 'old')
+        self.assertEqual(failing.call_count, 2)
+
+    def test_user_sections(self):
+        with self.assertRaises(ValueError):
+            get_home_section('personal', list)
+        get_home_section('personal', lambda: ['a'], user_id=1)
+        get_home_section('personal', lambda: ['b'], user_id=2)
+        invalidate_user_sections(1)
+        self.assertEqual(get_home_section('personal', lambda: ['c'], user_id=1), ['c'])
+        self.assertEqual(get_home_section('personal', lambda: ['c'], user_id=2), ['b'])
@@ -5,8 +5,13 @@ from django.contrib.auth.decorators import login_required
 from django.views.decorators.http import require_POST
 from django.views.decorators.cache import cache_page
 import json
-from .models import Movie, Genre, MovieImageCache, CollectMovieDB, CollectMovieTypeDB, CollectTop250MovieDB, MoviePubdateDB, MovieRatingDB, MovieTagDB
-from users.models import UserRating
+from .models import Movie, Genre, MovieImageCache, CollectMovieDB, CollectMovieTypeDB, CollectTop250MovieDB, MoviePubdateDB, MovieRatingDB, MovieTagDB, MovieGenreLink
+from users.models import UserRating, UserFavorite
+from recommender.recommendation_store import precomputed_recommendations, neighbor_recommendations
+from .cards import get_movie_cards
+from .home_cache import get_home_section, invalidate_user_sections
+from .featured_pool import sample_featured_ids
+from .genre_index import genre_top_movie_ids
 from django.core.paginator import Paginator
 from django.db import connection
 from datetime import datetime, timedelta
@@ -211,6 +216,75 @@ def home(request):
             'error_code': 'GENERAL_ERROR'
         })
 
+# 首页每个类型分区缓存的候选电影数，登录用户去掉已评分的电影后取前 HOME_SECTION_SIZE 部
+HOME_SECTION_SIZE = 6
+HOME_GENRE_CANDIDATES = 18
+
+def _query_home_movies(sql, params=None):
+    """执行首页分区的查询并转换为电影卡片数据"""
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return _movie_cards(dictfetchall(cursor))
+
+def _featured_movies(pool_name, seed=None):
+    """从精选候选池中抽样，返回电影卡片数据；还没有生成电影卡片时返回空列表"""
+    movie_ids = sample_featured_ids(pool_name, seed=seed)
+    return _movie_cards([{'movie_id': movie_id} for movie_id in movie_ids])
+
+def _load_home_genres():
+    """首页的类型分区: 电影数最多的5个类型及其评分最高的候选电影"""
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            SELECT movie_type as name, COUNT(*) as movie_count
+            FROM movie_collectmovietypedb
+            GROUP BY movie_type
+            ORDER BY movie_count DESC
+            LIMIT 5
+        """)
+        
+        genres = dictfetchall(cursor)
+        
+    # 过滤掉空的genre条目
+    genres = [genre for genre in genres if genre.get('name')]
+    
+    # 从类型榜单一次取出所有类型的候选电影
+    toplists = genre_top_movie_ids([genre['name'] for genre in genres], HOME_GENRE_CANDIDATES)
+    movie_ids = list(dict.fromkeys(movie_id for movie_ids in toplists.values() for movie_id in movie_ids))
+    movies = {movie['movie_id']: movie for movie in _movie_cards([{'movie_id': movie_id} for movie_id in movie_ids])}
+    
+    # 为每个类型添加推荐电影，任一类型查询出错时整个分区不缓存
+    for genre in genres:
+        if toplists[genre['name']]:
+            genre['recommended_movies'] = [movies[movie_id] for movie_id in toplists[genre['name']] if movie_id in movies]
+            continue
+        
+        # 还没有生成类型榜单时通过类型对应表查询
+        genre['recommended_movies'] = _query_home_movies("""
+            SELECT m.movie_id, m.title, m.year, m.genres, 
+                   m.tags, m.images, IFNULL(mr.rating, 0) as avg_rating
+            FROM movie_genre_link gl
+            JOIN movies_genre g ON g.id = gl.genre_id
+            JOIN movie_collectmoviedb m ON m.movie_id = gl.movie_id
+            LEFT JOIN movie_movieratingdb mr ON m.movie_id = mr.movie_id_id
+            WHERE g.name = %s
+            ORDER BY mr.rating DESC, m.collect_count DESC
+            LIMIT %s
+        """, [genre['name'], HOME_GENRE_CANDIDATES])
+    
+    return genres
+
+def _home_genres(user_id=None):
+    """读取缓存的类型分区，登录用户去掉已评分的电影"""
+    genres = get_home_section('genres', _load_home_genres)
+    rated_ids = set()
+    if user_id is not None:
+        candidate_ids = {movie['movie_id'] for genre in genres for movie in genre['recommended_movies']}
+        rated_ids = set(UserRating.objects.filter(user_id=user_id, movie_id__in=candidate_ids).values_list('movie_id', flat=True))
+    for genre in genres:
+        movies = [movie for movie in genre['recommended_movies'] if movie['movie_id'] not in rated_ids]
+        genre['recommended_movies'] = movies[:HOME_SECTION_SIZE]
+    return genres
+
 def _home_view_for_authenticated_user(request):
     """已登录用户的首页视图"""
     # 用于存储所有要显示的电影
@@ -221,11 +295,14 @@ def _home_view_for_authenticated_user(request):
         'recently_rated_movies': [],
         'genres': []
     }
+    user_id = request.user.id
     
-    # 1. 获取精选电影
+    # 1. 获取精选电影，同一用户在候选池刷新前看到相同的精选
     try:
-        with connection.cursor() as cursor:
-            cursor.execute("""
+        context['featured_movies'] = _featured_movies('member', seed=user_id)
+        if not context['featured_movies']:
+            # 还没有生成电影卡片时退回原来的查询
+            context['featured_movies'] = get_home_section('featured', lambda: _query_home_movies("""
                 SELECT m.movie_id, m.title, m.original_title, m.year, m.genres, 
                        m.tags, m.images, IFNULL(mr.rating, 0) as avg_rating,
                        m.directors, m.actor, m.summary, m.countries
@@ -234,99 +311,49 @@ def _home_view_for_authenticated_user(request):
                 WHERE m.collect_count > 1000
                 ORDER BY RAND()
                 LIMIT 6
-            """)
-            featured_movies_data = dictfetchall(cursor)
-            
-            context['featured_movies'] = [_process_movie_data(movie) for movie in featured_movies_data]
+            """), variant='member')
     except Exception as e:
         logger.error(f"[首页] 获取精选电影时出错: {str(e)}")
     
     # 2. 个人推荐
     try:
-        context['personal_recommendations'] = _get_personalized_recommendations(request.user.id)
+        context['personal_recommendations'] = get_home_section(
+            'personal', lambda: _get_personalized_recommendations(user_id), user_id=user_id
+        )
     except Exception as e:
         logger.error(f"[首页] 获取个人推荐时出错: {str(e)}")
         
     # 3. 热门电影
     try:
-        with connection.cursor() as cursor:
-            cursor.execute("""
-                SELECT m.movie_id, m.title, m.year, m.genres, 
-                       m.tags, m.images, IFNULL(mr.rating, 0) as avg_rating
-                FROM movie_collectmoviedb m
-                LEFT JOIN movie_movieratingdb mr ON m.movie_id = mr.movie_id_id
-                ORDER BY m.collect_count DESC
-                LIMIT 6
-            """)
-            popular_movies = dictfetchall(cursor)
-            context['popular_movies'] = [_process_movie_data(movie) for movie in popular_movies]
+        context['popular_movies'] = get_home_section('popular', lambda: _query_home_movies("""
+            SELECT m.movie_id, m.title, m.year, m.genres, 
+                   m.tags, m.images, IFNULL(mr.rating, 0) as avg_rating
+            FROM movie_collectmoviedb m
+            LEFT JOIN movie_movieratingdb mr ON m.movie_id = mr.movie_id_id
+            ORDER BY m.collect_count DESC
+            LIMIT 6
+        """), variant='member')
     except Exception as e:
         logger.error(f"[首页] 获取热门电影推荐时出错: {str(e)}")
     
     # 4. 最近评分的电影
     try:
-        with connection.cursor() as cursor:
-            cursor.execute("""
-                SELECT m.movie_id, m.title, m.year, m.genres, 
-                       m.tags, m.images, IFNULL(mr.rating, 0) as avg_rating
-                FROM users_userrating ur
-                JOIN movie_collectmoviedb m ON ur.movie_id = m.movie_id
-                LEFT JOIN movie_movieratingdb mr ON m.movie_id = mr.movie_id_id
-                WHERE ur.user_id = %s
-                ORDER BY ur.updated_time DESC
-                LIMIT 6
-            """, [request.user.id])
-            
-            recent_movies = dictfetchall(cursor)
-            context['recently_rated_movies'] = [_process_movie_data(movie) for movie in recent_movies]
+        context['recently_rated_movies'] = get_home_section('recently_rated', lambda: _query_home_movies("""
+            SELECT m.movie_id, m.title, m.year, m.genres, 
+                   m.tags, m.images, IFNULL(mr.rating, 0) as avg_rating
+            FROM users_userrating ur
+            JOIN movie_collectmoviedb m ON ur.movie_id = m.movie_id
+            LEFT JOIN movie_movieratingdb mr ON m.movie_id = mr.movie_id_id
+            WHERE ur.user_id = %s
+            ORDER BY ur.updated_time DESC
+            LIMIT 6
+        """, [user_id]), user_id=user_id)
     except Exception as e:
         logger.error(f"[首页] 获取用户最近评分电影时出错: {str(e)}")
         
     # 5. 电影类型分类
     try:
-        with connection.cursor() as cursor:
-            cursor.execute("""
-                SELECT movie_type as name, COUNT(*) as movie_count
-                FROM movie_collectmovietypedb
-                GROUP BY movie_type
-                ORDER BY movie_count DESC
-                LIMIT 5
-            """)
-            
-            genres = dictfetchall(cursor)
-            
-            # 过滤掉空的genre条目
-            genres = [genre for genre in genres if genre.get('name')]
-            
-            # 为每个类型添加推荐电影
-            for genre in genres:
-                try:
-                    genre_name = genre['name']
-                    if not genre_name:
-                        continue
-                    
-                    # 获取该类型的推荐电影
-                    with connection.cursor() as genre_cursor:
-                        genre_cursor.execute("""
-                            SELECT m.movie_id, m.title, m.year, m.genres, 
-                                   m.tags, m.images, IFNULL(mr.rating, 0) as avg_rating
-                            FROM movie_collectmoviedb m
-                            LEFT JOIN movie_movieratingdb mr ON m.movie_id = mr.movie_id_id
-                            WHERE m.genres LIKE %s
-                            AND m.movie_id NOT IN (
-                                SELECT movie_id FROM users_userrating WHERE user_id = %s
-                            )
-                            ORDER BY mr.rating DESC, m.collect_count DESC
-                            LIMIT 6
-                        """, [f'%{genre_name}%', request.user.id])
-                        
-                        genre_movies = dictfetchall(genre_cursor)
-                        genre['recommended_movies'] = [_process_movie_data(movie) for movie in genre_movies]
-                except Exception as e:
-                    logger.error(f"[首页] 获取类型 '{genre_name}' 推荐电影时出错: {str(e)}")
-                    genre['recommended_movies'] = []
-            
-            context['genres'] = genres
+        context['genres'] = _home_genres(user_id)
     except Exception as e:
         logger.error(f"[首页] 获取电影类型时出错: {str(e)}")
     
@@ -344,8 +371,10 @@ def _home_view_for_guest(request):
     
     # 1. 精选电影
     try:
-        with connection.cursor() as cursor:
-            cursor.execute("""
+        context['featured_movies'] = _featured_movies('guest')
+        if not context['featured_movies']:
+            # 还没有生成电影卡片时退回原来的查询
+            context['featured_movies'] = get_home_section('featured', lambda: _query_home_movies("""
                 SELECT m.movie_id, m.title, m.original_title, m.year, m.genres, 
                        m.tags, m.images, IFNULL(mr.rating, 0) as avg_rating,
                        m.directors, m.actor, m.summary, m.countries
@@ -355,105 +384,55 @@ def _home_view_for_guest(request):
                    OR m.collect_count > 10000
                 ORDER BY RAND()
                 LIMIT 6
-            """)
-            featured_movies = dictfetchall(cursor)
-            context['featured_movies'] = [_process_movie_data(movie) for movie in featured_movies]
+            """), variant='guest')
     except Exception as e:
         logger.error(f"[首页] 获取精选电影时出错: {str(e)}")
     
     # 2. 高分电影
     try:
-        with connection.cursor() as cursor:
-            cursor.execute("""
-                SELECT m.movie_id, m.title, m.year, m.genres, 
-                       m.tags, m.images, IFNULL(mr.rating, 0) as avg_rating
-                FROM movie_collectmoviedb m
-                LEFT JOIN movie_movieratingdb mr ON m.movie_id = mr.movie_id_id
-                WHERE mr.rating >= 8 OR m.rating LIKE '%"average": 8%'
-                ORDER BY mr.rating DESC, m.collect_count DESC
-                LIMIT 6
-            """)
-            top_rated_movies = dictfetchall(cursor)
-            context['top_rated_movies'] = [_process_movie_data(movie) for movie in top_rated_movies]
+        context['top_rated_movies'] = get_home_section('top_rated', lambda: _query_home_movies("""
+            SELECT m.movie_id, m.title, m.year, m.genres, 
+                   m.tags, m.images, IFNULL(mr.rating, 0) as avg_rating
+            FROM movie_collectmoviedb m
+            LEFT JOIN movie_movieratingdb mr ON m.movie_id = mr.movie_id_id
+            WHERE mr.rating >= 8 OR m.rating LIKE '%"average": 8%'
+            ORDER BY mr.rating DESC, m.collect_count DESC
+            LIMIT 6
+        """))
     except Exception as e:
         logger.error(f"[首页] 获取高分电影时出错: {str(e)}")
         
     # 3. 热门电影
     try:
-        with connection.cursor() as cursor:
-            cursor.execute("""
-                SELECT m.movie_id, m.title, m.year, m.genres, 
-                       m.tags, m.images, IFNULL(mr.rating, 0) as avg_rating
-                FROM movie_collectmoviedb m
-                LEFT JOIN movie_movieratingdb mr ON m.movie_id = mr.movie_id_id
-                WHERE m.collect_count > 1000
-                ORDER BY m.collect_count DESC
-                LIMIT 6
-            """)
-            popular_movies = dictfetchall(cursor)
-            context['popular_movies'] = [_process_movie_data(movie) for movie in popular_movies]
+        context['popular_movies'] = get_home_section('popular', lambda: _query_home_movies("""
+            SELECT m.movie_id, m.title, m.year, m.genres, 
+                   m.tags, m.images, IFNULL(mr.rating, 0) as avg_rating
+            FROM movie_collectmoviedb m
+            LEFT JOIN movie_movieratingdb mr ON m.movie_id = mr.movie_id_id
+            WHERE m.collect_count > 1000
+            ORDER BY m.collect_count DESC
+            LIMIT 6
+        """), variant='guest')
     except Exception as e:
         logger.error(f"[首页] 获取热门电影推荐时出错: {str(e)}")
     
     # 4. 最新上映
     try:
-        with connection.cursor() as cursor:
-            cursor.execute("""
-                SELECT m.movie_id, m.title, m.year, m.genres, 
-                       m.tags, m.images, IFNULL(mr.rating, 0) as avg_rating
-                FROM movie_collectmoviedb m
-                LEFT JOIN movie_movieratingdb mr ON m.movie_id = mr.movie_id_id
-                WHERE m.year >= 2020
-                ORDER BY m.year DESC, m.pubdate DESC
-                LIMIT 6
-            """)
-            latest_movies = dictfetchall(cursor)
-            context['latest_movies'] = [_process_movie_data(movie) for movie in latest_movies]
+        context['latest_movies'] = get_home_section('latest', lambda: _query_home_movies("""
+            SELECT m.movie_id, m.title, m.year, m.genres, 
+                   m.tags, m.images, IFNULL(mr.rating, 0) as avg_rating
+            FROM movie_collectmoviedb m
+            LEFT JOIN movie_movieratingdb mr ON m.movie_id = mr.movie_id_id
+            WHERE m.year >= 2020
+            ORDER BY m.year DESC, m.pubdate DESC
+            LIMIT 6
+        """))
     except Exception as e:
         logger.error(f"[首页] 获取最新电影时出错: {str(e)}")
     
     # 5. 电影类型分类
     try:
-        with connection.cursor() as cursor:
-            cursor.execute("""
-                SELECT movie_type as name, COUNT(*) as movie_count
-                FROM movie_collectmovietypedb
-                GROUP BY movie_type
-                ORDER BY movie_count DESC
-                LIMIT 5
-            """)
-            
-            genres = dictfetchall(cursor)
-            
-            # 过滤掉空的genre条目
-            genres = [genre for genre in genres if genre.get('name')]
-            
-            # 为每个类型添加推荐电影
-            for genre in genres:
-                try:
-                    genre_name = genre['name']
-                    if not genre_name:
-                        continue
-                    
-                    # 获取该类型的推荐电影
-                    with connection.cursor() as genre_cursor:
-                        genre_cursor.execute("""
-                            SELECT m.movie_id, m.title, m.year, m.genres, 
-                                   m.tags, m.images, IFNULL(mr.rating, 0) as avg_rating
-                            FROM movie_collectmoviedb m
-                            LEFT JOIN movie_movieratingdb mr ON m.movie_id = mr.movie_id_id
-                            WHERE m.genres LIKE %s
-                            ORDER BY mr.rating DESC, m.collect_count DESC
-                            LIMIT 6
-                        """, [f'%{genre_name}%'])
-                        
-                        genre_movies = dictfetchall(genre_cursor)
-                        genre['recommended_movies'] = [_process_movie_data(movie) for movie in genre_movies]
-                except Exception as e:
-                    logger.error(f"[首页] 获取类型 '{genre_name}' 推荐电影时出错: {str(e)}")
-                    genre['recommended_movies'] = []
-            
-            context['genres'] = genres
+        context['genres'] = _home_genres()
     except Exception as e:
         logger.error(f"[首页] 获取电影类型时出错: {str(e)}")
     
@@ -735,6 +714,33 @@ def _process_movie_data(movie):
     
     return processed_movie
 
+def _movie_cards(movies):
+    """
+    把查询结果转换为电影卡片数据，优先使用预先生成的电影卡片(见 movies/cards.py)，
+    还没有卡片的电影仍由 _process_movie_data 现场解析
+    """
+    cards = get_movie_cards([movie['movie_id'] for movie in movies if movie.get('movie_id')])
+    processed_movies = []
+    for movie in movies:
+        card = cards.get(movie.get('movie_id'))
+        if card is None:
+            processed_movies.append(_process_movie_data(movie))
+            continue
+        
+        processed_movie = dict(movie)
+        processed_movie.update(card)
+        # 卡片在进程间共享，列表复制一份再交给调用方
+        for key in ('genres', 'tags', 'directors', 'actor'):
+            processed_movie[key] = list(card[key])
+        # 与 _process_movie_data 相同，没有豆瓣评分时使用本站评分
+        if not processed_movie['rating'] and movie.get('avg_rating'):
+            try:
+                processed_movie['rating'] = float(movie['avg_rating'])
+            except (ValueError, TypeError):
+                pass
+        processed_movies.append(processed_movie)
+    return processed_movies
+
 # @cache_page(60 * 10)  # 缓存10分钟
 def movie_list(request):
     """
@@ -813,7 +819,15 @@ def movie_list(request):
         movies = dictfetchall(cursor)
     
     # 处理电影数据
+    cards = get_movie_cards([movie['movie_id'] for movie in movies])
     for movie in movies:
+        # 有电影卡片时直接使用预先解析好的封面和类型
+        card = cards.get(movie['movie_id'])
+        if card:
+            movie['cover_image'] = card['cover_image']
+            movie['genres'] = list(card['genres'])
+            continue
+        
         # 解析电影封面图片
         movie['cover_image'] = None
         image_data = parse_image_data(movie.get('raw_images', '{}'), movie_id=movie.get('movie_id'), title=movie.get('title'))
@@ -858,28 +872,35 @@ def movie_list(request):
 def movie_list_by_genre(request, genre_name):
     """按类型显示电影列表"""
     with connection.cursor() as cursor:
-        # 使用movie_movietagdb表通过tag_name查询相关电影
+        # 通过类型对应表查询相关电影
         cursor.execute("""
             SELECT m.*, 
                    m.genres as raw_genres,
-                   GROUP_CONCAT(DISTINCT mt.tag_name) as tags,
                    mr.rating as avg_rating,
                    m.images as raw_images
-            FROM movie_collectmoviedb m
-            INNER JOIN movie_movietagdb mt ON m.movie_id = mt.movie_id_id
+            FROM movie_genre_link gl
+            JOIN movies_genre g ON g.id = gl.genre_id
+            JOIN movie_collectmoviedb m ON m.movie_id = gl.movie_id
             LEFT JOIN movie_movieratingdb mr ON m.movie_id = mr.movie_id_id
-            WHERE mt.tag_name = %s AND mt.tag_type = 'genre'
-            GROUP BY m.id
+            WHERE g.name = %s
             ORDER BY mr.rating DESC, m.collect_count DESC
         """, [genre_name])
         genre_movies = dictfetchall(cursor)
         logger.info(f"[类型电影] Genre {genre_name} movies count: {len(genre_movies)}")
         
         # 处理电影数据
+        cards = get_movie_cards([movie['movie_id'] for movie in genre_movies])
         for movie in genre_movies:
             # 解析评分
             movie['rating'] = float(movie.get('avg_rating', 0) or 0)
             
+            # 有电影卡片时直接使用预先解析好的封面和类型
+            card = cards.get(movie['movie_id'])
+            if card:
+                movie['cover_image'] = card['cover_image']
+                movie['genres'] = list(card['genres'])
+                continue
+            
             # 处理图片URL
             try:
                 images = parse_image_data(movie.get('raw_images', '{}'), movie_id=movie.get('movie_id'), title=movie.get('title'))
@@ -927,12 +948,13 @@ def movie_list_by_genre(request, genre_name):
                 movie['genres'] = [movie['genres']]
         
         # 获取所有电影类型 - 合并两个来源的数据
-        # 首先从movie_movietagdb获取带有计数的类型
+        # 首先从类型对应表获取带有计数的类型
         cursor.execute("""
-            SELECT DISTINCT tag_name as name, tag_name as id, COUNT(*) as count
-            FROM movie_movietagdb
-            WHERE tag_name != '' AND tag_type = 'genre'
-            GROUP BY tag_name
+            SELECT g.name as name, g.name as id, COUNT(*) as count
+            FROM movie_genre_link gl
+            JOIN movies_genre g ON g.id = gl.genre_id
+            WHERE g.name != ''
+            GROUP BY g.id, g.name
             ORDER BY count DESC
         """)
         genres_from_tags = dictfetchall(cursor)
@@ -1085,15 +1107,9 @@ def movie_detail(request, movie_id):
                 # 限制最多使用3个类型，避免查询过于复杂
                 genres = genres[:3]
                 
-                # 为每个类型创建一个条件
-                conditions = []
-                params = []
-                
-                for genre in genres:
-                    conditions.append("m.genres LIKE %s")
-                    params.append(f'%{genre}%')
+                placeholders = ', '.join(['%s'] * len(genres))
                 
-                # 构建SQL查询，减少连接和聚合操作
+                # 通过类型对应表查询同类型的电影
                 try:
                     with connection.cursor() as cursor:
                         cursor.execute(f"""
@@ -1102,14 +1118,19 @@ def movie_detail(request, movie_id):
                                 m.tags, m.images, IFNULL(mr.rating, 0) as avg_rating
                             FROM movie_collectmoviedb m
                             LEFT JOIN movie_movieratingdb mr ON m.movie_id = mr.movie_id_id
-                            WHERE ({' OR '.join(conditions)})
+                            WHERE m.movie_id IN (
+                                SELECT gl.movie_id
+                                FROM movie_genre_link gl
+                                JOIN movies_genre g ON g.id = gl.genre_id
+                                WHERE g.name IN ({placeholders})
+                            )
                             AND m.movie_id != %s
                             ORDER BY mr.rating DESC, m.collect_count DESC
                             LIMIT 6
-                        """, params + [movie_id])
+                        """, list(genres) + [movie_id])
                         
                         similar_results = dictfetchall(cursor)
-                        similar_movies = [_process_movie_data(similar) for similar in similar_results]
+                        similar_movies = _movie_cards(similar_results)
                 except Exception as e:
                     logger.error(f"[电影详情] 获取相似电影时出错: {str(e)}")
             
@@ -1179,10 +1200,17 @@ def search_movies(request):
             logger.info(f"搜索 '{query}' 找到 {len(movies)} 条结果")
             
             # 处理电影数据
+            cards = get_movie_cards([movie['movie_id'] for movie in movies])
             for movie in movies:
                 # 解析评分
                 movie['rating'] = float(movie.get('avg_rating', 0) or 0)
                 
+                # 有电影卡片时直接使用预先解析好的封面
+                card = cards.get(movie['movie_id'])
+                if card:
+                    movie['cover_image'] = card['cover_image']
+                    continue
+                
                 # 处理图片URL
                 try:
                     images = parse_image_data(movie.get('raw_images', '{}'), movie_id=movie.get('movie_id'), title=movie.get('title'))
@@ -1281,6 +1309,9 @@ def rate_movie(request, movie_id):
                 # 恢复外键检查
                 cursor.execute("SET FOREIGN_KEY_CHECKS = 1")
         
+        # 首页的最近评分和个人推荐需要重新查询
+        invalidate_user_sections(request.user.id)
+        
         return JsonResponse({'success': True})
     except json.JSONDecodeError as e:
         print(f"JSON decode error: {e}")
@@ -1349,6 +1380,9 @@ def comment_movie(request, movie_id):
                 # 恢复外键检查
                 cursor.execute("SET FOREIGN_KEY_CHECKS = 1")
         
+        # 首页的最近评分和个人推荐需要重新查询
+        invalidate_user_sections(request.user.id)
+        
         return JsonResponse({'success': True})
     except json.JSONDecodeError as e:
         print(f"JSON decode error for comment: {e}")
@@ -1710,15 +1744,32 @@ def process_image(image, width=None, height=None, quality=85, img_format='JPEG')
         logger.error(f"[图片代理] 处理图片失败: {str(e)}")
         return image
 
+def _collect_movies_by_ids(movie_ids):
+    """按给定顺序读取电影数据，movie_collectmoviedb 中不存在的电影被跳过"""
+    if not movie_ids:
+        return []
+    placeholders = ', '.join(['%s'] * len(movie_ids))
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+            SELECT m.movie_id, m.title, m.year, m.genres, 
+                   m.tags, m.images, m.directors, m.actor,
+                   IFNULL(mr.rating, 0) as avg_rating
+            FROM movie_collectmoviedb m
+            LEFT JOIN movie_movieratingdb mr ON m.movie_id = mr.movie_id_id
+            WHERE m.movie_id IN ({placeholders})
+        """, list(movie_ids))
+        rows = {row['movie_id']: row for row in dictfetchall(cursor)}
+    return [rows[movie_id] for movie_id in movie_ids if movie_id in rows]
+
 def _get_personalized_recommendations(user_id, limit=6):
     """
     获取用户的个性化电影推荐
     
-    使用基于内容的推荐方法，结合以下因素：
-    - 类型相似度 (权重: 0.4)
-    - 导演相似度 (权重: 0.1)
-    - 演员相似度 (权重: 0.1)
-    - 标签相似度 (权重: 0.4)
+    依次使用：
+    1. 离线预计算的推荐 (recommender_userrecommendation，按用户ID和名次读取)
+    2. 用户最近喜欢的电影在共现表和相似度表中的近邻，剧情片的相似度降低权重
+    3. 用户喜欢的类型中的高评分电影
+    4. 热门电影
     
     参数:
         user_id: 用户ID
@@ -1727,33 +1778,29 @@ def _get_personalized_recommendations(user_id, limit=6):
     返回:
         处理过的电影数据列表
     """
-    recommendations = []
-    
     try:
-        # 1. 获取用户评分过和收藏的电影
-        with connection.cursor() as cursor:
-            cursor.execute("""
-                SELECT 
-                    COALESCE(r.movie_id, f.movie_id) as movie_id,
-                    COALESCE(r.rating, 7.0) as rating  -- 收藏但未评分的电影默认给7分权重
-                FROM (
-                    SELECT movie_id, rating
-                    FROM users_userrating
-                    WHERE user_id = %s
-                    UNION
-                    SELECT movie_id, 7.0 as rating
-                    FROM users_userfavorite
-                    WHERE user_id = %s
-                ) as combined_data
-                LEFT JOIN users_userrating r ON combined_data.movie_id = r.movie_id AND r.user_id = %s
-                LEFT JOIN users_userfavorite f ON combined_data.movie_id = f.movie_id AND f.user_id = %s
-                ORDER BY rating DESC
-                LIMIT 10
-            """, [user_id, user_id, user_id, user_id])
-            
-            rated_movies = dictfetchall(cursor)
-            
-        if not rated_movies:
+        # 1. 离线预计算的推荐
+        precomputed = precomputed_recommendations(user_id, limit * 2)
+        if precomputed:
+            movies = _collect_movies_by_ids([movie_id for movie_id, _, _ in precomputed])
+            if movies:
+                return _movie_cards(movies[:limit])
+        
+        # 2. 还没有预计算结果时，只按电影ID查询近邻
+        neighbors = neighbor_recommendations(user_id, limit=20)
+        if neighbors:
+            scores = {movie_id: score for movie_id, score, _ in neighbors}
+            similar_movies = _collect_movies_by_ids([movie_id for movie_id, _, _ in neighbors])
+            for movie in similar_movies:
+                movie['similarity'] = scores[movie['movie_id']]
+                # 降低剧情片的相似度权重
+                movie['adjusted_similarity'] = movie['similarity'] * 0.7 if '剧情' in (movie['genres'] or '') else movie['similarity']
+            similar_movies.sort(key=lambda movie: movie['adjusted_similarity'], reverse=True)
+            if similar_movies:
+                return _movie_cards(similar_movies[:limit])
+        
+        if not neighbors and not UserRating.objects.filter(user_id=user_id).exists() \
+                and not UserFavorite.objects.filter(user_id=user_id).exists():
             # 如果用户没有评分过或收藏电影，返回热门电影
             with connection.cursor() as cursor:
                 cursor.execute("""
@@ -1766,105 +1813,31 @@ def _get_personalized_recommendations(user_id, limit=6):
                 """, [limit])
                 
                 popular_movies = dictfetchall(cursor)
-                return [_process_movie_data(movie) for movie in popular_movies]
+                return _movie_cards(popular_movies)
         
-        # 2. 使用相似度计算从推荐系统中获取推荐电影
-        # 获取用户已评分和收藏电影的ID列表
-        rated_movie_ids = [movie['movie_id'] for movie in rated_movies]
-        rated_movie_ids_str = ','.join([str(id) for id in rated_movie_ids])
+        # 3. 如果没有找到相似电影或没有相似度数据，基于用户喜欢的类型推荐
+        # 用户评分最高的5部电影(评分 >= 7)和最近收藏的5部电影
+        liked_ids = list(UserRating.objects.filter(user_id=user_id, rating__gte=7)
+                         .order_by('-rating').values_list('movie_id', flat=True)[:5])
+        liked_ids += list(UserFavorite.objects.filter(user_id=user_id)
+                          .order_by('-created_time').values_list('movie_id', flat=True)[:5])
         
-        if rated_movie_ids:
-            # 查询与已评分/收藏电影相似的电影，排除剧情片的权重
+        # 通过类型对应表获取这些电影的类型
+        user_genre_ids = list(MovieGenreLink.objects.filter(movie_id__in=liked_ids)
+                              .values_list('genre_id', flat=True).distinct())
+        
+        if user_genre_ids:
+            placeholders = ', '.join(['%s'] * len(user_genre_ids))
             with connection.cursor() as cursor:
+                # 查询符合用户喜好类型的电影，降低剧情类型的权重
                 cursor.execute(f"""
-                    SELECT 
-                        m.movie_id, m.title, m.year, m.genres, 
-                        m.tags, m.images, m.directors, m.actor,
-                        IFNULL(mr.rating, 0) as avg_rating,
-                        ms.similarity,
-                        CASE 
-                            WHEN m.genres LIKE '%剧情%' THEN ms.similarity * 0.7  -- 降低剧情片的相似度权重
-                            ELSE ms.similarity
-                        END as adjusted_similarity
-                    FROM movie_collectmoviedb m
-                    LEFT JOIN movie_movieratingdb mr ON m.movie_id = mr.movie_id_id
-                    LEFT JOIN recommender_moviesimilarity ms ON 
-                        (ms.movie1_id = m.movie_id AND ms.movie2_id IN ({rated_movie_ids_str})) OR 
-                        (ms.movie2_id = m.movie_id AND ms.movie1_id IN ({rated_movie_ids_str}))
-                    WHERE m.movie_id NOT IN ({rated_movie_ids_str}) 
-                    GROUP BY m.movie_id
-                    ORDER BY adjusted_similarity DESC, m.collect_count DESC
-                    LIMIT 20
-                """)
-                
-                similar_movies = dictfetchall(cursor)
-                
-                # 如果找到相似电影，处理并返回
-                if similar_movies:
-                    # 对电影进行处理并按相似度排序
-                    processed_movies = [_process_movie_data(movie) for movie in similar_movies]
-                    
-                    # 返回前limit个电影
-                    return processed_movies[:limit]
-        
-        # 3. 如果没有找到相似电影或没有相似度数据，基于用户喜欢的类型推荐
-        with connection.cursor() as cursor:
-            # 获取用户喜欢的电影类型，降低剧情类型的权重
-            cursor.execute("""
-                WITH user_genres AS (
-                    SELECT DISTINCT m.genres
-                    FROM movie_collectmoviedb m
-                    LEFT JOIN users_userrating ur ON m.movie_id = ur.movie_id
-                    LEFT JOIN users_userfavorite uf ON m.movie_id = uf.movie_id
-                    WHERE (ur.user_id = %s AND ur.rating >= 7)
-                       OR uf.user_id = %s
-                    ORDER BY ur.rating DESC
-                    LIMIT 5
-                )
-                SELECT genres
-                FROM user_genres
-                WHERE genres NOT LIKE '%剧情%'
-                UNION ALL
-                SELECT genres
-                FROM user_genres
-                WHERE genres LIKE '%剧情%'
-                LIMIT 5
-            """, [user_id, user_id])
-            
-            user_genres_data = dictfetchall(cursor)
-            
-            # 解析类型数据
-            user_genres = set()
-            for genre_data in user_genres_data:
-                try:
-                    if genre_data['genres']:
-                        genres_list = ast.literal_eval(genre_data['genres'])
-                        user_genres.update(genres_list)
-                except Exception as e:
-                    logger.error(f"解析类型数据出错: {str(e)}")
-            
-            if user_genres:
-                # 构建类型查询条件，降低剧情类型的权重
-                genre_conditions = []
-                genre_params = []
-                
-                for genre in user_genres:
-                    if genre != '剧情':  # 对非剧情类型使用正常权重
-                        genre_conditions.append("m.genres LIKE %s")
-                        genre_params.append(f"%{genre}%")
-                    else:  # 对剧情类型使用较低权重
-                        genre_conditions.append("(m.genres LIKE %s AND m.genres NOT REGEXP '^剧情$')")
-                        genre_params.append(f"%{genre}%")
-                
-                genre_query = " OR ".join(genre_conditions)
-                
-                # 查询符合用户喜好类型的电影
-                query = f"""
                     SELECT m.movie_id, m.title, m.year, m.genres, 
                            m.tags, m.images, IFNULL(mr.rating, 0) as avg_rating
                     FROM movie_collectmoviedb m
                     LEFT JOIN movie_movieratingdb mr ON m.movie_id = mr.movie_id_id
-                    WHERE ({genre_query})
+                    WHERE m.movie_id IN (
+                        SELECT movie_id FROM movie_genre_link WHERE genre_id IN ({placeholders})
+                    )
                     AND m.movie_id NOT IN (
                         SELECT movie_id FROM users_userrating WHERE user_id = %s
                         UNION
@@ -1872,22 +1845,22 @@ def _get_personalized_recommendations(user_id, limit=6):
                     )
                     ORDER BY 
                         CASE 
-                            WHEN m.genres LIKE '%剧情%' THEN mr.rating * 0.7
+                            WHEN EXISTS (
+                                SELECT 1
+                                FROM movie_genre_link dl
+                                JOIN movies_genre dg ON dg.id = dl.genre_id
+                                WHERE dl.movie_id = m.movie_id AND dg.name = '剧情'
+                            ) THEN mr.rating * 0.7
                             ELSE mr.rating 
                         END DESC,
                         m.collect_count DESC
                     LIMIT %s
-                """
-                
-                # 添加参数
-                query_params = genre_params + [user_id, user_id, limit]
+                """, user_genre_ids + [user_id, user_id, limit])
                 
-                # 执行查询
-                cursor.execute(query, query_params)
                 genre_based_movies = dictfetchall(cursor)
                 
                 if genre_based_movies:
-                    return [_process_movie_data(movie) for movie in genre_based_movies]
+                    return _movie_cards(genre_based_movies)
     
     except Exception as e:
         logger.error(f"[推荐系统] 获取个性化推荐时出错: {str(e)}")
@@ -1905,7 +1878,7 @@ def _get_personalized_recommendations(user_id, limit=6):
             """, [limit])
             
             popular_movies = dictfetchall(cursor)
-            return [_process_movie_data(movie) for movie in popular_movies]
+            return _movie_cards(popular_movies)
     except Exception as e:
         logger.error(f"[推荐系统] 获取热门电影推荐时出错: {str(e)}")
         return []
@@ -1928,7 +1901,7 @@ def _get_basic_recommendations(user_id, limit=6):
             """, [user_id, limit])
             
             recommended_movies = dictfetchall(cursor)
-            return [_process_movie_data(movie) for movie in recommended_movies]
+            return _movie_cards(recommended_movies)
     except Exception as e:
         logger.error(f"[个人推荐] 获取基础推荐电影时出错: {str(e)}")
         return []
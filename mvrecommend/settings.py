@@ -165,6 +165,27 @@ IMAGE_PROXY = {
     'USER_AGENT': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
 }
 
+# 推荐系统配置
+RECOMMENDER = {
+    'ARTIFACT_DIR': os.path.join(BASE_DIR, 'recommender_artifacts'),  # ALS因子等离线产物目录
+    'KEEP_VERSIONS': 3,  # 每类产物保留的历史版本数
+    'RELOAD_INTERVAL': 60,  # Web进程检查新版本的间隔（秒）
+    'ANN_TABLES': 8,  # 相似电影LSH索引的哈希表数量，越多召回率越高、查询越慢
+    'ANN_BITS': 16,  # 每张哈希表的超平面数量，越多每个桶越小
+    # 内容相似度各维度的权重，修改后运行 reblend_similarities 即可生效，不需要重新计算
+    'SIMILARITY_WEIGHTS': {'genres': 0.4, 'directors': 0.1, 'actors': 0.1, 'tags': 0.4},
+    # 本地隐式反馈ALS (update_similarities --method als --als-engine implicit)
+    'IMPLICIT_FACTORS': 64,  # 因子维度
+    'IMPLICIT_ITERATIONS': 15,  # 交替求解的轮数
+    'IMPLICIT_REGULARIZATION': 0.05,  # 正则化系数
+    'IMPLICIT_ALPHA': 10.0,  # 置信度 c = 1 + alpha·信号强度
+    # 信号强度: 评分按 rating/10、收藏为1、观看历史按 1 + log1p(观看分钟数)，再乘以各自的权重
+    'IMPLICIT_SIGNAL_WEIGHTS': {'rating': 1.0, 'favorite': 2.0, 'history': 0.5},
+    # 离线预计算的用户推荐 (refresh_user_recommendations)
+    'USER_RECOMMENDATION_TOP_N': 30,  # 每个用户保存的推荐数量
+    'ACTIVE_USER_DAYS': 90,  # 最近多少天内登录过或有交互的用户会被预计算
+}
+
 # 允许的图片域名
 ALLOWED_IMAGE_HOSTS = [
     'img1.doubanio.com',
@@ -0,0 +1,181 @@
+"""
+电影向量的近似最近邻(ANN)索引
+
+使用随机超平面LSH: 每张哈希表用 n_bits 个随机超平面把归一化并减去均值后的向量
+编码为一个整数桶号(ALS因子非负，不减均值时几乎所有向量都落在超平面同侧)，查询时取出各表中同桶(以及汉明距离为1的相邻桶)的
+电影作为候选，再对候选做精确的余弦相似度排序。桶号按表排序保存，
+用二分查找定位桶，索引文件可以直接内存映射。
+"""
+import json
+import logging
+import os
+import time
+import numpy as np
+
+logger = logging.getLogger('django')
+
+DEFAULT_TABLES = 8
+DEFAULT_BITS = 16
+
+
+def _normalize(vectors):
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class LSHIndex:
+    """随机超平面LSH索引，ids按升序保存"""
+
+    def __init__(self, ids, vectors, center, planes, keys, rows, meta=None):
+        self.ids = ids
+        self.vectors = vectors
+        self.center = center  # 归一化向量的均值，哈希前减去
+        self.planes = planes  # (n_tables, n_bits, dim)
+        self.keys = keys      # (n_tables, n) 每张表排序后的桶号
+        self.rows = rows      # (n_tables, n) 与keys对应的向量行号
+        self.meta = meta or {}
+        self._bit_weights = (1 << np.arange(planes.shape[1], dtype=np.int64))
+
+    @classmethod
+    def build(cls, ids, vectors, n_tables=DEFAULT_TABLES, n_bits=DEFAULT_BITS, seed=42):
+        """从ID和向量构建索引"""
+        ids = np.asarray(ids, dtype=np.int64)
+        order = np.argsort(ids, kind='stable')
+        ids = ids[order]
+        vectors = _normalize(np.asarray(vectors)[order])
+        dim = vectors.shape[1] if vectors.ndim == 2 else 0
+
+        rng = np.random.default_rng(seed)
+        planes = rng.standard_normal((n_tables, n_bits, dim)).astype(np.float32)
+        center = vectors.mean(axis=0) if len(vectors) else np.zeros(dim, dtype=np.float32)
+        index = cls(ids, vectors, center, planes, None, None, {'n_tables': n_tables, 'n_bits': n_bits, 'seed': seed})
+
+        codes = index._codes(vectors)  # (n_tables, n)
+        rows = np.argsort(codes, axis=1, kind='stable')
+        index.keys = np.take_along_axis(codes, rows, axis=1)
+        index.rows = rows.astype(np.int64)
+        return index
+
+    def _codes(self, vectors):
+        """计算向量在每张表中的桶号，返回 (n_tables, n)"""
+        bits = np.einsum('tbd,nd->tnb', self.planes, np.atleast_2d(vectors) - self.center) > 0
+        return bits.astype(np.int64) @ self._bit_weights
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, 'ids.npy'), self.ids)
+        np.save(os.path.join(path, 'vectors.npy'), self.vectors)
+        np.save(os.path.join(path, 'center.npy'), self.center)
+        np.save(os.path.join(path, 'planes.npy'), self.planes)
+        np.save(os.path.join(path, 'keys.npy'), self.keys)
+        np.save(os.path.join(path, 'rows.npy'), self.rows)
+        with open(os.path.join(path, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump(self.meta, f, ensure_ascii=False, indent=2)
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        arrays = [
+            np.load(os.path.join(path, f'{name}.npy'), mmap_mode=mmap_mode)
+            for name in ('ids', 'vectors', 'center', 'planes', 'keys', 'rows')
+        ]
+        with open(os.path.join(path, 'meta.json'), encoding='utf-8') as f:
+            meta = json.load(f)
+        # 均值和超平面很小，放入内存避免每次查询都读映射
+        arrays[2] = np.asarray(arrays[2])
+        arrays[3] = np.asarray(arrays[3])
+        return cls(*arrays, meta=meta)
+
+    def row_of(self, movie_id):
+        """二分查找电影ID对应的行号，不存在时返回-1"""
+        if not len(self.ids):
+            return -1
+        row = int(np.searchsorted(self.ids, movie_id))
+        return row if row < len(self.ids) and self.ids[row] == movie_id else -1
+
+    def candidates(self, vector, probe_neighbors=True):
+        """返回与查询向量同桶(以及汉明距离为1的相邻桶)的候选行号"""
+        codes = self._codes(vector)[:, 0]
+        if probe_neighbors:
+            # 每张表额外探查翻转一位后的相邻桶
+            probes = np.concatenate([codes[:, None], codes[:, None] ^ self._bit_weights[None, :]], axis=1)
+        else:
+            probes = codes[:, None]
+
+        found = []
+        for table in range(len(codes)):
+            keys = self.keys[table]
+            starts = np.searchsorted(keys, probes[table], side='left')
+            ends = np.searchsorted(keys, probes[table], side='right')
+            for start, end in zip(starts.tolist(), ends.tolist()):
+                if end > start:
+                    found.append(self.rows[table][start:end])
+        if not found:
+            return np.zeros(0, dtype=np.int64)
+        return np.unique(np.concatenate(found))
+
+    def query(self, vector, k=10, exclude_row=-1, probe_neighbors=True):
+        """返回与向量最相似的 k 部电影 [(movie_id, similarity), ...]"""
+        vector = _normalize(np.asarray(vector))
+        rows = self.candidates(vector, probe_neighbors)
+        if exclude_row >= 0:
+            rows = rows[rows != exclude_row]
+        if not len(rows):
+            return []
+        sims = np.asarray(self.vectors[rows]) @ vector
+        k = min(k, len(rows))
+        top = np.argpartition(-sims, k - 1)[:k]
+        top = top[np.argsort(-sims[top], kind='stable')]
+        return [(int(self.ids[rows[i]]), float(sims[i])) for i in top]
+
+    def similar(self, movie_id, k=10, probe_neighbors=True):
+        """返回与指定电影最相似的 k 部电影，电影不在索引中时返回空列表"""
+        row = self.row_of(movie_id)
+        if row < 0:
+            return []
+        return self.query(self.vectors[row], k, exclude_row=row, probe_neighbors=probe_neighbors)
+
+
+def exact_similar(vectors, row, k=10):
+    """精确计算与第 row 行最相似的 k 行(排除自身)，用于评估召回率"""
+    vectors = np.asarray(vectors)
+    sims = vectors @ vectors[row]
+    sims[row] = -np.inf
+    k = min(k, len(sims) - 1)
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    top = np.argpartition(-sims, k - 1)[:k]
+    return top[np.argsort(-sims[top], kind='stable')]
+
+
+def measure_recall(index, k=10, sample_size=200, seed=0, probe_neighbors=True):
+    """
+    在随机抽样的电影上比较ANN结果与精确前K名
+
+    返回:
+        {'recall': 平均召回率, 'avg_ms': 平均查询耗时(毫秒), 'p99_ms': 99分位耗时, 'avg_candidates': 平均候选数, 'samples': 样本数}
+    """
+    n = len(index.ids)
+    if n < 2:
+        return {'recall': 0.0, 'avg_ms': 0.0, 'p99_ms': 0.0, 'avg_candidates': 0.0, 'samples': 0}
+    rng = np.random.default_rng(seed)
+    sample = rng.choice(n, size=min(sample_size, n), replace=False)
+
+    recalls, timings, candidate_counts = [], [], []
+    for row in sample.tolist():
+        expected = set(index.ids[exact_similar(index.vectors, row, k)].tolist())
+        start = time.perf_counter()
+        result = index.similar(int(index.ids[row]), k, probe_neighbors=probe_neighbors)
+        timings.append((time.perf_counter() - start) * 1000)
+        candidate_counts.append(len(index.candidates(index.vectors[row], probe_neighbors)))
+        if expected:
+            recalls.append(len(expected & {movie_id for movie_id, _ in result}) / len(expected))
+
+    return {
+        'recall': float(np.mean(recalls)) if recalls else 0.0,
+        'avg_ms': float(np.mean(timings)),
+        'p99_ms': float(np.percentile(timings, 99)),
+        'avg_candidates': float(np.mean(candidate_counts)),
+        'samples': len(sample),
+    }
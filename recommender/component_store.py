@@ -0,0 +1,126 @@
+"""
+相似度各维度分量的持久化存储
+
+相似度表只保存按权重合成后的总分，调整类型、导演、演员、标签的权重原本需要全量重算。
+这里为相似度表中的每个电影对保存四个维度的重叠度(float16)，带版本号:
+
+    <ARTIFACT_DIR>/similarity_components/<版本号>/
+        movie1_ids.npy     较小的电影ID
+        movie2_ids.npy     较大的电影ID
+        components.npy     (电影对数, 4) 各维度重叠度，列顺序见 meta.json 的 fields
+        meta.json          计算时使用的权重、阈值和top_k
+    <ARTIFACT_DIR>/similarity_components/CURRENT
+
+修改 settings.RECOMMENDER['SIMILARITY_WEIGHTS'] 后，用一次向量化的矩阵向量乘法
+在这些候选电影对上重新合成总分并重新选出每部电影的前K名，不需要重新计算候选。
+"""
+import itertools
+import json
+import logging
+import os
+import numpy as np
+from django.conf import settings
+from .factor_store import new_version_dir, publish_version, VersionedArtifact
+from .content_similarity import (
+    SIMILARITY_WEIGHTS, PAIR_BATCH_SIZE, build_feature_matrices, build_pair_features, pair_components,
+    blend_components,
+)
+
+logger = logging.getLogger('django')
+
+COMPONENT_STORE_NAME = 'similarity_components'
+
+
+def similarity_weights():
+    """
+    读取 settings.RECOMMENDER['SIMILARITY_WEIGHTS']，未配置的维度使用默认权重
+
+    维度名称不合法或权重为负时抛出ValueError
+    """
+    weights = dict(SIMILARITY_WEIGHTS)
+    configured = settings.RECOMMENDER.get('SIMILARITY_WEIGHTS') or {}
+    unknown = set(configured) - set(SIMILARITY_WEIGHTS)
+    if unknown:
+        raise ValueError(f"未知的相似度维度: {', '.join(sorted(unknown))}，可选: {', '.join(SIMILARITY_WEIGHTS)}")
+    weights.update({field: float(weight) for field, weight in configured.items()})
+    if any(weight < 0 for weight in weights.values()):
+        raise ValueError("相似度权重不能为负数")
+    return weights
+
+
+class SimilarityComponents(VersionedArtifact):
+    """只读的一版相似度分量，数组均为内存映射"""
+
+    STORE_NAME = COMPONENT_STORE_NAME
+
+    def __init__(self, version, mmap_mode='r'):
+        super().__init__(self.STORE_NAME, version)
+        self.movie1_ids = self.load_array('movie1_ids', mmap_mode)
+        self.movie2_ids = self.load_array('movie2_ids', mmap_mode)
+        self.components = self.load_array('components', mmap_mode)
+        self.meta = self.load_json('meta')
+
+    def __len__(self):
+        return len(self.movie1_ids)
+
+    def blend(self, weights, min_similarity=0.15, batch_size=PAIR_BATCH_SIZE):
+        """按新的权重合成全部电影对的总相似度，顺序与 movie1_ids 一致"""
+        if self.meta.get('fields') != list(SIMILARITY_WEIGHTS):
+            raise ValueError(f"相似度分量版本 {self.version} 的维度与当前代码不一致，请重新计算相似度")
+        similarities = np.zeros(len(self), dtype=np.float64)
+        for start in range(0, len(self), batch_size):
+            end = min(start + batch_size, len(self))
+            similarities[start:end] = blend_components(self.components[start:end], weights, min_similarity)
+        return similarities
+
+
+def save_similarity_components(movies, pairs, meta=None):
+    """
+    计算已保存电影对的各维度分量并发布为新版本
+
+    参数:
+        movies: 计算相似度时使用的电影字典列表
+        pairs: 可迭代的 (movie1_id, movie2_id)，通常直接读取相似度表；不在 movies 中的电影对会被跳过
+        meta: 额外记录的计算参数
+
+    返回:
+        新版本号
+    """
+    movie_ids = np.asarray([movie['movie_id'] for movie in movies], dtype=np.int64)
+    order = np.argsort(movie_ids, kind='stable')
+    sorted_ids = movie_ids[order]
+
+    pairs = np.fromiter(itertools.chain.from_iterable(pairs), dtype=np.int64).reshape(-1, 2)
+    movie1_ids = np.minimum(pairs[:, 0], pairs[:, 1])
+    movie2_ids = np.maximum(pairs[:, 0], pairs[:, 1])
+
+    def rows_of(ids):
+        if not len(sorted_ids):
+            return np.full(len(ids), -1, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(sorted_ids, ids), len(sorted_ids) - 1)
+        return np.where(sorted_ids[positions] == ids, order[positions], -1)
+
+    rows, cols = rows_of(movie1_ids), rows_of(movie2_ids)
+    known = (rows >= 0) & (cols >= 0)
+    if not known.all():
+        logger.warning(f"[推荐系统] {int((~known).sum())} 个电影对的电影不在本次特征中，不保存其相似度分量")
+    movie1_ids, movie2_ids, rows, cols = movie1_ids[known], movie2_ids[known], rows[known], cols[known]
+
+    pair_features = build_pair_features(build_feature_matrices(movies))
+    components = np.zeros((len(rows), len(SIMILARITY_WEIGHTS)), dtype=np.float16)
+    for start in range(0, len(rows), PAIR_BATCH_SIZE):
+        end = min(start + PAIR_BATCH_SIZE, len(rows))
+        components[start:end] = pair_components(pair_features, rows[start:end], cols[start:end])
+
+    version, tmp_dir = new_version_dir(COMPONENT_STORE_NAME)
+    np.save(os.path.join(tmp_dir, 'movie1_ids.npy'), movie1_ids)
+    np.save(os.path.join(tmp_dir, 'movie2_ids.npy'), movie2_ids)
+    np.save(os.path.join(tmp_dir, 'components.npy'), components)
+    meta = dict(meta or {})
+    meta.update({'version': version, 'fields': list(SIMILARITY_WEIGHTS), 'pairs': int(len(rows))})
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    publish_version(COMPONENT_STORE_NAME, version, tmp_dir)
+
+    logger.info(f"[推荐系统] 已保存相似度分量版本 {version}: {meta['pairs']} 个电影对")
+    return version
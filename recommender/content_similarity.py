@@ -0,0 +1,844 @@
+"""
+基于内容的电影相似度计算内核
+
+把电影的类型、标签、导演、演员编码为多热(multi-hot)CSR稀疏矩阵，
+按行分块用一次稀疏矩阵乘法得到每对电影在各维度上的交集数量，
+再按 0.4/0.1/0.1/0.4 的权重合成总相似度。整个过程不会在driver上
+构造 n·(n-1)/2 的电影对列表。
+
+只需给候选电影对打分时(MinHash候选、倒排列表候选)，类型和标签编码为uint64位图，
+交集大小为按位与后的popcount；导演和演员编码为有序的整数ID数组，按批向量化求交集。
+"""
+import bisect
+import hashlib
+import heapq
+import json
+import logging
+import random
+import numpy as np
+from scipy.sparse import csr_matrix, triu
+
+logger = logging.getLogger('django')
+
+# 各维度相似度权重
+SIMILARITY_WEIGHTS = {
+    'genres': 0.4,     # 类型相似度权重
+    'directors': 0.1,  # 导演相似度权重
+    'actors': 0.1,     # 演员相似度权重
+    'tags': 0.4,       # 标签相似度权重
+}
+
+# 只有类型匹配时给予的基础分
+GENRE_ONLY_FLOOR = 0.05
+
+# 每部电影默认保留的相似电影数量
+DEFAULT_TOP_K = 50
+
+# 倒排列表的最大长度，超过后按固定种子抽样（如“剧情”这类几乎所有电影都有的类型）
+MAX_POSTING_SIZE = 1000
+
+# 逐对打分时用uint64位图表示的维度，及每个维度放入位图的最高频特征数量
+BITSET_FIELDS = ('genres', 'tags')
+BITSET_MAX_BITS = 512
+
+# 其余特征保存为有序的整数ID数组；每行最多这么多个ID时补齐为定长矩阵，整批向量化比较
+PADDED_MAX_WIDTH = 16
+
+# 逐对打分时每批的电影对数量
+PAIR_BATCH_SIZE = 200000
+
+
+def build_multi_hot_matrix(values_list):
+    """
+    把每部电影的特征值列表编码为多热CSR矩阵
+
+    返回:
+        (matrix, lengths) - matrix为 n×V 的0/1矩阵，lengths为每行的特征数量
+    """
+    vocabulary = {}
+    indptr = [0]
+    indices = []
+    for values in values_list:
+        row = {vocabulary.setdefault(value, len(vocabulary)) for value in values if value}
+        indices.extend(sorted(row))
+        indptr.append(len(indices))
+
+    matrix = csr_matrix(
+        (
+            np.ones(len(indices), dtype=np.float32),
+            np.asarray(indices, dtype=np.int32),
+            np.asarray(indptr, dtype=np.int64),
+        ),
+        shape=(len(values_list), max(len(vocabulary), 1)),
+    )
+    lengths = np.diff(matrix.indptr).astype(np.float32)
+    return matrix, lengths
+
+
+def build_feature_matrices(movies):
+    """为每个相似度维度构建 (矩阵, 转置矩阵, 每行特征数)"""
+    features = {}
+    for field in SIMILARITY_WEIGHTS:
+        matrix, lengths = build_multi_hot_matrix([movie[field] for movie in movies])
+        features[field] = (matrix, matrix.T.tocsr(), lengths)
+    return features
+
+
+def _overlap_rows(matrix, matrix_t, lengths, rows):
+    """计算 rows 指定的行与全部电影的重叠度: 交集数量 / 两者特征数的较大值"""
+    counts = (matrix[rows] @ matrix_t).tocsr()
+    if counts.nnz:
+        row_idx = np.repeat(rows, np.diff(counts.indptr))
+        counts.data /= np.maximum(lengths[row_idx], lengths[counts.indices])
+    return counts
+
+
+def score_block(features, start, end, min_similarity, weights=SIMILARITY_WEIGHTS):
+    """
+    计算 [start, end) 行与全部电影的加权相似度
+
+    weights 为 {维度: 权重}，须包含 SIMILARITY_WEIGHTS 的全部维度。
+    返回 start..end 行的 CSR 相似度矩阵，未过滤阈值，包含对角线
+    """
+    return score_rows(features, np.arange(start, end), min_similarity, weights)
+
+
+def score_rows(features, rows, min_similarity, weights=SIMILARITY_WEIGHTS):
+    """计算 rows 指定的行(电影下标数组)与全部电影的加权相似度，返回值同 score_block"""
+    total = None
+    genre_overlap = None
+    for field in SIMILARITY_WEIGHTS:
+        weight = weights[field]
+        matrix, matrix_t, lengths = features[field]
+        overlap = _overlap_rows(matrix, matrix_t, lengths, rows)
+        if field == 'genres':
+            genre_overlap = overlap
+        weighted = overlap * weight
+        total = weighted if total is None else total + weighted
+    total = total.tocsr()
+
+    # 如果只有类型匹配也给一个基础分，与逐对计算的规则保持一致
+    if genre_overlap is not None and genre_overlap.nnz:
+        low = total.copy()
+        low.data = (low.data < min_similarity).astype(np.float32)
+        low.eliminate_zeros()
+        # 只用类型是否匹配作为掩码，bump 中保留的是总相似度本身
+        has_genre = genre_overlap.copy()
+        has_genre.data = np.ones_like(has_genre.data)
+        bump = has_genre.multiply(low).multiply(total).tocsr()
+        if bump.nnz:
+            bump.data = np.maximum(bump.data, GENRE_ONLY_FLOOR) - bump.data
+            total = (total + bump).tocsr()
+    return total
+
+
+def iter_similarity_blocks(movies, min_similarity=0.15, block_size=2000, weights=SIMILARITY_WEIGHTS):
+    """
+    按行分块计算电影相似度
+
+    每块产出 (movie1_ids, movie2_ids, similarities) 三个numpy数组，
+    只包含上三角(movie1 在列表中排在 movie2 之前)且相似度不低于阈值的电影对。
+    """
+    n = len(movies)
+    if n == 0:
+        return
+    movie_ids = np.asarray([movie['movie_id'] for movie in movies], dtype=np.int64)
+    features = build_feature_matrices(movies)
+
+    for start in range(0, n, block_size):
+        end = min(start + block_size, n)
+        block = score_block(features, start, end, min_similarity, weights)
+        # 只保留上三角，全局列号需大于全局行号
+        block = triu(block, k=start + 1, format='coo')
+        keep = block.data >= min_similarity
+        yield (
+            movie_ids[block.row[keep] + start],
+            movie_ids[block.col[keep]],
+            block.data[keep].astype(np.float64),
+        )
+        logger.info(f"[推荐系统] 稀疏矩阵相似度计算进度: {end}/{n} ({end / n * 100:.2f}%)")
+
+
+def _ranked_entries(block, row_ids, min_similarity):
+    """
+    取出分块相似度矩阵中不低于阈值的非对角元素，并按 (行升序, 相似度降序, 列升序) 排序
+
+    返回 (行下标, 列下标, 相似度, 行内名次)，行下标为全局下标
+    """
+    block = block.tocsr()
+    rows = np.repeat(np.asarray(row_ids), np.diff(block.indptr))
+    cols = block.indices
+    data = block.data
+    keep = (cols != rows) & (data >= min_similarity)
+    rows, cols, data = rows[keep], cols[keep], data[keep]
+    if not len(data):
+        return rows, cols, data, np.zeros(0, dtype=np.int64)
+
+    order = np.lexsort((cols, -data, rows))
+    rows, cols, data = rows[order], cols[order], data[order]
+    row_start = np.searchsorted(rows, rows, side='left')
+    rank = np.arange(len(rows)) - row_start
+    return rows, cols, data, rank
+
+
+def top_k_block(block, row_ids, top_k, min_similarity):
+    """
+    在分块相似度矩阵的每一行中选出相似度最高的 top_k 个邻居(排除自身)
+
+    返回 (行下标, 列下标, 相似度)，行下标为全局下标
+    """
+    rows, cols, data, rank = _ranked_entries(block, row_ids, min_similarity)
+    keep = rank < top_k
+    return rows[keep], cols[keep], data[keep]
+
+
+def row_floors(block, row_ids, top_k, min_similarity):
+    """
+    找出分块中每行排在第 top_k 名的邻居，名次按 (相似度降序, 列下标升序) 确定
+
+    返回与 row_ids 对齐的 (相似度, 列下标) 两个数组，不足 top_k 个邻居的行为 (-inf, -1)
+    """
+    row_ids = np.asarray(row_ids)
+    rows, cols, data, rank = _ranked_entries(block, row_ids, min_similarity)
+    floor_sims = np.full(len(row_ids), -np.inf)
+    floor_cols = np.full(len(row_ids), -1, dtype=np.int64)
+    kth = rank == top_k - 1
+    positions = np.searchsorted(row_ids, rows[kth])
+    floor_sims[positions] = data[kth]
+    floor_cols[positions] = cols[kth]
+    return floor_sims, floor_cols
+
+
+def owned_top_k_entries(block, row_ids, floor_sims, floor_cols, min_similarity):
+    """
+    选出由本分块负责写出的前K名电影对，各分块独立执行时每对电影只会被写出一次
+
+    floor_sims/floor_cols 为全部电影第K名邻居(见 row_floors)，j 排在 i 的前K名当且仅当
+    (相似度, -j) 不低于 i 的第K名。电影对由行 i 写出当且仅当 j 在 i 的前K名中，
+    并且 i < j 或 i 不在 j 的前K名中，结果与 iter_top_k_pairs 一致。
+
+    返回 (行下标, 列下标, 相似度)，行下标为全局下标
+    """
+    rows, cols, data, _ = _ranked_entries(block, row_ids, min_similarity)
+    in_row = (data > floor_sims[rows]) | ((data == floor_sims[rows]) & (cols <= floor_cols[rows]))
+    in_col = (data > floor_sims[cols]) | ((data == floor_sims[cols]) & (rows <= floor_cols[cols]))
+    keep = in_row & ((rows < cols) | ~in_col)
+    return rows[keep], cols[keep], data[keep]
+
+
+def iter_top_k_blocks(movies, min_similarity=0.15, top_k=DEFAULT_TOP_K, block_size=2000, weights=SIMILARITY_WEIGHTS):
+    """
+    按行分块计算每部电影的前 top_k 个相似电影
+
+    每块产出 (movie_ids, neighbor_ids, similarities)，为有向的邻居关系，
+    内存占用为 O(block_size·n) 的单块矩阵加上 O(n·K) 的结果。
+    """
+    n = len(movies)
+    if n == 0:
+        return
+    movie_ids = np.asarray([movie['movie_id'] for movie in movies], dtype=np.int64)
+    features = build_feature_matrices(movies)
+
+    for start in range(0, n, block_size):
+        end = min(start + block_size, n)
+        block = score_block(features, start, end, min_similarity, weights)
+        rows, cols, data = top_k_block(block, np.arange(start, end), top_k, min_similarity)
+        yield movie_ids[rows], movie_ids[cols], data.astype(np.float64)
+        logger.info(f"[推荐系统] 稀疏矩阵Top-{top_k}计算进度: {end}/{n} ({end / n * 100:.2f}%)")
+
+
+def top_k_pairs(movie_ids, neighbor_ids, similarities):
+    """
+    把有向的邻居关系合并为去重的无序电影对 (较小ID, 较大ID, 相似度)
+
+    一对电影只要出现在任一方的前K个邻居中就会被保留，结果按相似度降序排列。
+    """
+    low = np.minimum(movie_ids, neighbor_ids)
+    high = np.maximum(movie_ids, neighbor_ids)
+    order = np.lexsort((high, low))
+    low, high, similarities = low[order], high[order], similarities[order]
+    first = np.ones(len(low), dtype=bool)
+    first[1:] = (low[1:] != low[:-1]) | (high[1:] != high[:-1])
+    low, high, similarities = low[first], high[first], similarities[first]
+    order = np.argsort(-similarities, kind='stable')
+    return low[order], high[order], similarities[order]
+
+
+def rerank_top_k_pairs(movie1_ids, movie2_ids, similarities, min_similarity=0.15, top_k=DEFAULT_TOP_K):
+    """
+    在已有的无序电影对中按新的相似度重新选出每部电影的前 top_k 个邻居
+
+    规则与全量计算相同: 先过滤阈值，同分时按邻居ID升序，一对电影只要出现在任一方的前K个邻居中就会被保留。
+    top_k 为None时只过滤阈值。返回值同 top_k_pairs
+    """
+    keep = similarities >= min_similarity
+    movie1_ids, movie2_ids, similarities = movie1_ids[keep], movie2_ids[keep], similarities[keep]
+    if not top_k:
+        order = np.argsort(-similarities, kind='stable')
+        return movie1_ids[order], movie2_ids[order], similarities[order]
+
+    # 展开为双向的邻居关系，按 (电影, 相似度降序, 邻居) 排序后取每部电影的前K名
+    sources = np.concatenate([movie1_ids, movie2_ids])
+    targets = np.concatenate([movie2_ids, movie1_ids])
+    sims = np.concatenate([similarities, similarities])
+    order = np.lexsort((targets, -sims, sources))
+    sources, targets, sims = sources[order], targets[order], sims[order]
+    rank = np.arange(len(sources)) - np.searchsorted(sources, sources, side='left')
+    keep = rank < top_k
+    return top_k_pairs(sources[keep], targets[keep], sims[keep])
+
+
+def iter_top_k_pairs(movies, min_similarity=0.15, top_k=DEFAULT_TOP_K, block_size=2000, weights=SIMILARITY_WEIGHTS):
+    """逐条产出每部电影前 top_k 个邻居合并后的 (movie1_id, movie2_id, similarity)"""
+    blocks = list(iter_top_k_blocks(movies, min_similarity, top_k, block_size, weights))
+    if not blocks:
+        return
+    movie_ids, neighbor_ids, similarities = (np.concatenate(parts) for parts in zip(*blocks))
+    yield from zip(*(part.tolist() for part in top_k_pairs(movie_ids, neighbor_ids, similarities)))
+
+
+def push_top_k(heap, item, top_k):
+    """把 (similarity, neighbor_id) 放入容量为 top_k 的最小堆"""
+    if len(heap) < top_k:
+        heapq.heappush(heap, item)
+    elif item > heap[0]:
+        heapq.heapreplace(heap, item)
+    return heap
+
+
+def neighbors_to_pairs(neighbors):
+    """
+    把 {movie_id: [(similarity, neighbor_id), ...]} 形式的邻居堆合并为去重的无序电影对
+
+    返回按相似度降序排列的 (movie1_id, movie2_id, similarity) 列表
+    """
+    pairs = {}
+    for movie_id, heap in neighbors.items():
+        for similarity, neighbor_id in heap:
+            key = (movie_id, neighbor_id) if movie_id < neighbor_id else (neighbor_id, movie_id)
+            pairs[key] = similarity
+    return sorted(
+        ((movie1_id, movie2_id, similarity) for (movie1_id, movie2_id), similarity in pairs.items()),
+        key=lambda pair: pair[2],
+        reverse=True,
+    )
+
+
+def score_movie_pair(movie1, movie2, min_similarity, weights=SIMILARITY_WEIGHTS):
+    """逐对计算两部电影的加权内容相似度，规则与 score_block 一致"""
+    similarity = 0.0
+    genre_similarity = 0.0
+    for field in SIMILARITY_WEIGHTS:
+        weight = weights[field]
+        values1, values2 = movie1[field], movie2[field]
+        if values1 and values2:
+            common = set(values1) & set(values2)
+            if common:
+                overlap = len(common) / max(len(values1), len(values2))
+                similarity += weight * overlap
+                if field == 'genres':
+                    genre_similarity = overlap
+
+    # 如果只有类型匹配也给一个基础分
+    if genre_similarity > 0 and similarity < min_similarity:
+        similarity = max(similarity, GENRE_ONLY_FLOOR)
+    return similarity
+
+
+def iter_similarity_pairs(movies, min_similarity=0.15, block_size=2000, weights=SIMILARITY_WEIGHTS):
+    """逐条产出 (movie1_id, movie2_id, similarity)，供与Spark路径相同的保存逻辑使用"""
+    for movie1_ids, movie2_ids, similarities in iter_similarity_blocks(movies, min_similarity, block_size, weights):
+        yield from zip(movie1_ids.tolist(), movie2_ids.tolist(), similarities.tolist())
+
+
+def build_inverted_index(movies, max_posting_size=MAX_POSTING_SIZE, seed=42):
+    """
+    构建 (维度, 特征值) -> 电影下标 的倒排列表
+
+    长度超过 max_posting_size 的列表按固定种子抽样，只有被抽中的电影
+    才会通过该特征产生候选对。max_posting_size 为0或None时不限制。
+    """
+    index = {}
+    for i, movie in enumerate(movies):
+        for field in SIMILARITY_WEIGHTS:
+            for value in movie.get(field) or ():
+                if value:
+                    index.setdefault((field, value), []).append(i)
+
+    rng = random.Random(seed)
+    capped = 0
+    for key, postings in index.items():
+        # 同一部电影的重复特征值只保留一次
+        postings = sorted(set(postings))
+        if max_posting_size and len(postings) > max_posting_size:
+            postings = sorted(rng.sample(postings, max_posting_size))
+            capped += 1
+        index[key] = postings
+
+    if capped:
+        logger.info(f"[推荐系统] {capped} 个高频特征的倒排列表被抽样至 {max_posting_size} 部电影")
+    return index
+
+
+def iter_candidate_rows(movies, max_posting_size=MAX_POSTING_SIZE):
+    """
+    逐个电影产出候选列表 (i, [j, ...])，其中 j > i
+
+    只有在至少一个倒排列表中同时出现的两部电影才会成为候选对，
+    计算量与实际共现次数成正比，而不是 n·(n-1)/2。
+    """
+    index = build_inverted_index(movies, max_posting_size=max_posting_size)
+    movie_postings = [[] for _ in movies]
+    for postings in index.values():
+        if len(postings) > 1:
+            for i in postings:
+                movie_postings[i].append(postings)
+
+    for i, postings_list in enumerate(movie_postings):
+        candidates = set()
+        for postings in postings_list:
+            candidates.update(postings[bisect.bisect_right(postings, i):])
+        if candidates:
+            yield i, sorted(candidates)
+
+
+def iter_candidate_pairs(movies, max_posting_size=MAX_POSTING_SIZE):
+    """逐条产出候选电影对 (i, j)，i < j"""
+    for i, candidates in iter_candidate_rows(movies, max_posting_size=max_posting_size):
+        for j in candidates:
+            yield i, j
+
+
+def movie_content_hash(movie):
+    """
+    计算电影参与相似度计算的特征(类型、导演、演员、标签)的内容哈希
+
+    增量更新时与上次保存的哈希比较，哈希不同的电影才需要重新计算
+    """
+    payload = json.dumps([sorted(movie.get(field) or ()) for field in SIMILARITY_WEIGHTS], ensure_ascii=False)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def neighbor_floors(pairs, top_k):
+    """
+    由已保存的 (movie1_id, movie2_id, similarity) 计算每部电影当前第 top_k 名的相似度
+
+    邻居不足 top_k 个的电影不出现在结果中
+    """
+    heaps = {}
+    for movie1_id, movie2_id, similarity in pairs:
+        push_top_k(heaps.setdefault(movie1_id, []), similarity, top_k)
+        push_top_k(heaps.setdefault(movie2_id, []), similarity, top_k)
+    return {movie_id: heap[0] for movie_id, heap in heaps.items() if len(heap) >= top_k}
+
+
+def incremental_top_k_pairs(movies, changed_rows, floors_by_id, min_similarity=0.15, top_k=DEFAULT_TOP_K, block_size=2000,
+                            weights=SIMILARITY_WEIGHTS):
+    """
+    只计算变化电影所在的行，并与未变化电影已有的邻居列表合并
+
+    参数:
+        changed_rows: 变化电影在 movies 中的下标
+        floors_by_id: neighbor_floors 的结果，未变化电影当前第K名的相似度
+        top_k: 为None时保留所有超过阈值的电影对
+
+    变化电影c与电影j组成的电影对在以下任一条件成立时保留：相似度位于c的前K名；
+    或j未变化且相似度不低于j当前第K名(j的邻居不足K个时直接保留)。
+
+    返回去重的 (movie1_ids, movie2_ids, similarities) 数组，按相似度降序排列
+    """
+    n = len(movies)
+    changed_rows = np.unique(np.asarray(changed_rows, dtype=np.int64))
+    if n == 0 or not len(changed_rows):
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, np.zeros(0)
+    movie_ids = np.asarray([movie['movie_id'] for movie in movies], dtype=np.int64)
+    features = build_feature_matrices(movies)
+
+    # 变化电影之间的电影对由双方各自的行判断，门槛设为正无穷
+    floors = np.full(n, -1.0)
+    if top_k:
+        for i, movie_id in enumerate(movie_ids.tolist()):
+            if movie_id in floors_by_id:
+                floors[i] = floors_by_id[movie_id]
+        floors[changed_rows] = np.inf
+
+    parts = []
+    total = len(changed_rows)
+    for start in range(0, total, block_size):
+        row_ids = changed_rows[start:start + block_size]
+        block = score_rows(features, row_ids, min_similarity, weights)
+        rows, cols, data, rank = _ranked_entries(block, row_ids, min_similarity)
+        if top_k:
+            keep = (rank < top_k) | (data >= floors[cols])
+            rows, cols, data = rows[keep], cols[keep], data[keep]
+        parts.append((movie_ids[rows], movie_ids[cols], data.astype(np.float64)))
+        end = min(start + block_size, total)
+        logger.info(f"[推荐系统] 增量相似度计算进度: {end}/{total} ({end / total * 100:.2f}%)")
+
+    movie1_ids, movie2_ids, similarities = (np.concatenate(part) for part in zip(*parts))
+    return top_k_pairs(movie1_ids, movie2_ids, similarities)
+
+
+# MinHash签名长度和LSH分段数，每段 MINHASH_PERMUTATIONS // MINHASH_BANDS 行
+MINHASH_PERMUTATIONS = 64
+MINHASH_BANDS = 32
+
+_MERSENNE_PRIME = (1 << 31) - 1
+
+
+def _signature_fields(num_perm, rng, weights=SIMILARITY_WEIGHTS):
+    """按相似度权重把签名的各个位置分配给各维度，并打乱顺序让每段混合多个维度"""
+    fields = list(SIMILARITY_WEIGHTS)
+    total = sum(weights[field] for field in fields) or 1.0
+    counts = [max(1, round(weights[field] / total * num_perm)) for field in fields]
+    counts[counts.index(max(counts))] += num_perm - sum(counts)
+    return rng.permutation(np.repeat(np.arange(len(fields)), counts))
+
+
+def minhash_signatures(features, num_perm=MINHASH_PERMUTATIONS, seed=42, weights=SIMILARITY_WEIGHTS):
+    """
+    计算每部电影的分维度MinHash签名
+
+    每个签名位置只对一个维度的特征取最小哈希，分配给各维度的位置数与其权重成正比，
+    两部电影签名在某位置相同的概率约等于加权后的特征相似度。
+    哈希族为 (a·x + b) mod p；某维度没有特征的电影在该维度的位置上填入各自唯一的负数，
+    不会因为同样缺少特征而落入同一个桶。
+
+    返回 (n, num_perm) 的int64矩阵
+    """
+    rng = np.random.default_rng(seed)
+    position_fields = _signature_fields(num_perm, rng, weights)
+    a = rng.integers(1, _MERSENNE_PRIME, size=num_perm, dtype=np.int64)
+    b = rng.integers(0, _MERSENNE_PRIME, size=num_perm, dtype=np.int64)
+
+    n = next(iter(features.values()))[0].shape[0]
+    missing = -np.arange(1, n + 1, dtype=np.int64)
+    signatures = np.empty((n, num_perm), dtype=np.int64)
+    for field_index, field in enumerate(SIMILARITY_WEIGHTS):
+        matrix = features[field][0]
+        nonempty = np.diff(matrix.indptr) > 0
+        starts = matrix.indptr[:-1][nonempty]
+        tokens = matrix.indices.astype(np.int64)
+        for position in np.flatnonzero(position_fields == field_index):
+            signatures[:, position] = missing
+            if len(tokens):
+                hashed = (a[position] * tokens + b[position]) % _MERSENNE_PRIME
+                signatures[nonempty, position] = np.minimum.reduceat(hashed, starts)
+    return signatures
+
+
+def minhash_candidate_pairs(features, num_perm=MINHASH_PERMUTATIONS, bands=MINHASH_BANDS,
+                            max_bucket_size=MAX_POSTING_SIZE, seed=42, weights=SIMILARITY_WEIGHTS):
+    """
+    把MinHash签名分段放入LSH桶，至少一段完全相同的电影成为候选对
+
+    返回去重的候选对下标数组 (i, j)，i < j。超过 max_bucket_size 的桶按固定种子抽样。
+    """
+    signatures = minhash_signatures(features, num_perm, seed, weights)
+    n = len(signatures)
+    rows_per_band = num_perm // bands
+    rng = np.random.default_rng(seed + 1)
+    multipliers = rng.integers(1, 1 << 62, size=rows_per_band, dtype=np.int64) | 1
+
+    pair_keys = []
+    capped = 0
+    for band in range(bands):
+        block = signatures[:, band * rows_per_band:(band + 1) * rows_per_band]
+        # 用随机乘数把一段签名合成一个64位桶号，溢出回绕不影响桶的划分
+        with np.errstate(over='ignore'):
+            keys = (block * multipliers).sum(axis=1)
+        # 桶内按随机数排序，超过上限的桶只保留排在前面的 max_bucket_size 部电影
+        order = np.lexsort((rng.random(n), keys))
+        sorted_keys = keys[order]
+        bucket_start = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+        bucket_size = np.diff(np.r_[bucket_start, n])
+        if max_bucket_size:
+            capped += int((bucket_size > max_bucket_size).sum())
+            position = np.arange(n) - np.repeat(bucket_start, bucket_size)
+            keep = position < max_bucket_size
+            order = order[keep]
+            bucket_size = np.minimum(bucket_size, max_bucket_size)
+            bucket_start = np.r_[0, np.cumsum(bucket_size)[:-1]]
+
+        # 每部电影与桶内排在它后面的电影组成候选对
+        bucket_end = np.repeat(bucket_start + bucket_size, bucket_size)
+        partners = bucket_end - np.arange(len(order)) - 1
+        total = int(partners.sum())
+        if not total:
+            continue
+        left = np.repeat(np.arange(len(order)), partners)
+        right = left + 1 + np.arange(total) - np.repeat(np.cumsum(partners) - partners, partners)
+        i, j = order[left], order[right]
+        pair_keys.append(np.minimum(i, j) * n + np.maximum(i, j))
+
+    if capped:
+        logger.info(f"[推荐系统] MinHash: {capped} 个LSH桶被抽样至 {max_bucket_size} 部电影")
+    if not pair_keys:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty
+    # 各段产生的候选对大量重复，排序后去重
+    pair_keys = np.concatenate(pair_keys)
+    pair_keys.sort()
+    pair_keys = pair_keys[np.r_[True, pair_keys[1:] != pair_keys[:-1]]]
+    return pair_keys // n, pair_keys % n
+
+
+def _popcount_table():
+    table = np.zeros(1 << 16, dtype=np.uint8)
+    for bit in range(16):
+        table[(np.arange(1 << 16) >> bit) & 1 == 1] += 1
+    return table
+
+
+_POPCOUNT16 = None
+
+
+def popcount(words):
+    """逐个统计uint64数组中置位的比特数"""
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(words)
+    # numpy 2.0 之前没有bitwise_count，按16位查表
+    global _POPCOUNT16
+    if _POPCOUNT16 is None:
+        _POPCOUNT16 = _popcount_table()
+    halves = np.ascontiguousarray(words).view(np.uint16).reshape(words.shape + (4,))
+    return _POPCOUNT16[halves].sum(axis=-1, dtype=np.uint8)
+
+
+def build_bitsets(matrix, columns):
+    """
+    把多热矩阵中 columns 指定的列打包为位图
+
+    返回 (n, ceil(len(columns)/64)) 的uint64矩阵，第 k 个比特对应 columns[k]
+    """
+    n = matrix.shape[0]
+    bit_of = np.full(matrix.shape[1], -1, dtype=np.int64)
+    bit_of[columns] = np.arange(len(columns))
+    bitsets = np.zeros((n, max((len(columns) + 63) // 64, 1)), dtype=np.uint64)
+    rows = np.repeat(np.arange(n), np.diff(matrix.indptr))
+    bits = bit_of[matrix.indices]
+    keep = bits >= 0
+    rows, bits = rows[keep], bits[keep]
+    np.bitwise_or.at(bitsets, (rows, bits >> 6), np.left_shift(np.uint64(1), (bits & 63).astype(np.uint64)))
+    return bitsets
+
+
+def _gather_rows(matrix, rows):
+    """展开 rows 中每一行的列号，返回 (对序号, 列号)，同一行内列号保持升序"""
+    starts = matrix.indptr[rows]
+    lengths = matrix.indptr[rows + 1] - starts
+    pair = np.repeat(np.arange(len(rows)), lengths)
+    # 第 k 个元素在indices中的位置 = 所在行的起点 + (k - 该行在输出中的起点)
+    positions = np.arange(len(pair)) + np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+    return pair, matrix.indices[positions]
+
+
+def sorted_intersections(matrix, rows, cols):
+    """
+    逐对计算列号已排序的CSR矩阵中 rows[k] 行与 cols[k] 行的交集大小
+
+    把两侧的列号编码为 对序号·列数 + 列号，两侧各自有序，用一次二分查找完成归并
+    """
+    counts = np.zeros(len(rows), dtype=np.int64)
+    if not len(rows) or not matrix.nnz:
+        return counts
+    width = matrix.shape[1]
+    pair_r, values_r = _gather_rows(matrix, rows)
+    pair_c, values_c = _gather_rows(matrix, cols)
+    if not len(values_r) or not len(values_c):
+        return counts
+    keys_r = pair_r * width + values_r
+    keys_c = pair_c * width + values_c
+    positions = np.minimum(np.searchsorted(keys_r, keys_c), len(keys_r) - 1)
+    hit = keys_r[positions] == keys_c
+    return np.bincount(pair_c[hit], minlength=len(rows))
+
+
+def pad_sorted_ids(matrix):
+    """把列号有序的CSR矩阵补齐为 (n, 最大行长) 的int32矩阵，空位为-1"""
+    lengths = np.diff(matrix.indptr)
+    padded = np.full((matrix.shape[0], max(int(lengths.max()) if len(lengths) else 0, 1)), -1, dtype=np.int32)
+    rows = np.repeat(np.arange(matrix.shape[0]), lengths)
+    padded[rows, np.arange(matrix.nnz) - np.repeat(matrix.indptr[:-1], lengths)] = matrix.indices
+    return padded
+
+
+def id_intersections(ids, rows, cols):
+    """逐对计算交集大小，ids 为 pad_sorted_ids 的结果或列号有序的CSR矩阵"""
+    if not isinstance(ids, np.ndarray):
+        return sorted_intersections(ids, rows, cols)
+    left = ids[rows]
+    right = ids[cols]
+    matches = (left[:, :, None] == right[:, None, :]) & (left[:, :, None] >= 0)
+    return matches.sum(axis=(1, 2), dtype=np.int64)
+
+
+def build_pair_features(features):
+    """
+    把 build_feature_matrices 的结果转换为逐对打分用的紧凑表示
+
+    类型和标签中出现最多的 BITSET_MAX_BITS 个特征打包为uint64位图，交集大小为按位与后的popcount；
+    其余特征以及导演、演员保留为有序的整数ID数组: 每行不超过 PADDED_MAX_WIDTH 个时
+    补齐为定长矩阵，否则保留为列号有序的CSR矩阵，用归并求交集。
+
+    返回:
+        {维度: (位图或None, 剩余特征的ID数组, 每行特征数)}
+    """
+    pair_features = {}
+    for field, (matrix, _, lengths) in features.items():
+        matrix = matrix.tocsr()
+        matrix.sort_indices()
+        bitsets = None
+        if field in BITSET_FIELDS:
+            frequency = np.bincount(matrix.indices, minlength=matrix.shape[1])
+            hot = np.sort(np.argsort(-frequency, kind='stable')[:BITSET_MAX_BITS])
+            bitsets = build_bitsets(matrix, hot)
+            # 位图之外的低频特征仍按列号归并
+            cold = matrix.copy()
+            cold.data = np.ones_like(cold.data)
+            cold.data[np.isin(cold.indices, hot)] = 0
+            cold.eliminate_zeros()
+            matrix = cold
+        if not matrix.nnz or np.diff(matrix.indptr).max() <= PADDED_MAX_WIDTH:
+            matrix = pad_sorted_ids(matrix)
+        pair_features[field] = (bitsets, matrix, lengths)
+    return pair_features
+
+
+def pair_components(pair_features, rows, cols):
+    """
+    计算一批电影对在各维度上的重叠度: 交集数量 / 两者特征数的较大值
+
+    返回 (电影对数, 维度数) 的数组，列顺序与 SIMILARITY_WEIGHTS 一致
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    cols = np.asarray(cols, dtype=np.int64)
+    components = np.zeros((len(rows), len(SIMILARITY_WEIGHTS)), dtype=np.float64)
+    for column, field in enumerate(SIMILARITY_WEIGHTS):
+        bitsets, ids, lengths = pair_features[field]
+        counts = id_intersections(ids, rows, cols)
+        if bitsets is not None:
+            counts = counts + popcount(bitsets[rows] & bitsets[cols]).sum(axis=1, dtype=np.int64)
+        components[:, column] = counts / np.maximum(np.maximum(lengths[rows], lengths[cols]), 1)
+    return components
+
+
+def blend_components(components, weights=SIMILARITY_WEIGHTS, min_similarity=0.0):
+    """
+    按权重把 pair_components 的各维度重叠度合成总相似度，只有类型匹配时给予基础分
+
+    weights 须包含 SIMILARITY_WEIGHTS 的全部维度
+    """
+    components = np.asarray(components, dtype=np.float64)
+    total = components @ np.asarray([weights[field] for field in SIMILARITY_WEIGHTS], dtype=np.float64)
+    genre_overlap = components[:, list(SIMILARITY_WEIGHTS).index('genres')]
+
+    # 如果只有类型匹配也给一个基础分
+    bump = (genre_overlap > 0) & (total < min_similarity)
+    total[bump] = np.maximum(total[bump], GENRE_ONLY_FLOOR)
+    return total
+
+
+def score_pairs(pair_features, rows, cols, min_similarity, weights=SIMILARITY_WEIGHTS):
+    """
+    对一批电影对 (rows[k], cols[k]) 精确计算加权相似度，规则与 score_movie_pair 一致
+
+    pair_features 由 build_pair_features 生成
+    """
+    return blend_components(pair_components(pair_features, rows, cols), weights, min_similarity)
+
+
+def iter_candidate_pair_blocks(movies, max_posting_size=MAX_POSTING_SIZE, batch_size=PAIR_BATCH_SIZE):
+    """
+    把倒排列表生成的候选对按批产出 (rows, cols, 已处理到的行号)，每批约 batch_size 对，rows < cols
+    """
+    rows, cols, size = [], [], 0
+    last = -1
+    for i, candidates in iter_candidate_rows(movies, max_posting_size=max_posting_size):
+        rows.append(np.full(len(candidates), i, dtype=np.int64))
+        cols.append(np.asarray(candidates, dtype=np.int64))
+        size += len(candidates)
+        last = i
+        if size >= batch_size:
+            yield np.concatenate(rows), np.concatenate(cols), last
+            rows, cols, size = [], [], 0
+    if size:
+        yield np.concatenate(rows), np.concatenate(cols), last
+
+
+def minhash_top_k_pairs(movies, min_similarity=0.15, top_k=DEFAULT_TOP_K, num_perm=MINHASH_PERMUTATIONS,
+                        bands=MINHASH_BANDS, max_bucket_size=MAX_POSTING_SIZE, chunk_size=PAIR_BATCH_SIZE,
+                        weights=SIMILARITY_WEIGHTS):
+    """
+    MinHash/LSH生成候选对，只对候选对精确打分
+
+    返回去重的 (movie1_ids, movie2_ids, similarities) 数组，按相似度降序排列
+    """
+    empty = np.zeros(0, dtype=np.int64)
+    if not movies:
+        return empty, empty, np.zeros(0)
+    movie_ids = np.asarray([movie['movie_id'] for movie in movies], dtype=np.int64)
+    features = build_feature_matrices(movies)
+    rows, cols = minhash_candidate_pairs(features, num_perm, bands, max_bucket_size, weights=weights)
+    logger.info(f"[推荐系统] MinHash候选电影对: {len(rows)} / {len(movies) * (len(movies) - 1) // 2}")
+    pair_features = build_pair_features(features)
+
+    kept = []
+    for start in range(0, len(rows), chunk_size):
+        r, c = rows[start:start + chunk_size], cols[start:start + chunk_size]
+        sims = score_pairs(pair_features, r, c, min_similarity, weights)
+        keep = sims >= min_similarity
+        kept.append((r[keep], c[keep], sims[keep]))
+    if not kept:
+        return empty, empty, np.zeros(0)
+    rows, cols, sims = (np.concatenate(part) for part in zip(*kept))
+
+    if top_k:
+        # 每对电影在两个方向上各参与一次排名，每部电影保留前 top_k 个
+        directed_rows = np.concatenate([rows, cols])
+        directed_cols = np.concatenate([cols, rows])
+        directed_sims = np.concatenate([sims, sims])
+        order = np.lexsort((-directed_sims, directed_rows))
+        directed_rows, directed_cols, directed_sims = directed_rows[order], directed_cols[order], directed_sims[order]
+        rank = np.arange(len(directed_rows)) - np.searchsorted(directed_rows, directed_rows, side='left')
+        keep = rank < top_k
+        rows, cols, sims = directed_rows[keep], directed_cols[keep], directed_sims[keep]
+    return top_k_pairs(movie_ids[rows], movie_ids[cols], sims)
+
+
+def minhash_accuracy_report(movies, sample_size=2000, min_similarity=0.15, top_k=DEFAULT_TOP_K,
+                            num_perm=MINHASH_PERMUTATIONS, bands=MINHASH_BANDS, seed=0):
+    """
+    在抽样的电影上比较MinHash引擎和精确的稀疏矩阵引擎
+
+    返回:
+        {'samples', 'exact_pairs', 'minhash_pairs', 'recall', 'precision',
+         'exact_seconds', 'minhash_seconds', 'speedup'}
+    """
+    import time
+
+    rng = random.Random(seed)
+    sample = movies if len(movies) <= sample_size else rng.sample(movies, sample_size)
+
+    start = time.perf_counter()
+    exact = {(m1, m2) for m1, m2, _ in iter_top_k_pairs(sample, min_similarity, top_k)} if top_k else \
+        {(m1, m2) for m1, m2, _ in iter_similarity_pairs(sample, min_similarity)}
+    exact_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    movie1_ids, movie2_ids, _ = minhash_top_k_pairs(sample, min_similarity, top_k, num_perm, bands)
+    approx = set(zip(movie1_ids.tolist(), movie2_ids.tolist()))
+    minhash_seconds = time.perf_counter() - start
+
+    hits = len(exact & approx)
+    return {
+        'samples': len(sample),
+        'exact_pairs': len(exact),
+        'minhash_pairs': len(approx),
+        'recall': hits / len(exact) if exact else 1.0,
+        'precision': hits / len(approx) if approx else 1.0,
+        'exact_seconds': exact_seconds,
+        'minhash_seconds': minhash_seconds,
+        'speedup': exact_seconds / minhash_seconds if minhash_seconds > 0 else 0.0,
+    }
@@ -0,0 +1,242 @@
+"""
+基于用户行为的电影共现(item-to-item协同过滤)
+
+把高评分(rating >= 7)、收藏和观看历史合并为 用户数×电影数 的0/1稀疏矩阵 B，
+一次稀疏矩阵乘法 BᵀB 得到每对电影被同一用户喜欢的次数 C，再按余弦归一化
+
+    sim(i, j) = C_ij / sqrt(C_ii · C_jj)
+
+其中 C_ii 为喜欢电影 i 的用户数。C 只保存上三角(含对角线)，带版本号:
+
+    <ARTIFACT_DIR>/cooccurrence/<版本号>/
+        item_ids.npy        电影ID，升序
+        counts_indptr.npy   上三角共现次数的CSR行指针
+        counts_indices.npy  列下标
+        counts_data.npy     共现次数
+        meta.json           水位线(已计入的交互的最晚时间)等
+    <ARTIFACT_DIR>/cooccurrence/CURRENT
+
+增量刷新只读取水位线之后新增的交互: 对这些交互涉及的用户，设其原有的电影集合为 O，
+新增的电影集合为 N (已在 O 中的不重复计入)，则
+
+    ΔC = OᵀN + NᵀO + NᵀN
+
+删除交互或把评分改到7分以下不会产生新记录，需要定期用 full=True 全量重算。
+"""
+import json
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+import numpy as np
+from scipy.sparse import csr_matrix, coo_matrix, triu
+from django.utils import timezone
+from users.models import UserRating, UserFavorite, UserHistory
+from .factor_store import new_version_dir, publish_version, VersionedArtifact
+from .rating_loader import load_interactions
+
+logger = logging.getLogger('django')
+
+COOCCURRENCE_STORE_NAME = 'cooccurrence'
+
+# 评分不低于该值才算用户喜欢这部电影
+MIN_POSITIVE_RATING = 7
+
+# 共现次数低于该值的电影对不参与相似度计算
+DEFAULT_MIN_COOCCURRENCE = 2
+
+# 水位线比当前时间提前的秒数，给时间戳已生成但尚未提交的事务留出余量
+WATERMARK_LAG_SECONDS = 60
+
+# 增量刷新时按用户ID分批查询原有交互的批大小
+USER_BATCH_SIZE = 1000
+
+
+class CooccurrenceCounts(VersionedArtifact):
+    """只读的一版共现次数，数组均为内存映射"""
+
+    STORE_NAME = COOCCURRENCE_STORE_NAME
+
+    def __init__(self, version, mmap_mode='r'):
+        super().__init__(self.STORE_NAME, version)
+        load = lambda name: self.load_array(name, mmap_mode)
+        self.item_ids = load('item_ids')
+        self.counts = csr_matrix(
+            (load('counts_data'), load('counts_indices'), load('counts_indptr')),
+            shape=(len(self.item_ids), len(self.item_ids)),
+        )
+        self.meta = self.load_json('meta')
+
+    @property
+    def watermark(self):
+        return datetime.fromisoformat(self.meta['watermark'])
+
+    def __len__(self):
+        return len(self.item_ids)
+
+
+def binary_matrix(user_idx, item_idx, n_users, n_items):
+    """构建 用户数×电影数 的0/1 CSR矩阵，同一用户对同一电影的多条交互只计一次"""
+    matrix = csr_matrix(
+        (np.ones(len(user_idx), dtype=np.int32), (user_idx, item_idx)),
+        shape=(n_users, n_items),
+    )
+    matrix.data[:] = 1
+    return matrix
+
+
+def cooccurrence_counts(matrix):
+    """0/1矩阵 B 的共现次数 BᵀB 的上三角(含对角线)，int32 CSR"""
+    return triu(matrix.T.tocsr() @ matrix, format='csr').astype(np.int32)
+
+
+def cooccurrence_delta(old, new):
+    """
+    同一批用户原有交互 O 与新增交互 N 带来的共现次数变化 triu(OᵀN + NᵀO + NᵀN)
+
+    O 和 N 的行都对应这批用户，列对应同一组电影，且 N 中不含 O 已有的元素
+    """
+    new_t = new.T.tocsr()
+    cross = new_t @ old
+    return triu(cross + cross.T + new_t @ new, format='csr').astype(np.int32)
+
+
+def remap_counts(counts, item_ids, new_item_ids):
+    """把共现次数矩阵的下标从 item_ids 换到其超集 new_item_ids，两者均为升序"""
+    positions = np.searchsorted(new_item_ids, item_ids)
+    counts = counts.tocoo()
+    return coo_matrix(
+        (counts.data, (positions[counts.row], positions[counts.col])),
+        shape=(len(new_item_ids), len(new_item_ids)),
+    ).tocsr()
+
+
+def normalized_pairs(item_ids, counts, min_count=DEFAULT_MIN_COOCCURRENCE):
+    """
+    把上三角共现次数换算为余弦相似度
+
+    返回:
+        (movie1_ids, movie2_ids, similarities)，movie1_id < movie2_id，未排序
+    """
+    counts = counts.tocoo()
+    popularity = counts.diagonal().astype(np.float64)
+    keep = (counts.row < counts.col) & (counts.data >= min_count)
+    rows, cols = counts.row[keep], counts.col[keep]
+    similarities = counts.data[keep] / np.sqrt(popularity[rows] * popularity[cols])
+    item_ids = np.asarray(item_ids)
+    return item_ids[rows], item_ids[cols], similarities
+
+
+def _positive_querysets():
+    """三类正反馈交互及其时间字段"""
+    return (
+        (UserRating.objects.filter(rating__gte=MIN_POSITIVE_RATING), 'created_time'),
+        (UserFavorite.objects.all(), 'created_time'),
+        (UserHistory.objects.all(), 'watch_time'),
+    )
+
+
+def _fetch_positive_pairs(since=None, until=None, user_ids=None):
+    """读取时间在 (since, until] 内的正反馈 (user_id, movie_id)，可限定用户"""
+    pairs = []
+    for queryset, time_field in _positive_querysets():
+        if since is not None:
+            queryset = queryset.filter(**{f'{time_field}__gt': since})
+        if until is not None:
+            queryset = queryset.filter(**{f'{time_field}__lte': until})
+        if user_ids is None:
+            pairs.extend(queryset.values_list('user_id', 'movie_id').iterator(chunk_size=10000))
+            continue
+        for start in range(0, len(user_ids), USER_BATCH_SIZE):
+            chunk = user_ids[start:start + USER_BATCH_SIZE]
+            pairs.extend(queryset.filter(user_id__in=chunk).values_list('user_id', 'movie_id'))
+    return np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+
+
+def _full_counts(until):
+    """全量读取截止时间之前的正反馈并计算共现次数"""
+    interactions = load_interactions(favorites=True, history=True, min_rating=MIN_POSITIVE_RATING, until=until)
+    matrix = binary_matrix(interactions.user_idx, interactions.item_idx, interactions.n_users, interactions.n_items)
+    logger.info(f"[推荐系统] 共现矩阵输入: {interactions.n_users} 个用户，{interactions.n_items} 部电影，{matrix.nnz} 个正反馈")
+    return interactions.item_ids, cooccurrence_counts(matrix)
+
+
+def _incremental_counts(previous, until):
+    """
+    在上一版本的基础上计入 (水位线, until] 内新增的正反馈
+
+    返回:
+        (item_ids, counts, 新增正反馈数)
+    """
+    new_pairs = _fetch_positive_pairs(since=previous.watermark, until=until)
+    if not len(new_pairs):
+        return np.asarray(previous.item_ids), previous.counts, 0
+
+    user_ids = np.unique(new_pairs[:, 0])
+    old_pairs = _fetch_positive_pairs(until=previous.watermark, user_ids=user_ids.tolist())
+    item_ids = np.union1d(np.asarray(previous.item_ids), np.concatenate([new_pairs[:, 1], old_pairs[:, 1]]))
+    shape = (len(user_ids), len(item_ids))
+
+    def encode(pairs):
+        return np.searchsorted(user_ids, pairs[:, 0]), np.searchsorted(item_ids, pairs[:, 1])
+
+    old = binary_matrix(*encode(old_pairs), *shape)
+    new = binary_matrix(*encode(new_pairs), *shape)
+    # 用户原本就喜欢的电影不重复计入
+    new = (new - new.multiply(old)).tocsr()
+    new.eliminate_zeros()
+
+    counts = remap_counts(previous.counts, np.asarray(previous.item_ids), item_ids) + cooccurrence_delta(old, new)
+    return item_ids, counts.tocsr(), int(new.nnz)
+
+
+def save_cooccurrence(item_ids, counts, meta):
+    """把共现次数发布为新版本，返回版本号"""
+    counts = triu(counts, format='csr')
+    counts.sum_duplicates()
+    version, tmp_dir = new_version_dir(COOCCURRENCE_STORE_NAME)
+    save = lambda name, array: np.save(os.path.join(tmp_dir, f'{name}.npy'), array)
+    save('item_ids', np.asarray(item_ids, dtype=np.int64))
+    save('counts_indptr', counts.indptr.astype(np.int64))
+    save('counts_indices', counts.indices.astype(np.int32))
+    save('counts_data', counts.data.astype(np.int32))
+    meta = dict(meta)
+    meta.update({'version': version, 'items': int(len(item_ids)), 'nnz': int(counts.nnz)})
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    publish_version(COOCCURRENCE_STORE_NAME, version, tmp_dir)
+    return version
+
+
+def refresh_cooccurrence(full=False):
+    """
+    刷新共现次数，没有上一版本或 full=True 时全量计算，否则只计入水位线之后的新交互
+
+    返回:
+        (CooccurrenceCounts, {'version', 'full', 'added'})
+    """
+    start_time = time.time()
+    previous = None if full else CooccurrenceCounts.current()
+    until = (timezone.now() - timedelta(seconds=WATERMARK_LAG_SECONDS)).replace(microsecond=0)
+
+    if previous is None:
+        item_ids, counts = _full_counts(until)
+        added = int(counts.diagonal().sum())
+    else:
+        item_ids, counts, added = _incremental_counts(previous, until)
+        if not added:
+            # 水位线不前移，时间戳较早但提交较晚的交互下次仍能读到
+            logger.info(f"[推荐系统] 水位线 {previous.watermark} 之后没有新的正反馈，沿用共现次数版本 {previous.version}")
+            return previous, {'version': previous.version, 'full': False, 'added': 0}
+
+    version = save_cooccurrence(item_ids, counts, {
+        'watermark': until.isoformat(),
+        'min_rating': MIN_POSITIVE_RATING,
+        'full': previous is None,
+        'base_version': previous.version if previous is not None else None,
+    })
+    logger.info(
+        f"[推荐系统] 已保存共现次数版本 {version}: {len(item_ids)} 部电影，计入 {added} 个正反馈，"
+        f"水位线 {until}，耗时 {time.time() - start_time:.2f}秒"
+    )
+    return CooccurrenceCounts(version), {'version': version, 'full': previous is None, 'added': added}
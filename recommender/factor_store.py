@@ -0,0 +1,356 @@
+"""
+ALS因子的持久化存储
+
+训练完成后把用户因子、电影因子及其ID映射写成带版本号的 .npy 文件:
+
+    <ARTIFACT_DIR>/als/<版本号>/user_ids.npy, user_factors.npy,
+                               item_ids.npy, item_factors.npy, meta.json,
+                               ann/ (电影因子的LSH近似最近邻索引)
+    <ARTIFACT_DIR>/als/CURRENT      当前版本号
+
+Web进程用 mmap_mode='r' 加载，多个gunicorn/uWSGI工作进程共享页缓存中的
+同一份数据，在线打分不需要Spark和MySQL。ID数组按升序保存，用二分查找定位行号。
+"""
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import numpy as np
+from django.conf import settings
+from .ann_index import LSHIndex, DEFAULT_TABLES, DEFAULT_BITS
+from .implicit_als import signal_strengths, SIGNAL_WEIGHTS
+from .rating_loader import SIGNAL_RATING, SIGNAL_FAVORITE, SIGNAL_HISTORY
+
+logger = logging.getLogger('django')
+
+DEFAULT_STORE_NAME = 'als'
+CURRENT_FILE = 'CURRENT'
+
+# 进程内已加载的因子存储 {name: (FactorStore, 上次检查时间)}
+_loaded_stores = {}
+_lock = threading.Lock()
+
+
+def _store_root(name=DEFAULT_STORE_NAME):
+    return os.path.join(settings.RECOMMENDER['ARTIFACT_DIR'], name)
+
+
+def version_path(name, version):
+    """name 下某个已发布版本的目录"""
+    return os.path.join(_store_root(name), version)
+
+
+def _sorted_by_id(ids, factors):
+    """按ID升序排列ID和对应的因子行"""
+    ids = np.asarray(ids, dtype=np.int64)
+    factors = np.ascontiguousarray(factors, dtype=np.float32)
+    order = np.argsort(ids, kind='stable')
+    return ids[order], factors[order]
+
+
+def new_version_dir(name):
+    """
+    为 name 下的新版本创建空的临时目录
+
+    版本号为秒级时间戳加三位序号，同一秒内多次发布(包括多个进程同时发布)时
+    依次递增序号，由创建临时目录是否成功来占用版本号，不会覆盖正在使用的版本。
+
+    返回:
+        (版本号, 临时目录)，写完后调用 publish_version 发布
+    """
+    root = _store_root(name)
+    os.makedirs(root, exist_ok=True)
+    timestamp = time.strftime('%Y%m%d%H%M%S')
+    # 从同一秒内已有的最大序号之后开始，已被清理的序号不会重复使用，版本号始终递增
+    used = [int(d[len(timestamp):][:3]) for d in os.listdir(root)
+            if d.startswith(timestamp) and d[len(timestamp):][:3].isdigit()]
+    for sequence in range(max(used) + 1 if used else 0, 1000):
+        version = f'{timestamp}{sequence:03d}'
+        tmp_dir = os.path.join(root, f'{version}.tmp')
+        if os.path.exists(os.path.join(root, version)):
+            continue
+        try:
+            os.makedirs(tmp_dir)
+        except FileExistsError:
+            continue
+        return version, tmp_dir
+    raise RuntimeError(f'{root} 下同一秒内发布的版本过多')
+
+
+def publish_version(name, version, tmp_dir):
+    """把临时目录重命名为版本目录，原子地替换CURRENT文件并清理旧版本"""
+    root = _store_root(name)
+    # 版本号由 new_version_dir 保证唯一，不会替换正在被映射的版本目录
+    os.rename(tmp_dir, version_path(name, version))
+
+    current_tmp = os.path.join(root, f'{CURRENT_FILE}.tmp')
+    with open(current_tmp, 'w', encoding='utf-8') as f:
+        f.write(version)
+    os.replace(current_tmp, os.path.join(root, CURRENT_FILE))
+    _prune_versions(root, version)
+
+
+def save_factors(user_ids, user_factors, item_ids, item_factors, meta=None, name=DEFAULT_STORE_NAME):
+    """
+    保存一版ALS因子并切换为当前版本
+
+    先写入临时目录再整体重命名，最后原子地替换CURRENT文件，
+    读取方不会看到写了一半的版本。
+
+    返回:
+        新版本号
+    """
+    version, tmp_dir = new_version_dir(name)
+
+    user_ids, user_factors = _sorted_by_id(user_ids, user_factors)
+    item_ids, item_factors = _sorted_by_id(item_ids, item_factors)
+    np.save(os.path.join(tmp_dir, 'user_ids.npy'), user_ids)
+    np.save(os.path.join(tmp_dir, 'user_factors.npy'), user_factors)
+    np.save(os.path.join(tmp_dir, 'item_ids.npy'), item_ids)
+    np.save(os.path.join(tmp_dir, 'item_factors.npy'), item_factors)
+
+    meta = dict(meta or {})
+    meta.update({
+        'version': version,
+        'rank': int(item_factors.shape[1]) if item_factors.ndim == 2 else 0,
+        'users': int(len(user_ids)),
+        'items': int(len(item_ids)),
+    })
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+
+    # 相似电影查询用的LSH索引与因子一起发布
+    LSHIndex.build(
+        item_ids, item_factors,
+        n_tables=settings.RECOMMENDER.get('ANN_TABLES', DEFAULT_TABLES),
+        n_bits=settings.RECOMMENDER.get('ANN_BITS', DEFAULT_BITS),
+    ).save(os.path.join(tmp_dir, 'ann'))
+
+    publish_version(name, version, tmp_dir)
+    logger.info(f"[推荐系统] 已保存ALS因子版本 {version}: {meta['users']} 个用户, {meta['items']} 部电影, rank={meta['rank']}")
+    return version
+
+
+def _prune_versions(root, current_version):
+    """只保留最近的 KEEP_VERSIONS 个版本，当前版本总会保留"""
+    keep = settings.RECOMMENDER.get('KEEP_VERSIONS', 3)
+    versions = sorted(
+        d for d in os.listdir(root)
+        if os.path.isdir(os.path.join(root, d)) and d.isdigit()
+    )
+    for version in versions[:-keep] if keep else []:
+        if version != current_version:
+            # 已映射旧版本的进程仍可继续读取，文件在其解除映射后才被真正释放
+            shutil.rmtree(os.path.join(root, version), ignore_errors=True)
+
+
+def current_version(name=DEFAULT_STORE_NAME):
+    """读取当前版本号，没有任何版本时返回None"""
+    try:
+        with open(os.path.join(_store_root(name), CURRENT_FILE), encoding='utf-8') as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def lookup_rows(sorted_ids, ids):
+    """在升序ID数组中二分查找ID对应的行号，不存在的ID返回-1"""
+    ids = np.asarray(ids, dtype=np.int64)
+    if not len(sorted_ids):
+        return np.full(ids.shape, -1, dtype=np.int64)
+    rows = np.searchsorted(sorted_ids, ids)
+    rows = np.minimum(rows, len(sorted_ids) - 1)
+    return np.where(sorted_ids[rows] == ids, rows, -1)
+
+
+class VersionedArtifact:
+    """
+    带版本号的只读产物
+
+    子类设置 STORE_NAME，在 __init__ 中先调用 super().__init__(name, version)，
+    再用 load_array 和 load_json 读取版本目录中的文件。
+    """
+
+    STORE_NAME = None
+
+    def __init__(self, name, version):
+        self.name = name
+        self.version = version
+        self.path = version_path(name, version)
+
+    def load_array(self, filename, mmap_mode='r'):
+        """读取版本目录中的 <filename>.npy"""
+        return np.load(os.path.join(self.path, f'{filename}.npy'), mmap_mode=mmap_mode)
+
+    def load_json(self, filename):
+        """读取版本目录中的 <filename>.json"""
+        with open(os.path.join(self.path, f'{filename}.json'), encoding='utf-8') as f:
+            return json.load(f)
+
+    @classmethod
+    def current(cls):
+        """加载 STORE_NAME 的当前版本，没有任何版本时返回None"""
+        version = current_version(cls.STORE_NAME)
+        return cls(version) if version else None
+
+
+class FactorStore(VersionedArtifact):
+    """只读的一版ALS因子，数组均为内存映射"""
+
+    STORE_NAME = DEFAULT_STORE_NAME
+
+    def __init__(self, name, version, mmap_mode='r'):
+        super().__init__(name, version)
+        self._ann_index = None
+        self._item_gram = None
+        self.user_ids = self.load_array('user_ids', mmap_mode)
+        self.user_factors = self.load_array('user_factors', mmap_mode)
+        self.item_ids = self.load_array('item_ids', mmap_mode)
+        self.item_factors = self.load_array('item_factors', mmap_mode)
+        self.meta = self.load_json('meta')
+
+    @classmethod
+    def current(cls, name=DEFAULT_STORE_NAME):
+        """加载 name 的当前版本，没有任何版本时返回None"""
+        version = current_version(name)
+        return cls(name, version) if version else None
+
+    def ann_index(self):
+        """该版本的LSH近似最近邻索引，首次调用时内存映射，索引不存在时返回None"""
+        if self._ann_index is None:
+            ann_path = os.path.join(self.path, 'ann')
+            if os.path.isdir(ann_path):
+                self._ann_index = LSHIndex.load(ann_path)
+        return self._ann_index
+
+    def similar(self, movie_id, k=10):
+        """返回因子空间中与电影最相似的 k 部电影 [(movie_id, similarity), ...]"""
+        index = self.ann_index()
+        return index.similar(movie_id, k) if index is not None else []
+
+    def item_gram(self):
+        """全部电影因子的 YᵀY，首次调用时计算并缓存"""
+        if self._item_gram is None:
+            factors = np.asarray(self.item_factors, dtype=np.float32)
+            self._item_gram = factors.T @ factors
+        return self._item_gram
+
+    @property
+    def rank(self):
+        return self.item_factors.shape[1] if self.item_factors.ndim == 2 else 0
+
+    def item_rows(self, movie_ids):
+        return lookup_rows(self.item_ids, movie_ids)
+
+    def user_rows(self, user_ids):
+        return lookup_rows(self.user_ids, user_ids)
+
+    def user_row(self, user_id):
+        return int(self.user_rows([user_id])[0])
+
+    def user_vector(self, user_id):
+        """返回训练时得到的用户因子，用户不在模型中时返回None"""
+        row = self.user_row(user_id)
+        return None if row < 0 else np.asarray(self.user_factors[row])
+
+    def score_items(self, user_vector):
+        """用一次矩阵向量乘法计算用户对所有电影的打分，顺序与 item_ids 一致"""
+        return self.item_factors @ np.asarray(user_vector, dtype=np.float32)
+
+    def fold_in(self, movie_ids, values, reg_param=None, kinds=None):
+        """
+        根据用户当前的交互求解用户因子，不需要重新训练
+
+        kinds 为每条交互的种类(SIGNAL_RATING/SIGNAL_FAVORITE/SIGNAL_HISTORY，默认全部为评分)，
+        values 为评分或观看分钟数，收藏的值不使用。
+
+        固定电影因子Y，求解与Spark ALS相同的正则化最小二乘问题:
+            (YᵀY + λ·n·I) x = Yᵀr
+        其中n为用户评分数量，只使用评分。隐式反馈训练的因子(meta['implicit'])改为求解
+            (YᵀY_全部 + Yᵀ(Cu - I)Y + λI) x = YᵀCu·1
+        三类交互按训练时的权重换算为置信度，同一电影的多条交互相加。
+        模型不在因子中的电影会被忽略，没有可用交互时返回None。
+        """
+        rows = self.item_rows(movie_ids)
+        values = np.asarray(values, dtype=np.float32)
+        kinds = np.full(len(values), SIGNAL_RATING) if kinds is None else np.asarray(kinds)
+        mask = rows >= 0
+        reg = self.meta.get('reg_param', 0.1) if reg_param is None else reg_param
+        if self.meta.get('implicit'):
+            weights = {
+                SIGNAL_RATING: self.meta.get('rating_weight', SIGNAL_WEIGHTS[SIGNAL_RATING]),
+                SIGNAL_FAVORITE: self.meta.get('favorite_weight', SIGNAL_WEIGHTS[SIGNAL_FAVORITE]),
+                SIGNAL_HISTORY: self.meta.get('history_weight', SIGNAL_WEIGHTS[SIGNAL_HISTORY]),
+            }
+            strengths = self.meta.get('alpha', 1.0) * signal_strengths(kinds[mask], values[mask], weights)
+            # 与训练时一样合并同一电影的多条交互，置信度为0的电影不参与求解
+            item_rows, inverse = np.unique(rows[mask], return_inverse=True)
+            confidence = np.bincount(inverse, weights=strengths, minlength=len(item_rows)).astype(np.float32)
+            item_rows, confidence = item_rows[confidence > 0], confidence[confidence > 0]
+            if not len(item_rows):
+                return None
+            factors = np.asarray(self.item_factors[item_rows], dtype=np.float32)
+            gram = self.item_gram() + factors.T @ (confidence[:, None] * factors) + reg * np.eye(self.rank, dtype=np.float32)
+            return np.linalg.solve(gram, factors.T @ (confidence + 1.0))
+
+        mask &= kinds == SIGNAL_RATING
+        if not mask.any():
+            return None
+        factors = np.asarray(self.item_factors[rows[mask]], dtype=np.float32)
+        ratings = values[mask]
+        gram = factors.T @ factors + reg * len(ratings) * np.eye(self.rank, dtype=np.float32)
+        user_vector = np.linalg.solve(gram, factors.T @ ratings)
+        if self.meta.get('nonnegative'):
+            # 近似非负约束，与训练时的非负ALS保持一致
+            user_vector = np.maximum(user_vector, 0)
+        return user_vector
+
+    def recommend(self, user_vector, limit=10, exclude_ids=()):
+        """
+        返回打分最高的 limit 部电影 [(movie_id, score), ...]，exclude_ids 中的电影被屏蔽
+        """
+        scores = np.array(self.score_items(user_vector), dtype=np.float32)
+        exclude_rows = self.item_rows(list(exclude_ids))
+        scores[exclude_rows[exclude_rows >= 0]] = -np.inf
+        limit = min(limit, len(scores))
+        if limit <= 0:
+            return []
+        top = np.argpartition(-scores, limit - 1)[:limit]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return [
+            (int(self.item_ids[row]), float(scores[row]))
+            for row in top if np.isfinite(scores[row])
+        ]
+
+
+def get_factor_store(name=DEFAULT_STORE_NAME):
+    """
+    获取当前进程缓存的因子存储
+
+    每隔 RELOAD_INTERVAL 秒检查一次CURRENT文件，有新版本时重新映射。
+    没有可用的因子时返回None。
+    """
+    interval = settings.RECOMMENDER.get('RELOAD_INTERVAL', 60)
+    now = time.time()
+    store, checked_at = _loaded_stores.get(name, (None, 0))
+    if name in _loaded_stores and now - checked_at < interval:
+        return store
+
+    with _lock:
+        store, checked_at = _loaded_stores.get(name, (None, 0))
+        if name in _loaded_stores and now - checked_at < interval:
+            return store
+        version = current_version(name)
+        if version is None:
+            _loaded_stores[name] = (None, now)
+            return None
+        if store is None or store.version != version:
+            try:
+                store = FactorStore(name, version)
+                logger.info(f"[推荐系统] 已加载ALS因子版本 {version} (rank={store.rank}, 电影数={len(store.item_ids)})")
+            except Exception as e:
+                logger.error(f"[推荐系统] 加载ALS因子版本 {version} 失败: {str(e)}")
+        _loaded_stores[name] = (store, now)
+        return store
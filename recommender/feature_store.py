@@ -0,0 +1,275 @@
+"""
+预解析的电影特征列式存储
+
+movie_collectmoviedb 中的导演、演员、类型、标签和评分以JSON或Python repr文本保存，
+每次批处理都要重新解析。这里把每行解析一次，保存为带版本号的 .npy 列文件:
+
+    <ARTIFACT_DIR>/features/<版本号>/
+        movie_ids.npy        电影ID，升序
+        row_hash.npy         每行的哈希(包含record_time)，用于增量刷新
+        rating.npy           平均评分
+        ratings_count.npy    评分人数
+        year.npy             年份
+        <维度>_indptr.npy    类型、标签、导演、演员的CSR行指针
+        <维度>_indices.npy   字典编码后的特征编号
+        vocab.json           编号到字符串的字典，导演和演员共用people字典
+        titles.json          标题和原始标题
+    <ARTIFACT_DIR>/features/CURRENT
+
+刷新时只重新读取并解析哈希变化的行，其余行直接沿用上一版本的编码；
+字典只追加不删除，旧版本的编号在新版本中保持不变。
+"""
+import json
+import logging
+import os
+import time
+import numpy as np
+from django.db import connection
+from .factor_store import new_version_dir, publish_version, VersionedArtifact
+from .utils import parse_names, parse_str_list, parse_rating_average
+
+logger = logging.getLogger('django')
+
+FEATURE_STORE_NAME = 'features'
+
+# 特征维度及其使用的字典
+FEATURE_VOCABULARIES = {
+    'genres': 'genres',
+    'tags': 'tags',
+    'directors': 'people',
+    'actors': 'people',
+}
+
+# 参与行哈希的原始列，任何一列或record_time变化都会重新解析该行
+HASH_COLUMNS = ('record_time', 'title', 'original_title', 'directors', 'actor', 'genres', 'tags', 'rating', 'year', 'ratings_count')
+
+# 按ID读取原始行时每批的数量
+FETCH_BATCH_SIZE = 2000
+
+
+class MovieFeatureStore(VersionedArtifact):
+    """只读的一版电影特征，数值列均为内存映射"""
+
+    STORE_NAME = FEATURE_STORE_NAME
+
+    def __init__(self, version, mmap_mode='r'):
+        super().__init__(self.STORE_NAME, version)
+        load = lambda name: self.load_array(name, mmap_mode)
+        self.movie_ids = load('movie_ids')
+        self.row_hash = load('row_hash')
+        self.rating = load('rating')
+        self.ratings_count = load('ratings_count')
+        self.year = load('year')
+        self.columns = {
+            field: (load(f'{field}_indptr'), load(f'{field}_indices'))
+            for field in FEATURE_VOCABULARIES
+        }
+        self.vocab = self.load_json('vocab')
+        self.titles = self.load_json('titles')
+
+    def __len__(self):
+        return len(self.movie_ids)
+
+    def codes(self, field, row):
+        """第 row 行在某个维度上的特征编号列表"""
+        indptr, indices = self.columns[field]
+        return indices[indptr[row]:indptr[row + 1]].tolist()
+
+    def values(self, field, row):
+        """第 row 行在某个维度上的特征值列表，保持原始顺序"""
+        vocab = self.vocab[FEATURE_VOCABULARIES[field]]
+        return [vocab[code] for code in self.codes(field, row)]
+
+    def movies(self, limit=None, min_ratings=10):
+        """
+        返回与 _load_collect_movies 相同结构的电影字典列表
+
+        先按评分人数过滤并降序排列，再截取前 limit 部，最后去掉没有类型也没有标签的电影
+        """
+        counts = np.asarray(self.ratings_count)
+        rows = np.flatnonzero(counts >= min_ratings)
+        rows = rows[np.lexsort((np.asarray(self.movie_ids)[rows], -counts[rows]))]
+        if limit:
+            rows = rows[:limit]
+
+        movies = []
+        for row in rows.tolist():
+            genres = self.values('genres', row)
+            tags = self.values('tags', row)
+            if not genres and not tags:
+                continue
+            movies.append({
+                'movie_id': int(self.movie_ids[row]),
+                'title': self.titles['title'][row],
+                'original_title': self.titles['original_title'][row],
+                'directors': self.values('directors', row),
+                'actors': self.values('actors', row),
+                'genres': genres,
+                'tags': tags,
+                'rating': float(self.rating[row]),
+                'year': int(self.year[row]),
+                'ratings_count': int(self.ratings_count[row]),
+            })
+        return movies
+
+
+def _fetch_row_hashes():
+    """在MySQL端计算每行的哈希，只传回 (movie_id, 64位哈希)"""
+    columns = ', '.join(f'`{column}`' for column in HASH_COLUMNS)
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+            SELECT movie_id, LEFT(MD5(CONCAT_WS(CHAR(31), {columns})), 16)
+            FROM movie_collectmoviedb
+        """)
+        rows = cursor.fetchall()
+    movie_ids = np.asarray([row[0] for row in rows], dtype=np.int64)
+    hashes = np.asarray([int(row[1], 16) for row in rows], dtype=np.uint64)
+    order = np.argsort(movie_ids, kind='stable')
+    return movie_ids[order], hashes[order]
+
+
+def _fetch_parsed_rows(movie_ids):
+    """读取并解析指定电影的原始行，返回 {movie_id: 解析结果}"""
+    parsed = {}
+    movie_ids = list(movie_ids)
+    with connection.cursor() as cursor:
+        for start in range(0, len(movie_ids), FETCH_BATCH_SIZE):
+            chunk = movie_ids[start:start + FETCH_BATCH_SIZE]
+            placeholders = ', '.join(['%s'] * len(chunk))
+            cursor.execute(f"""
+                SELECT movie_id, title, original_title, directors, actor, genres, tags, rating, year, ratings_count
+                FROM movie_collectmoviedb
+                WHERE movie_id IN ({placeholders})
+            """, chunk)
+            for movie_id, title, original_title, directors, actors, genres, tags, rating, year, ratings_count in cursor.fetchall():
+                parsed[movie_id] = {
+                    'title': title or '',
+                    'original_title': original_title or '',
+                    'directors': parse_names(directors),
+                    'actors': parse_names(actors),
+                    'genres': parse_str_list(genres),
+                    'tags': parse_str_list(tags),
+                    'rating': parse_rating_average(rating),
+                    'year': year or 0,
+                    'ratings_count': ratings_count or 0,
+                }
+    return parsed
+
+
+def refresh_feature_store(full=False):
+    """
+    刷新电影特征存储，只解析新增或哈希变化的行
+
+    参数:
+        full: 忽略上一版本，重新解析全部行
+
+    返回:
+        {'version', 'total', 'parsed', 'reused', 'removed'}；没有任何变化时version为当前版本
+    """
+    start_time = time.time()
+    movie_ids, hashes = _fetch_row_hashes()
+    previous = None if full else MovieFeatureStore.current()
+
+    reuse_rows = np.full(len(movie_ids), -1, dtype=np.int64)
+    if previous is not None and len(previous):
+        old_ids = np.asarray(previous.movie_ids)
+        positions = np.minimum(np.searchsorted(old_ids, movie_ids), len(old_ids) - 1)
+        same = (old_ids[positions] == movie_ids) & (np.asarray(previous.row_hash)[positions] == hashes)
+        reuse_rows[same] = positions[same]
+    changed_ids = movie_ids[reuse_rows < 0]
+    removed = len(np.setdiff1d(previous.movie_ids, movie_ids)) if previous is not None else 0
+
+    stats = {
+        'version': previous.version if previous is not None else None,
+        'total': len(movie_ids),
+        'parsed': len(changed_ids),
+        'reused': int((reuse_rows >= 0).sum()),
+        'removed': removed,
+    }
+    if previous is not None and not len(changed_ids) and not removed:
+        logger.info(f"[推荐系统] 电影特征没有变化，沿用版本 {previous.version}")
+        return stats
+
+    parsed = _fetch_parsed_rows(changed_ids.tolist())
+    # 字典只追加，沿用的行的编号无需改写
+    vocab = {name: list(previous.vocab[name]) if previous is not None else [] for name in set(FEATURE_VOCABULARIES.values())}
+    lookup = {name: {value: code for code, value in enumerate(values)} for name, values in vocab.items()}
+
+    def encode(name, values):
+        codes = lookup[name]
+        for value in values:
+            if value not in codes:
+                codes[value] = len(vocab[name])
+                vocab[name].append(value)
+        return [codes[value] for value in values]
+
+    n = len(movie_ids)
+    rating = np.zeros(n, dtype=np.float64)
+    ratings_count = np.zeros(n, dtype=np.int32)
+    year = np.zeros(n, dtype=np.int32)
+    titles = {'title': [''] * n, 'original_title': [''] * n}
+    field_rows = {field: [] for field in FEATURE_VOCABULARIES}
+    for row, (movie_id, old_row) in enumerate(zip(movie_ids.tolist(), reuse_rows.tolist())):
+        if old_row >= 0:
+            rating[row] = previous.rating[old_row]
+            ratings_count[row] = previous.ratings_count[old_row]
+            year[row] = previous.year[old_row]
+            titles['title'][row] = previous.titles['title'][old_row]
+            titles['original_title'][row] = previous.titles['original_title'][old_row]
+            for field in FEATURE_VOCABULARIES:
+                field_rows[field].append(previous.codes(field, old_row))
+            continue
+
+        data = parsed.get(movie_id)
+        if data is None:
+            # 读取期间被删除的行按空行处理，下次刷新时会被移除
+            for field in FEATURE_VOCABULARIES:
+                field_rows[field].append([])
+            continue
+        rating[row] = data['rating']
+        ratings_count[row] = data['ratings_count']
+        year[row] = data['year']
+        titles['title'][row] = data['title']
+        titles['original_title'][row] = data['original_title']
+        for field, name in FEATURE_VOCABULARIES.items():
+            field_rows[field].append(encode(name, data[field]))
+
+    version, tmp_dir = new_version_dir(FEATURE_STORE_NAME)
+    save = lambda name, array: np.save(os.path.join(tmp_dir, f'{name}.npy'), array)
+    save('movie_ids', movie_ids)
+    save('row_hash', hashes)
+    save('rating', rating)
+    save('ratings_count', ratings_count)
+    save('year', year)
+    for field, rows in field_rows.items():
+        save(f'{field}_indptr', np.cumsum([0] + [len(codes) for codes in rows], dtype=np.int64))
+        save(f'{field}_indices', np.asarray([code for codes in rows for code in codes], dtype=np.int32))
+    with open(os.path.join(tmp_dir, 'vocab.json'), 'w', encoding='utf-8') as f:
+        json.dump(vocab, f, ensure_ascii=False)
+    with open(os.path.join(tmp_dir, 'titles.json'), 'w', encoding='utf-8') as f:
+        json.dump(titles, f, ensure_ascii=False)
+    publish_version(FEATURE_STORE_NAME, version, tmp_dir)
+
+    stats['version'] = version
+    logger.info(
+        f"[推荐系统] 已保存电影特征版本 {version}: 共 {stats['total']} 部，解析 {stats['parsed']} 部，"
+        f"沿用 {stats['reused']} 部，移除 {stats['removed']} 部，耗时 {time.time() - start_time:.2f}秒"
+    )
+    return stats
+
+
+def load_movie_features(limit=None, min_ratings=10, refresh=True):
+    """
+    刷新并从特征存储中读取电影特征，结构与 _load_collect_movies 相同
+
+    返回:
+        电影字典列表；特征存储不可用时返回None
+    """
+    if refresh:
+        refresh_feature_store()
+    store = MovieFeatureStore.current()
+    if store is None:
+        return None
+    movies = store.movies(limit=limit, min_ratings=min_ratings)
+    logger.info(f"[推荐系统] 从特征存储版本 {store.version} 读取了 {len(movies)} 部电影（评分人数 >= {min_ratings}）")
+    return movies
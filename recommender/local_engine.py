@@ -0,0 +1,193 @@
+"""
+不依赖Spark的多进程相似度计算后端
+
+主进程把各维度的多热CSR矩阵(及其转置)的 indptr/indices/data 数组和每行特征数
+放入 multiprocessing.shared_memory，工作进程启动时按名称映射这些数组重建矩阵，
+之后每个任务只传递 (起始行, 结束行)，不会为每个任务序列化电影列表。
+每个工作进程用与稀疏矩阵引擎相同的内核计算一段行，结果按分块顺序交回主进程。
+同时提交的分块数有上限，消费方写库较慢时已算完的结果不会在主进程中无限堆积。
+"""
+import collections
+import itertools
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+from scipy.sparse import csr_matrix, triu
+from .content_similarity import (
+    SIMILARITY_WEIGHTS, DEFAULT_TOP_K, build_feature_matrices, score_block, top_k_block, top_k_pairs,
+)
+
+logger = logging.getLogger('django')
+
+# 每个任务计算的行数
+DEFAULT_LOCAL_BLOCK_SIZE = 1000
+
+# 同时提交的分块数为进程数的多少倍
+PENDING_BLOCKS_PER_WORKER = 2
+
+# 工作进程内映射的共享数组 {'features': ..., 'shm': [...]}
+_worker_state = {}
+
+
+def available_cores():
+    """当前进程可以使用的CPU核数"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+class SharedArrays:
+    """把一组numpy数组复制到共享内存，spec 描述每个数组的 (共享内存名, 形状, 类型)"""
+
+    def __init__(self, arrays):
+        self._blocks = []
+        self.spec = {}
+        try:
+            for key, array in arrays.items():
+                array = np.ascontiguousarray(array)
+                shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+                self._blocks.append(shm)
+                np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+                self.spec[key] = (shm.name, array.shape, array.dtype.str)
+        except Exception:
+            self.close()
+            raise
+
+    def close(self):
+        """释放并删除全部共享内存"""
+        for shm in self._blocks:
+            try:
+                shm.close()
+                shm.unlink()
+            except FileNotFoundError:
+                pass
+        self._blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+def _attach(spec):
+    """在工作进程中按名称映射共享数组，返回 ({key: ndarray}, [SharedMemory])"""
+    arrays, handles = {}, []
+    for key, (name, shape, dtype) in spec.items():
+        # 工作进程与主进程共用同一个resource_tracker，共享内存由主进程负责删除
+        shm = shared_memory.SharedMemory(name=name)
+        handles.append(shm)
+        arrays[key] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+    return arrays, handles
+
+
+def feature_arrays(features):
+    """把 build_feature_matrices 的结果拆成可放入共享内存的数组"""
+    arrays = {}
+    for field, (matrix, matrix_t, lengths) in features.items():
+        for name, m in (('m', matrix), ('t', matrix_t)):
+            arrays[f'{field}.{name}.data'] = m.data
+            arrays[f'{field}.{name}.indices'] = m.indices
+            arrays[f'{field}.{name}.indptr'] = m.indptr
+            arrays[f'{field}.{name}.shape'] = np.asarray(m.shape, dtype=np.int64)
+        arrays[f'{field}.lengths'] = lengths
+    return arrays
+
+
+def features_from_arrays(arrays):
+    """用共享数组重建 {维度: (矩阵, 转置矩阵, 每行特征数)}，不复制数据"""
+    features = {}
+    for field in SIMILARITY_WEIGHTS:
+        matrices = []
+        for name in ('m', 't'):
+            shape = tuple(int(x) for x in arrays[f'{field}.{name}.shape'])
+            matrices.append(csr_matrix(
+                (arrays[f'{field}.{name}.data'], arrays[f'{field}.{name}.indices'], arrays[f'{field}.{name}.indptr']),
+                shape=shape, copy=False,
+            ))
+        features[field] = (matrices[0], matrices[1], arrays[f'{field}.lengths'])
+    return features
+
+
+def _init_worker(spec):
+    arrays, handles = _attach(spec)
+    _worker_state['features'] = features_from_arrays(arrays)
+    # 保留共享内存句柄，否则映射会随对象回收而失效
+    _worker_state['shm'] = handles
+
+
+def _score_rows_task(task):
+    """
+    工作进程任务: 计算 [start, end) 行
+
+    top_k 不为空时返回每行前 top_k 个有向邻居，否则返回上三角中不低于阈值的电影对，
+    下标均为全局下标
+    """
+    start, end, min_similarity, top_k, weights = task
+    block = score_block(_worker_state['features'], start, end, min_similarity, weights)
+    if top_k:
+        rows, cols, data = top_k_block(block, np.arange(start, end), top_k, min_similarity)
+    else:
+        block = triu(block, k=start + 1, format='coo')
+        keep = block.data >= min_similarity
+        rows, cols, data = block.row[keep] + start, block.col[keep], block.data[keep]
+    return end, rows.astype(np.int32), cols.astype(np.int32), data.astype(np.float32)
+
+
+def iter_local_blocks(movies, min_similarity=0.15, top_k=DEFAULT_TOP_K, block_size=DEFAULT_LOCAL_BLOCK_SIZE, workers=None,
+                      weights=SIMILARITY_WEIGHTS):
+    """
+    用进程池按行分块计算相似度，按分块顺序产出 (movie1_ids, movie2_ids, similarities)
+
+    top_k 不为空时为有向的邻居关系，需经 top_k_pairs 合并；否则为去重的上三角电影对。
+    """
+    n = len(movies)
+    if n == 0:
+        return
+    workers = workers or available_cores()
+    movie_ids = np.asarray([movie['movie_id'] for movie in movies], dtype=np.int64)
+    tasks = [(start, min(start + block_size, n), min_similarity, top_k, weights) for start in range(0, n, block_size)]
+    logger.info(f"[推荐系统] 本地多进程引擎: {workers} 个进程，{len(tasks)} 个分块")
+
+    with SharedArrays(feature_arrays(build_feature_matrices(movies))) as shared:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(shared.spec,)) as executor:
+            # 按顺序取回最早提交的分块，每取回一个再提交一个，内存中最多 PENDING_BLOCKS_PER_WORKER·workers 个分块的结果
+            remaining = iter(tasks)
+            pending = collections.deque(
+                executor.submit(_score_rows_task, task)
+                for task in itertools.islice(remaining, PENDING_BLOCKS_PER_WORKER * workers)
+            )
+            done = 0
+            while pending:
+                _, rows, cols, data = pending.popleft().result()
+                task = next(remaining, None)
+                if task is not None:
+                    pending.append(executor.submit(_score_rows_task, task))
+                done += 1
+                yield movie_ids[rows], movie_ids[cols], data.astype(np.float64)
+                logger.info(f"[推荐系统] 本地多进程引擎计算进度: {done}/{len(tasks)} ({done / len(tasks) * 100:.2f}%)")
+
+
+def iter_local_pairs(movies, min_similarity=0.15, top_k=DEFAULT_TOP_K, block_size=DEFAULT_LOCAL_BLOCK_SIZE, workers=None,
+                     weights=SIMILARITY_WEIGHTS):
+    """
+    逐条产出 (movie1_id, movie2_id, similarity)
+
+    不限制top_k时各分块结果直接流式交给写入方；
+    限制top_k时先收集 O(n·K) 的有向邻居再合并去重，按相似度降序产出。
+    """
+    blocks = iter_local_blocks(movies, min_similarity, top_k, block_size, workers, weights)
+    if not top_k:
+        for movie1_ids, movie2_ids, similarities in blocks:
+            yield from zip(movie1_ids.tolist(), movie2_ids.tolist(), similarities.tolist())
+        return
+
+    blocks = list(blocks)
+    if not blocks:
+        return
+    movie_ids, neighbor_ids, similarities = (np.concatenate(parts) for parts in zip(*blocks))
+    yield from zip(*(part.tolist() for part in top_k_pairs(movie_ids, neighbor_ids, similarities)))
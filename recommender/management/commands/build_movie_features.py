@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from recommender.feature_store import refresh_feature_store, MovieFeatureStore
+import time
+
+
+class Command(BaseCommand):
+    help = '把movie_collectmoviedb中的导演、演员、类型、标签和评分解析为列式特征存储，只重新解析变化的电影'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='忽略上一版本，重新解析全部电影')
+
+    def handle(self, *args, **options):
+        start_time = time.time()
+        stats = refresh_feature_store(full=options['full'])
+        self.stdout.write(
+            f"电影总数: {stats['total']}，重新解析: {stats['parsed']}，沿用: {stats['reused']}，移除: {stats['removed']}"
+        )
+
+        store = MovieFeatureStore.current()
+        if store is None:
+            self.stdout.write(self.style.ERROR('没有生成电影特征'))
+            return
+        self.stdout.write(
+            f"类型 {len(store.vocab['genres'])} 个，标签 {len(store.vocab['tags'])} 个，人物 {len(store.vocab['people'])} 个"
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"电影特征版本 {store.version} 已就绪，耗时: {time.time() - start_time:.2f}秒"
+        ))
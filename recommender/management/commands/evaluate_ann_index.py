@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from recommender.factor_store import get_factor_store
+from recommender.ann_index import LSHIndex, measure_recall, DEFAULT_TABLES, DEFAULT_BITS
+import time
+
+
+class Command(BaseCommand):
+    help = '评估ALS电影因子LSH近似最近邻索引的召回率和查询耗时，用于调整索引参数'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tables', type=int, help='哈希表数量，默认使用settings.RECOMMENDER中的ANN_TABLES')
+        parser.add_argument('--bits', type=int, help='每张哈希表的超平面数量，默认使用settings.RECOMMENDER中的ANN_BITS')
+        parser.add_argument('--k', type=int, default=10, help='评估的相似电影数量')
+        parser.add_argument('--sample', type=int, default=200, help='抽样评估的电影数量')
+        parser.add_argument('--no-probe', action='store_true', help='只查询同桶电影，不探查相邻桶')
+
+    def handle(self, *args, **options):
+        store = get_factor_store()
+        if store is None:
+            self.stdout.write(self.style.ERROR('没有找到ALS因子，请先运行 update_similarities --method als'))
+            return
+
+        tables = options.get('tables') or settings.RECOMMENDER.get('ANN_TABLES', DEFAULT_TABLES)
+        bits = options.get('bits') or settings.RECOMMENDER.get('ANN_BITS', DEFAULT_BITS)
+        self.stdout.write(f"ALS因子版本: {store.version}，电影数: {len(store.item_ids)}，rank={store.rank}")
+        self.stdout.write(f"索引参数: 哈希表 {tables} 张，每张 {bits} 位，{'不' if options['no_probe'] else ''}探查相邻桶")
+
+        start_time = time.time()
+        index = LSHIndex.build(store.item_ids, store.item_factors, n_tables=tables, n_bits=bits)
+        self.stdout.write(f"索引构建耗时: {time.time() - start_time:.2f}秒")
+
+        report = measure_recall(index, k=options['k'], sample_size=options['sample'], probe_neighbors=not options['no_probe'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Recall@{options['k']}: {report['recall']:.4f}，"
+            f"平均查询耗时: {report['avg_ms']:.3f}毫秒，P99: {report['p99_ms']:.3f}毫秒，"
+            f"平均候选数: {report['avg_candidates']:.0f}，样本数: {report['samples']}"
+        ))
@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+from recommender.recommendation import reblend_similarities
+from recommender.component_store import similarity_weights, SimilarityComponents
+from recommender.content_similarity import DEFAULT_TOP_K, SIMILARITY_WEIGHTS
+import time
+
+
+class Command(BaseCommand):
+    help = '按settings.RECOMMENDER中的SIMILARITY_WEIGHTS(或--weights)在已保存的相似度分量上重新合成电影相似度，不重新计算候选'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--weights', type=str,
+                           help='临时覆盖的权重，如 genres=0.5,tags=0.3，未指定的维度使用settings中的权重')
+        parser.add_argument('--min-similarity', type=float, default=0.15, help='最小相似度阈值，低于此值的相似度不会被保存')
+        parser.add_argument('--top-k', type=int, default=DEFAULT_TOP_K, help='每部电影保留的相似电影数量，设置为0表示保留所有超过阈值的电影对')
+        parser.add_argument('--max-records', type=int, default=0, help='最大保存的相似度记录数量，按相似度从高到低截断，设置为0表示不限制')
+
+    def handle(self, *args, **options):
+        start_time = time.time()
+        try:
+            weights = similarity_weights()
+            for item in (options.get('weights') or '').split(','):
+                if not item.strip():
+                    continue
+                field, _, value = item.partition('=')
+                field = field.strip()
+                if field not in SIMILARITY_WEIGHTS:
+                    raise ValueError(f"未知的相似度维度: {field}，可选: {', '.join(SIMILARITY_WEIGHTS)}")
+                weights[field] = float(value)
+                if weights[field] < 0:
+                    raise ValueError("相似度权重不能为负数")
+        except ValueError as e:
+            self.stdout.write(self.style.ERROR(f'权重设置有误: {str(e)}'))
+            return
+
+        store = SimilarityComponents.current()
+        if store is None:
+            self.stdout.write(self.style.ERROR('没有找到相似度分量，请先运行 update_similarities 计算相似度'))
+            return
+        self.stdout.write(f"相似度分量版本: {store.version}，电影对数: {len(store)}")
+        self.stdout.write(f"权重: {', '.join(f'{field}={weight}' for field, weight in weights.items())}")
+
+        top_k = options['top_k'] or None
+        max_records = options['max_records'] or None
+        saved = reblend_similarities(weights, min_similarity=options['min_similarity'], top_k=top_k, max_similarity_records=max_records)
+        if saved is None:
+            self.stdout.write(self.style.ERROR('重新合成相似度失败'))
+            return
+        self.stdout.write(self.style.SUCCESS(f"已保存 {saved} 条相似度数据，耗时: {time.time() - start_time:.2f}秒"))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from recommender.recommendation_store import refresh_user_recommendations, USER_BLOCK_SIZE
+import time
+
+
+class Command(BaseCommand):
+    help = '为活跃用户离线预计算个性化推荐(ALS、共现、内容相似度、热门电影)，整体替换用户推荐表'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top-n', type=int, help='每个用户保存的推荐数量，默认读取settings.RECOMMENDER中的USER_RECOMMENDATION_TOP_N')
+        parser.add_argument('--active-days', type=int,
+                           help='最近多少天内登录过或有交互的用户算作活跃用户，默认读取ACTIVE_USER_DAYS，设置为0表示计算全部有交互的用户')
+        parser.add_argument('--block-size', type=int, default=USER_BLOCK_SIZE, help='每块同时计算的用户数')
+
+    def handle(self, *args, **options):
+        start_time = time.time()
+        try:
+            stats = refresh_user_recommendations(
+                top_n=options.get('top_n'),
+                active_days=options.get('active_days'),
+                block_size=options['block_size'],
+            )
+        except Exception as e:
+            self.stdout.write(self.style.ERROR(f'预计算用户推荐失败: {str(e)}'))
+            return
+        sources = '，'.join(f'{source}: {count}' for source, count in stats['sources'].items())
+        self.stdout.write(f"来源分布: {sources}")
+        self.stdout.write(self.style.SUCCESS(
+            f"已为 {stats['users']} 个用户保存 {stats['rows']} 条推荐，耗时: {time.time() - start_time:.2f}秒"
+        ))
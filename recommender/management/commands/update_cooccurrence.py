@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from recommender.recommendation import update_cooccurrence_similarities
+from recommender.cooccurrence import DEFAULT_MIN_COOCCURRENCE, MIN_POSITIVE_RATING
+from recommender.content_similarity import DEFAULT_TOP_K
+import time
+
+
+class Command(BaseCommand):
+    help = f'用高评分(>= {MIN_POSITIVE_RATING})、收藏和观看历史计算电影共现相似度，默认只计入上次运行之后的新交互'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='忽略水位线全量重算，删除交互或修改评分后需要全量重算')
+        parser.add_argument('--min-count', type=int, default=DEFAULT_MIN_COOCCURRENCE, help='最小共现次数，低于此值的电影对不会被保存')
+        parser.add_argument('--min-similarity', type=float, default=0.0, help='最小相似度阈值，低于此值的相似度不会被保存')
+        parser.add_argument('--top-k', type=int, default=DEFAULT_TOP_K, help='每部电影保留的共现电影数量，设置为0表示保留所有超过阈值的电影对')
+
+    def handle(self, *args, **options):
+        start_time = time.time()
+        self.stdout.write('全量计算共现次数...' if options['full'] else '增量更新共现次数...')
+        try:
+            saved, stats = update_cooccurrence_similarities(
+                full=options['full'],
+                min_count=options['min_count'],
+                min_similarity=options['min_similarity'],
+                top_k=options['top_k'] or None,
+            )
+        except Exception as e:
+            self.stdout.write(self.style.ERROR(f'更新共现相似度失败: {str(e)}'))
+            return
+        mode = '全量' if stats['full'] else '增量'
+        self.stdout.write(f"共现次数版本: {stats['version']}（{mode}），计入 {stats['added']} 个正反馈")
+        self.stdout.write(self.style.SUCCESS(f"已保存 {saved} 条共现相似度数据，耗时: {time.time() - start_time:.2f}秒"))
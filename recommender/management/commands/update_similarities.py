@@ -1,6 +1,8 @@
-from django.core.management.base import BaseCommand
-from recommender.recommendation import update_content_based_similarities, build_als_model, update_similarity_from_collectmoviedb, import_movies_from_collectdb
+from django.core.management.base import BaseCommand, CommandError
+from recommender.recommendation import update_content_based_similarities, build_als_model, build_implicit_als_model, update_similarity_from_collectmoviedb, import_movies_from_collectdb, load_collect_movies
 from recommender.models import MovieSimilarity
+from recommender.content_similarity import MAX_POSTING_SIZE, DEFAULT_TOP_K, MINHASH_PERMUTATIONS, MINHASH_BANDS, minhash_accuracy_report
+from recommender.factor_similarity import DEFAULT_FACTOR_BLOCK_SIZE
 import logging
 import time
 
@@ -19,8 +21,25 @@ class Command(BaseCommand):
                            help='推荐计算方法，content=基于内容的相似度，als=协同过滤，collectmovie=从collectmoviedb计算，both=多种方法')
         parser.add_argument('--force-import', action='store_true', help='强制导入电影数据')
         parser.add_argument('--import-only', action='store_true', help='仅导入电影数据，不计算相似度')
-        parser.add_argument('--max-records', type=int, default=10000, help='最大保存的相似度记录数量，设置为0表示不限制')
+        parser.add_argument('--max-records', type=int, default=0, help='最大保存的相似度记录数量，按相似度从高到低截断，设置为0表示不限制')
+        parser.add_argument('--top-k', type=int, default=DEFAULT_TOP_K, help='collectmovie和als方法中每部电影保留的相似电影数量，设置为0表示保留所有超过阈值的电影对')
+        parser.add_argument('--als-engine', type=str, choices=['spark', 'implicit'], default='spark',
+                           help='als方法的训练方式，spark=Spark显式评分ALS，implicit=本进程内用收藏、观看时长和评分训练隐式反馈ALS(不依赖Spark)')
+        parser.add_argument('--als-block-size', type=int, default=DEFAULT_FACTOR_BLOCK_SIZE, help='als方法按行分块计算因子相似度时每块的电影数量')
         parser.add_argument('--no-prompt', action='store_true', help='不提示确认删除已有的相似度数据')
+        parser.add_argument('--engine', type=str,
+                           choices=['spark', 'sparse', 'minhash', 'local'],
+                           default='spark',
+                           help='collectmovie方法的计算引擎，spark=Spark按行分块计算并由各分区直接写库，sparse=多热稀疏矩阵分块计算，minhash=MinHash/LSH生成候选后精确计算，local=多进程共享内存分块计算(不依赖Spark)')
+        parser.add_argument('--workers', type=int, help='local引擎的进程数以及implicit训练的线程数，默认使用全部可用CPU核')
+        parser.add_argument('--max-posting-size', type=int, default=MAX_POSTING_SIZE,
+                           help='候选生成时单个特征倒排列表的最大长度，超过则抽样，设置为0表示不限制')
+        parser.add_argument('--incremental', action='store_true',
+                           help='collectmovie方法增量更新，只重新计算新增或内容变化的电影，不删除已有数据')
+        parser.add_argument('--minhash-perm', type=int, default=MINHASH_PERMUTATIONS, help='minhash引擎的签名长度')
+        parser.add_argument('--minhash-bands', type=int, default=MINHASH_BANDS, help='minhash引擎的LSH分段数，需能整除签名长度')
+        parser.add_argument('--evaluate-minhash', type=int, default=0, metavar='SAMPLE',
+                           help='在抽样的SAMPLE部电影上比较minhash引擎与精确引擎的召回率和准确率，只输出报告，不修改数据')
         
     def handle(self, *args, **options):
         start_time = time.time()
@@ -31,10 +50,31 @@ class Command(BaseCommand):
         method = options.get('method', 'collectmovie')
         force_import = options.get('force_import', False)
         import_only = options.get('import_only', False)
-        max_records = options.get('max_records', 10000)
+        max_records = options.get('max_records', 0)
+        top_k = options.get('top_k', DEFAULT_TOP_K)
         no_prompt = options.get('no_prompt', False)
+        engine = options.get('engine', 'spark')
+        max_posting_size = options.get('max_posting_size', MAX_POSTING_SIZE)
+        incremental = options.get('incremental', False)
+        als_block_size = options.get('als_block_size', DEFAULT_FACTOR_BLOCK_SIZE)
+        als_engine = options.get('als_engine', 'spark')
+        minhash_perm = options.get('minhash_perm', MINHASH_PERMUTATIONS)
+        minhash_bands = options.get('minhash_bands', MINHASH_BANDS)
+        evaluate_minhash = options.get('evaluate_minhash', 0)
+        workers = options.get('workers')
+        # 如果设置为0，则转换为None表示不限制
+        max_posting_size = None if max_posting_size == 0 else max_posting_size
         # 如果设置为0，则转换为None表示无限制
         max_records = None if max_records == 0 else max_records
+        top_k = None if top_k == 0 else top_k
+        
+        if minhash_perm % minhash_bands:
+            self.stdout.write(self.style.ERROR('--minhash-perm 必须能被 --minhash-bands 整除'))
+            return
+        
+        if evaluate_minhash:
+            self._evaluate_minhash(evaluate_minhash, limit, min_similarity, min_ratings, top_k, minhash_perm, minhash_bands)
+            return
         
         self.stdout.write(self.style.SUCCESS('开始更新电影相似度数据...'))
         
@@ -45,13 +85,28 @@ class Command(BaseCommand):
         if min_ratings != 10:
             self.stdout.write(f"最小评分人数设为: {min_ratings}")
         self.stdout.write(f"使用的推荐算法方法: {method}")
+        if method in ('collectmovie', 'both'):
+            self.stdout.write(f"相似度计算引擎: {engine}")
+            if engine == 'minhash':
+                self.stdout.write(f"MinHash签名长度: {minhash_perm}，LSH分段数: {minhash_bands}")
+        if method in ('als', 'both'):
+            self.stdout.write(f"ALS训练方式: {als_engine}")
+        if method in ('collectmovie', 'als', 'both'):
+            self.stdout.write(f"每部电影保留的相似电影数: {top_k if top_k else '不限制'}")
+        if incremental:
+            if method != 'collectmovie':
+                self.stdout.write(self.style.ERROR('增量更新仅支持collectmovie方法'))
+                return
+            if limit:
+                raise CommandError('--incremental 需要读取全部电影才能判断哪些电影已移除，不能与 --limit 同时使用')
+            self.stdout.write("更新模式: 增量更新")
         if max_records:
             self.stdout.write(f"最大相似度记录数: {max_records}")
         else:
             self.stdout.write("相似度记录数: 不限制")
         
         # 检查是否已有相似度数据并提示确认
-        if not import_only and not no_prompt:
+        if not import_only and not no_prompt and not incremental:
             similarity_count = MovieSimilarity.objects.count()
             if similarity_count > 0:
                 self.stdout.write(self.style.WARNING(f'系统中已有 {similarity_count} 条相似度数据，继续操作将会删除所有已有数据!'))
@@ -74,13 +129,16 @@ class Command(BaseCommand):
             # 根据选择的方法更新相似度
             if method == 'content' or method == 'both':
                 self.stdout.write(self.style.SUCCESS('正在使用基于内容的方法更新电影相似度...'))
-                content_valid_pairs = update_content_based_similarities(limit=limit, min_similarity=min_similarity, no_prompt=no_prompt)
+                content_valid_pairs = update_content_based_similarities(limit=limit, min_similarity=min_similarity, no_prompt=no_prompt, max_posting_size=max_posting_size)
                 self.stdout.write(self.style.SUCCESS(f'基于内容的相似度更新完成，保存了 {content_valid_pairs} 条数据'))
                 valid_pairs += content_valid_pairs
                 
             if method == 'als' or method == 'both':
                 self.stdout.write(self.style.SUCCESS('正在使用协同过滤(ALS)方法更新电影相似度...'))
-                als_valid_pairs = build_als_model(min_similarity=min_similarity, no_prompt=no_prompt)
+                if als_engine == 'implicit':
+                    als_valid_pairs = build_implicit_als_model(min_similarity=min_similarity, no_prompt=no_prompt, top_k=top_k, block_size=als_block_size, workers=workers)
+                else:
+                    als_valid_pairs = build_als_model(min_similarity=min_similarity, no_prompt=no_prompt, top_k=top_k, block_size=als_block_size)
                 if als_valid_pairs is not None:
                     self.stdout.write(self.style.SUCCESS(f'协同过滤的相似度更新完成，保存了 {als_valid_pairs} 条数据'))
                     valid_pairs += als_valid_pairs
@@ -95,7 +153,14 @@ class Command(BaseCommand):
                     force_import=force_import,
                     min_ratings=min_ratings,
                     max_similarity_records=max_records,
-                    no_prompt=no_prompt
+                    no_prompt=no_prompt,
+                    engine=engine,
+                    max_posting_size=max_posting_size,
+                    top_k=top_k,
+                    incremental=incremental,
+                    minhash_perm=minhash_perm,
+                    minhash_bands=minhash_bands,
+                    workers=workers
                 )
                 self.stdout.write(self.style.SUCCESS(f'从收集的电影数据计算相似度完成，保存了 {collectmovie_valid_pairs} 条数据'))
                 valid_pairs += collectmovie_valid_pairs
@@ -106,4 +171,21 @@ class Command(BaseCommand):
             ))
         except Exception as e:
             self.stdout.write(self.style.ERROR(f'更新电影相似度数据失败: {str(e)}'))
-            logger.error(f'更新电影相似度数据失败: {str(e)}', exc_info=True) 
\ No newline at end of file
+            logger.error(f'更新电影相似度数据失败: {str(e)}', exc_info=True) 
+    
+    def _evaluate_minhash(self, sample_size, limit, min_similarity, min_ratings, top_k, num_perm, bands):
+        """在抽样电影上输出minhash引擎相对精确引擎的召回率和准确率"""
+        movies = load_collect_movies(limit=limit, min_ratings=min_ratings)
+        if not movies:
+            self.stdout.write(self.style.ERROR('没有找到有效的电影数据'))
+            return
+        self.stdout.write(f"评估MinHash引擎: 抽样 {min(sample_size, len(movies))} 部电影，签名长度 {num_perm}，LSH分段数 {bands}")
+        report = minhash_accuracy_report(
+            movies, sample_size=sample_size, min_similarity=min_similarity, top_k=top_k,
+            num_perm=num_perm, bands=bands
+        )
+        self.stdout.write(f"精确引擎: {report['exact_pairs']} 对，耗时 {report['exact_seconds']:.2f}秒")
+        self.stdout.write(f"MinHash引擎: {report['minhash_pairs']} 对，耗时 {report['minhash_seconds']:.2f}秒，加速 {report['speedup']:.1f}倍")
+        self.stdout.write(self.style.SUCCESS(
+            f"召回率: {report['recall']:.4f}，准确率: {report['precision']:.4f}"
+        ))
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.20 on 2026-10-18 10:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recommender', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MovieContentHash',
+            fields=[
+                ('movie_id', models.IntegerField(primary_key=True, serialize=False, verbose_name='电影ID')),
+                ('content_hash', models.CharField(max_length=40, verbose_name='内容哈希')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新时间')),
+            ],
+            options={
+                'verbose_name': '电影内容哈希',
+                'verbose_name_plural': '电影内容哈希',
+            },
+        ),
+    ]
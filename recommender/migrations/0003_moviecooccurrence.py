@@ -0,0 +1,31 @@
+# Generated by Django 4.2.20 on 2026-10-18 12:00
+
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0005_collectmoviedb_collectmovietypedb_and_more'),
+        ('recommender', '0002_moviecontenthash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MovieCooccurrence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('similarity', models.FloatField(validators=[django.core.validators.MinValueValidator(0), django.core.validators.MaxValueValidator(1)], verbose_name='共现相似度')),
+                ('movie1', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cooccurs_to', to='movies.movie', verbose_name='电影1')),
+                ('movie2', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cooccurs_from', to='movies.movie', verbose_name='电影2')),
+            ],
+            options={
+                'verbose_name': '电影共现相似度',
+                'verbose_name_plural': '电影共现相似度',
+                'ordering': ['-similarity'],
+                'unique_together': {('movie1', 'movie2')},
+            },
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.20 on 2026-10-18 14:00
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('movies', '0005_collectmoviedb_collectmovietypedb_and_more'),
+        ('recommender', '0003_moviecooccurrence'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserRecommendation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.PositiveSmallIntegerField(verbose_name='名次')),
+                ('score', models.FloatField(verbose_name='推荐分数')),
+                ('source', models.CharField(choices=[('als', 'ALS因子'), ('cooccurrence', '共现协同过滤'), ('content', '内容相似度'), ('popular', '热门电影')], max_length=16, verbose_name='推荐来源')),
+                ('movie', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='movies.movie', verbose_name='电影')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='precomputed_recommendations', to=settings.AUTH_USER_MODEL, verbose_name='用户')),
+            ],
+            options={
+                'verbose_name': '用户推荐',
+                'verbose_name_plural': '用户推荐',
+                'ordering': ['user', 'rank'],
+                'unique_together': {('user', 'rank')},
+            },
+        ),
+    ]
@@ -33,3 +33,54 @@ class MovieSimilarity(models.Model):
         
     def __str__(self):
         return f'{self.movie1.title} - {self.movie2.title}: {self.similarity}'
+
+class MovieCooccurrence(models.Model):
+    """电影共现相似度模型，由用户的高评分、收藏和观看历史计算，结构与电影相似度相同"""
+    movie1 = models.ForeignKey(Movie, on_delete=models.CASCADE, verbose_name='电影1', related_name='cooccurs_to')
+    movie2 = models.ForeignKey(Movie, on_delete=models.CASCADE, verbose_name='电影2', related_name='cooccurs_from')
+    similarity = models.FloatField('共现相似度', validators=[MinValueValidator(0), MaxValueValidator(1)])
+    
+    class Meta:
+        verbose_name = '电影共现相似度'
+        verbose_name_plural = verbose_name
+        unique_together = ['movie1', 'movie2']
+        ordering = ['-similarity']
+        
+    def __str__(self):
+        return f'{self.movie1.title} - {self.movie2.title}: {self.similarity}'
+
+class UserRecommendation(models.Model):
+    """离线预计算的用户推荐，每个活跃用户按名次保存前N部电影"""
+    SOURCE_CHOICES = [
+        ('als', 'ALS因子'),
+        ('cooccurrence', '共现协同过滤'),
+        ('content', '内容相似度'),
+        ('popular', '热门电影'),
+    ]
+    user = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name='用户', related_name='precomputed_recommendations')
+    rank = models.PositiveSmallIntegerField('名次')
+    movie = models.ForeignKey(Movie, on_delete=models.CASCADE, verbose_name='电影', related_name='+')
+    score = models.FloatField('推荐分数')
+    source = models.CharField('推荐来源', max_length=16, choices=SOURCE_CHOICES)
+    
+    class Meta:
+        verbose_name = '用户推荐'
+        verbose_name_plural = verbose_name
+        unique_together = ['user', 'rank']
+        ordering = ['user', 'rank']
+        
+    def __str__(self):
+        return f'{self.user.username} #{self.rank} {self.movie.title} ({self.source})'
+
+class MovieContentHash(models.Model):
+    """电影内容哈希模型，记录上次计算相似度时每部电影的特征快照，用于增量更新"""
+    movie_id = models.IntegerField('电影ID', primary_key=True)
+    content_hash = models.CharField('内容哈希', max_length=40)
+    updated_at = models.DateTimeField('更新时间', auto_now=True)
+    
+    class Meta:
+        verbose_name = '电影内容哈希'
+        verbose_name_plural = verbose_name
+        
+    def __str__(self):
+        return f'{self.movie_id}: {self.content_hash}'
@@ -0,0 +1,232 @@
+"""
+评分数据的流式加载
+
+用pymysql的服务端游标(SSCursor)按块读取 users_userrating (以及可选的收藏和观看历史)，
+直接写入预分配的numpy数组，不经过Django模型实例、字典或pandas DataFrame；
+再用 np.unique(return_inverse=True) 把用户ID和电影ID向量化地编码为连续下标。
+
+ID能放进int32时按int32保存并原地编码，1000万条评分常驻约130MB，
+编码时排序用的临时数组另需约170MB。
+"""
+import itertools
+import logging
+import time
+import numpy as np
+import pymysql
+from scipy.sparse import csr_matrix
+from users.models import UserRating, UserFavorite, UserHistory
+from .similarity_store import connection_config
+
+logger = logging.getLogger('django')
+
+# 服务端游标每次取回的行数
+RATING_FETCH_SIZE = 50000
+
+# kinds 数组中交互的种类
+SIGNAL_RATING = 0
+SIGNAL_FAVORITE = 1
+SIGNAL_HISTORY = 2
+
+# 各类交互记录发生时间的列，用于按时间截取
+TIME_COLUMNS = {
+    SIGNAL_RATING: 'created_time',
+    SIGNAL_FAVORITE: 'created_time',
+    SIGNAL_HISTORY: 'watch_time',
+}
+
+_INT32_MAX = np.iinfo(np.int32).max
+
+
+class Interactions:
+    """
+    编码后的用户-电影交互
+
+    user_ids/item_ids 为升序的原始ID，user_idx/item_idx 为每条交互对应的下标(int32)，
+    values 为评分或观看时长(分钟)，收藏为1，kinds 为交互种类
+    """
+
+    def __init__(self, user_ids, item_ids, user_idx, item_idx, values, kinds):
+        self.user_ids = user_ids
+        self.item_ids = item_ids
+        self.user_idx = user_idx
+        self.item_idx = item_idx
+        self.values = values
+        self.kinds = kinds
+
+    def __len__(self):
+        return len(self.values)
+
+    @property
+    def n_users(self):
+        return len(self.user_ids)
+
+    @property
+    def n_items(self):
+        return len(self.item_ids)
+
+    def select(self, kind):
+        """只保留某一种交互的 (user_idx, item_idx, values)"""
+        mask = self.kinds == kind
+        return self.user_idx[mask], self.item_idx[mask], self.values[mask]
+
+    def to_csr(self, weights=None):
+        """
+        构建 用户数×电影数 的CSR矩阵，同一用户对同一电影的多条交互相加
+
+        参数:
+            weights: {种类: 权重}，为None时直接使用 values
+        """
+        values = self.values
+        if weights is not None:
+            values = values * np.asarray(
+                [weights.get(kind, 0.0) for kind in range(SIGNAL_HISTORY + 1)], dtype=np.float32
+            )[self.kinds]
+        matrix = csr_matrix(
+            (values, (self.user_idx, self.item_idx)),
+            shape=(self.n_users, self.n_items), dtype=np.float32,
+        )
+        matrix.sum_duplicates()
+        return matrix
+
+
+class _ColumnBuffer:
+    """可增长的 (user_id, movie_id, value, kind) 列缓冲，ID超出int32时自动改为int64"""
+
+    def __init__(self, capacity):
+        self.size = 0
+        self.users = np.empty(capacity, dtype=np.int32)
+        self.items = np.empty(capacity, dtype=np.int32)
+        self.values = np.empty(capacity, dtype=np.float32)
+        self.kinds = np.empty(capacity, dtype=np.int8)
+
+    def _reserve(self, extra):
+        needed = self.size + extra
+        if needed <= len(self.values):
+            return
+        capacity = max(needed, int(len(self.values) * 1.25) + 1)
+        for name in ('users', 'items', 'values', 'kinds'):
+            old = getattr(self, name)
+            new = np.empty(capacity, dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+
+    def append(self, chunk, kind):
+        """追加一块 (n, 2或3) 的数组，第三列缺省时值为1"""
+        n = len(chunk)
+        self._reserve(n)
+        for name, column in (('users', chunk[:, 0]), ('items', chunk[:, 1])):
+            array = getattr(self, name)
+            if array.dtype == np.int32 and n and column.max() > _INT32_MAX:
+                array = array.astype(np.int64)
+                setattr(self, name, array)
+            array[self.size:self.size + n] = column
+        self.values[self.size:self.size + n] = chunk[:, 2] if chunk.shape[1] > 2 else 1.0
+        self.kinds[self.size:self.size + n] = kind
+        self.size += n
+
+    def trimmed(self):
+        return (self.users[:self.size], self.items[:self.size], self.values[:self.size], self.kinds[:self.size])
+
+
+def _stream_table(conn, sql, columns, buffer, kind, fetch_size, params=None):
+    """用服务端游标按块读取查询结果并追加到缓冲，返回读取的行数"""
+    count = 0
+    with conn.cursor(pymysql.cursors.SSCursor) as cursor:
+        cursor.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(fetch_size)
+            if not rows:
+                break
+            chunk = np.fromiter(itertools.chain.from_iterable(rows), dtype=np.float64, count=len(rows) * columns)
+            buffer.append(chunk.reshape(-1, columns), kind)
+            count += len(rows)
+    return count
+
+
+def _encode(ids):
+    """
+    把原始ID编码为连续下标，返回 (升序的唯一ID(int64), int32下标)
+
+    结果与 np.unique(ids, return_inverse=True) 相同，但下标直接写回int32的 ids 数组，
+    不生成int64的inverse和cumsum临时数组
+    """
+    order = np.argsort(ids)
+    sorted_ids = ids[order]
+    starts = np.empty(len(sorted_ids), dtype=bool)
+    starts[:1] = True
+    np.not_equal(sorted_ids[1:], sorted_ids[:-1], out=starts[1:])
+    unique_ids = sorted_ids[starts].astype(np.int64)
+    del sorted_ids
+    codes = np.cumsum(starts, dtype=np.int32)
+    codes -= 1
+    del starts
+    if ids.dtype == np.int32:
+        ids[order] = codes
+        return unique_ids, ids
+    inverse = np.empty(len(ids), dtype=np.int32)
+    inverse[order] = codes
+    return unique_ids, inverse
+
+
+def _where_clause(kind, min_rating, until):
+    """按评分下限和截止时间生成WHERE子句及其参数"""
+    conditions, params = [], []
+    if kind == SIGNAL_RATING and min_rating is not None:
+        conditions.append('rating >= %s')
+        params.append(min_rating)
+    if until is not None:
+        conditions.append(f'`{TIME_COLUMNS[kind]}` <= %s')
+        params.append(until)
+    return (f" WHERE {' AND '.join(conditions)}" if conditions else ''), params
+
+
+def load_interactions(favorites=False, history=False, fetch_size=RATING_FETCH_SIZE, min_rating=None, until=None):
+    """
+    流式读取评分(以及可选的收藏和观看历史)并编码为连续下标
+
+    参数:
+        favorites: 是否同时读取用户收藏，作为值为1的隐式反馈
+        history: 是否同时读取观看历史，值为观看时长(分钟)
+        min_rating: 只读取不低于该分数的评分
+        until: 只读取发生时间不晚于该时间的交互(见 TIME_COLUMNS)
+
+    返回:
+        Interactions
+    """
+    start_time = time.time()
+    sources = [(SIGNAL_RATING, UserRating._meta.db_table, 'user_id, movie_id, rating', 3)]
+    if favorites:
+        sources.append((SIGNAL_FAVORITE, UserFavorite._meta.db_table, 'user_id, movie_id', 2))
+    if history:
+        sources.append((SIGNAL_HISTORY, UserHistory._meta.db_table, 'user_id, movie_id, watch_duration', 3))
+
+    conn = pymysql.connect(**connection_config())
+    try:
+        # 先按行数预分配，读取期间新增的行由缓冲自动扩容
+        with conn.cursor() as cursor:
+            capacity = 0
+            for kind, table, _, _ in sources:
+                where, params = _where_clause(kind, min_rating, until)
+                cursor.execute(f"SELECT COUNT(*) FROM `{table}`{where}", params)
+                capacity += cursor.fetchone()[0]
+        buffer = _ColumnBuffer(capacity)
+        for kind, table, columns, width in sources:
+            where, params = _where_clause(kind, min_rating, until)
+            count = _stream_table(conn, f"SELECT {columns} FROM `{table}`{where}", width, buffer, kind, fetch_size, params)
+            logger.info(f"[推荐系统] 从 {table} 读取了 {count} 条交互数据")
+    finally:
+        conn.close()
+
+    users, items, values, kinds = buffer.trimmed()
+    # 编码完一列就释放其原始ID
+    del buffer
+    user_ids, user_idx = _encode(users)
+    del users
+    item_ids, item_idx = _encode(items)
+    del items
+    interactions = Interactions(user_ids, item_ids, user_idx, item_idx, values, kinds)
+    logger.info(
+        f"[推荐系统] 交互数据加载完成: {len(interactions)} 条，{interactions.n_users} 个用户，"
+        f"{interactions.n_items} 部电影，耗时 {time.time() - start_time:.2f}秒"
+    )
+    return interactions
@@ -2,39 +2,77 @@ from django.db.models import Q, Count, Avg, F
 from django.db import connection
 import numpy as np
 from scipy.sparse import csr_matrix
-from sklearn.metrics.pairwise import cosine_similarity
 from movies.models import Movie, Genre
+from movies.cards import refresh_movie_cards
+from movies.genre_index import build_genre_toplists
+from movies.memberships import sync_movie_memberships
 from users.models import UserRating, UserFavorite, UserHistory
-from .models import MovieSimilarity
+from .models import MovieSimilarity, MovieContentHash, MovieCooccurrence
+from .similarity_store import SimilarityTableWriter, ShadowTableWriter, connection_config
+from .factor_similarity import factor_top_k_pairs, DEFAULT_FACTOR_BLOCK_SIZE
+from .factor_store import save_factors, get_factor_store
 import logging
 import json
 import os
 import pandas as pd
 import time
-import pyspark
-from pyspark.sql import SparkSession
-from pyspark.ml.linalg import Vectors
-from pyspark.ml.feature import VectorAssembler
-from pyspark.ml.recommendation import ALS
-from .utils import parse_image_data
+from .utils import parse_image_data, parse_names, parse_str_list, parse_rating_average
+from .feature_store import load_movie_features
+from .component_store import similarity_weights, save_similarity_components, SimilarityComponents
+from .rating_loader import load_interactions, SIGNAL_RATING, SIGNAL_FAVORITE, SIGNAL_HISTORY
+from .cooccurrence import refresh_cooccurrence, normalized_pairs, DEFAULT_MIN_COOCCURRENCE
+from .recommendation_store import precomputed_recommendations, neighbor_recommendations
+from .implicit_als import (
+    confidence_matrix, train_implicit_als, SIGNAL_WEIGHTS, DEFAULT_FACTORS, DEFAULT_ITERATIONS,
+    DEFAULT_REGULARIZATION, DEFAULT_ALPHA, DEFAULT_CG_STEPS,
+)
+from .content_similarity import (
+    iter_similarity_pairs, iter_top_k_pairs, build_feature_matrices, MAX_POSTING_SIZE, DEFAULT_TOP_K,
+    build_pair_features, score_pairs, iter_candidate_pair_blocks, rerank_top_k_pairs, SIMILARITY_WEIGHTS,
+    movie_content_hash, neighbor_floors, incremental_top_k_pairs,
+    minhash_top_k_pairs, MINHASH_PERMUTATIONS, MINHASH_BANDS,
+)
 import sys
 import random
 import math
+import heapq
+import shutil
+import tempfile
+import zipfile
 from tqdm import tqdm
 from django.conf import settings
 from django.utils import timezone
 from django.contrib.auth import get_user_model
 from django.db.models.functions import Round, Cast
-from pyspark.sql.functions import col, expr
-from pyspark.sql.types import IntegerType, DoubleType
+from .local_engine import iter_local_pairs, feature_arrays
 
 # 初始化日志
 logger = logging.getLogger('django')
 
+# Spark引擎每个分区计算的行数
+SPARK_BLOCK_SIZE = 2000
+
+# 检查是否安装了pyspark，没有JVM的机器上可以使用local或sparse引擎
+try:
+    import pyspark
+    from pyspark.sql import SparkSession
+    from pyspark.ml.linalg import Vectors
+    from pyspark.ml.feature import VectorAssembler
+    from pyspark.ml.recommendation import ALS
+    from pyspark.sql.functions import col, expr
+    from pyspark.sql.types import IntegerType, DoubleType
+    HAS_SPARK = True
+except ImportError:
+    logger.warning("[推荐系统] 无法导入pyspark，Spark计算引擎和ALS模型不可用")
+    HAS_SPARK = False
+
 User = get_user_model()
 
 def get_spark_session():
     """获取或创建Spark会话"""
+    if not HAS_SPARK:
+        raise RuntimeError("未安装pyspark，无法创建Spark会话")
+    
     # 设置环境变量以确保Spark使用当前Python环境
     os.environ['PYSPARK_PYTHON'] = sys.executable
     os.environ['PYSPARK_DRIVER_PYTHON'] = sys.executable
@@ -74,7 +112,8 @@ def get_spark_session():
         .getOrCreate()
 
 def calculate_content_similarity(movie1, movie2):
-    """计算两部电影的内容相似度"""
+    """计算两部电影的内容相似度，各维度权重见 settings.RECOMMENDER['SIMILARITY_WEIGHTS']"""
+    weights = similarity_weights()
     similarity = 0.0
     # 初始化所有相似度变量，避免引用前未定义
     genre_similarity = 0.0
@@ -87,38 +126,53 @@ def calculate_content_similarity(movie1, movie2):
         genres1 = set([g.name for g in movie1.genres.all()])
         genres2 = set([g.name for g in movie2.genres.all()])
 
-        # 类型相似度 (权重: 0.4)
+        # 类型相似度
         if genres1 and genres2:
             genre_similarity = len(genres1.intersection(genres2)) / max(len(genres1), len(genres2), 1)
-            similarity += 0.4 * genre_similarity
+            similarity += weights['genres'] * genre_similarity
         
-        # 导演相似度 (权重: 0.1)
+        # 导演相似度
         if movie1.director and movie2.director:
             director1 = set(movie1.director.lower().split(','))
             director2 = set(movie2.director.lower().split(','))
             if director1 and director2:
                 director_similarity = len(director1.intersection(director2)) / max(len(director1), len(director2), 1)
-        similarity += 0.1 * director_similarity
+        similarity += weights['directors'] * director_similarity
         
-        # 演员相似度 (权重: 0.1)
+        # 演员相似度
         if movie1.actors and movie2.actors:
             actors1 = set(movie1.actors.lower().split(','))
             actors2 = set(movie2.actors.lower().split(','))
             if actors1 and actors2:
                 actor_similarity = len(actors1.intersection(actors2)) / max(len(actors1), len(actors2), 1)
-        similarity += 0.1 * actor_similarity
+        similarity += weights['actors'] * actor_similarity
         
-        # 标签相似度 (权重: 0.4) - 从电影类型再次作为标签进行计算
+        # 标签相似度 - 从电影类型再次作为标签进行计算
         tag_similarity = genre_similarity  # 使用类型作为标签的近似
-        similarity += 0.4 * tag_similarity
+        similarity += weights['tags'] * tag_similarity
         
         return similarity
     except Exception as e:
         logger.error(f"计算电影 {movie1.id} 和 {movie2.id} 的相似度时出错: {str(e)}")
         return 0.0
 
-def update_content_based_similarities(limit=None, min_similarity=0.1, no_prompt=False):
-    """更新基于内容的电影相似度"""
+def _content_features(movie):
+    """提取Movie对象用于候选生成的特征，与calculate_content_similarity使用的字段一致"""
+    genres = [g.name for g in movie.genres.all()]
+    return {
+        'genres': genres,
+        'directors': movie.director.lower().split(',') if movie.director else [],
+        'actors': movie.actors.lower().split(',') if movie.actors else [],
+        'tags': genres,  # 使用类型作为标签的近似
+    }
+
+def update_content_based_similarities(limit=None, min_similarity=0.1, no_prompt=False, max_posting_size=MAX_POSTING_SIZE):
+    """
+    更新基于内容的电影相似度
+    
+    只对至少共享一个类型、导演或演员的电影对计算相似度，规则与 calculate_content_similarity 一致，
+    max_posting_size 控制高频特征倒排列表的抽样上限
+    """
     print(f"[推荐系统] 开始更新电影内容相似度数据...")
     
     # 获取所有电影
@@ -140,13 +194,11 @@ def update_content_based_similarities(limit=None, min_similarity=0.1, no_prompt=
                 print("[推荐系统] 用户取消了相似度计算操作")
                 return 0
     
-    # 清除旧的相似度数据
-    print(f"[推荐系统] 清除旧的相似度数据...")
-    MovieSimilarity.objects.all().delete()
+    # 相似度表被整体替换后，collectmovie增量更新的哈希基线随之失效
+    MovieContentHash.objects.all().delete()
     
-    # 计算并更新相似度
-    batch_size = 1000
-    similarity_objects = []
+    # 计算并写入影子表，完成后替换线上表
+    print(f"[推荐系统] 相似度数据将写入影子表，完成后替换线上表...")
     total_pairs = 0
     valid_pairs = 0
     
@@ -154,59 +206,54 @@ def update_content_based_similarities(limit=None, min_similarity=0.1, no_prompt=
     movie_list = list(movies)
     movie_count = len(movie_list)
     
-    for i, movie1 in enumerate(movie_list):
-        if i % 10 == 0:
-            elapsed = time.time() - start_time
-            eta = (elapsed / (i+1)) * (movie_count - i - 1) if i > 0 else 0
-            print(f"[推荐系统] 处理进度: {i}/{movie_count} ({i/movie_count*100:.2f}%), 已用时间: {elapsed:.0f}秒, 预计剩余: {eta:.0f}秒")
-        
-        for j in range(i+1, len(movie_list)):
-            movie2 = movie_list[j]
-            similarity = calculate_content_similarity(movie1, movie2)
-            total_pairs += 1
-            
-            if similarity >= min_similarity:
-                similarity_objects.append(
-                    MovieSimilarity(
-                        movie1=movie1,
-                        movie2=movie2,
-                        similarity=similarity
-                    )
-                )
-                valid_pairs += 1
+    # 通过倒排列表生成候选对，没有任何共同特征的电影对相似度必为0，直接跳过
+    movie_features = [_content_features(movie) for movie in movie_list]
+    movie_ids = np.asarray([movie.id for movie in movie_list], dtype=np.int64)
+    # 类型和标签编码为位图，导演和演员编码为有序ID数组，按批向量化计算交集
+    pair_features = build_pair_features(build_feature_matrices(movie_features))
+    weights = similarity_weights()
+    
+    with ShadowTableWriter() as writer:
+        for rows, cols, i in iter_candidate_pair_blocks(movie_features, max_posting_size=max_posting_size):
+            # calculate_content_similarity 没有类型基础分，阈值传0避免触发
+            similarities = score_pairs(pair_features, rows, cols, 0, weights)
+            keep = similarities >= min_similarity
+            total_pairs += len(rows)
+            valid_pairs += int(keep.sum())
+            for movie1_id, movie2_id, similarity in zip(movie_ids[rows[keep]].tolist(), movie_ids[cols[keep]].tolist(), similarities[keep].tolist()):
+                writer.write(movie1_id, movie2_id, similarity)
             
-            if len(similarity_objects) >= batch_size:
-                MovieSimilarity.objects.bulk_create(
-                    similarity_objects,
-                    ignore_conflicts=True
-                )
-                print(f"[推荐系统] 已保存 {valid_pairs} 条相似度数据 (有效比例: {valid_pairs/total_pairs*100:.2f}%)")
-                similarity_objects = []
-    
-    if similarity_objects:
-        MovieSimilarity.objects.bulk_create(
-            similarity_objects,
-            ignore_conflicts=True
-        )
+            elapsed = time.time() - start_time
+            eta = (elapsed / (i+1)) * (movie_count - i - 1)
+            print(f"[推荐系统] 处理进度: {i+1}/{movie_count} ({(i+1)/movie_count*100:.2f}%), 已用时间: {elapsed:.0f}秒, 预计剩余: {eta:.0f}秒")
     
-    print(f"[推荐系统] 电影相似度更新完成！总共处理了 {total_pairs} 对电影，保存了 {valid_pairs} 条相似度数据")
-    print(f"[推荐系统] 有效相似度比例: {valid_pairs/total_pairs*100:.2f}%")
+    print(f"[推荐系统] 电影相似度更新完成！总共处理了 {total_pairs} 对候选电影，保存了 {valid_pairs} 条相似度数据")
+    if total_pairs:
+        print(f"[推荐系统] 有效相似度比例: {valid_pairs/total_pairs*100:.2f}%")
     return valid_pairs
 
-def build_als_model(min_similarity=0.1, no_prompt=False):
-    """使用ALS(交替最小二乘法)构建协同过滤推荐模型"""
+def build_als_model(min_similarity=0.1, no_prompt=False, top_k=DEFAULT_TOP_K, block_size=DEFAULT_FACTOR_BLOCK_SIZE):
+    """
+    使用ALS(交替最小二乘法)构建协同过滤推荐模型
+    
+    电影因子归一化后按行分块做矩阵乘法计算余弦相似度，
+    每部电影保留 top_k 个最相似的电影，top_k 为None时保留所有超过阈值的电影对
+    """
     print(f"[推荐系统] 开始构建ALS协同过滤模型...")
+    if not HAS_SPARK:
+        logger.warning("[推荐系统] 未安装pyspark，改用本地隐式反馈ALS")
+        return build_implicit_als_model(min_similarity, no_prompt, top_k, block_size)
     
     try:
         # 创建Spark会话
         spark = get_spark_session()
         print(f"[推荐系统] Spark会话已创建，版本: {spark.version}")
         
-        # 从数据库获取评分数据
+        # 从数据库流式读取评分数据，用户ID和电影ID直接编码为连续下标
         print(f"[推荐系统] 从数据库加载评分数据...")
-        ratings = UserRating.objects.all().values('user_id', 'movie_id', 'rating')
+        ratings = load_interactions()
         
-        if not ratings.exists():
+        if not len(ratings):
             print(f"[推荐系统] 没有评分数据，无法构建ALS模型")
             spark.stop()
             return 0
@@ -223,27 +270,18 @@ def build_als_model(min_similarity=0.1, no_prompt=False):
                     spark.stop()
                     return 0
         
-        # 清除现有的相似度数据
-        MovieSimilarity.objects.all().delete()
-        print(f"[推荐系统] 已清除旧的相似度数据")
-        
-        # 转换为Pandas DataFrame进行预处理
-        ratings_df = pd.DataFrame(list(ratings))
-        print(f"[推荐系统] 从数据库加载了 {len(ratings_df)} 条评分数据")
+        # 相似度表被整体替换后，collectmovie增量更新的哈希基线随之失效
+        MovieContentHash.objects.all().delete()
         
-        # 用整数索引替换用户ID和电影ID
-        user_ids = ratings_df['user_id'].unique()
-        movie_ids = ratings_df['movie_id'].unique()
+        print(f"[推荐系统] 从数据库加载了 {len(ratings)} 条评分数据")
         
-        user_id_map = {uid: i for i, uid in enumerate(user_ids)}
-        movie_id_map = {mid: i for i, mid in enumerate(movie_ids)}
-        reverse_movie_map = {i: mid for mid, i in movie_id_map.items()}
-        
-        ratings_df['user_idx'] = ratings_df['user_id'].map(user_id_map)
-        ratings_df['movie_idx'] = ratings_df['movie_id'].map(movie_id_map)
-        
-        # 使用Spark DataFrame
-        spark_ratings = spark.createDataFrame(ratings_df[['user_idx', 'movie_idx', 'rating']])
+        # 直接由numpy列构建DataFrame，启用Arrow后整列传给Spark
+        spark.conf.set("spark.sql.execution.arrow.pyspark.enabled", "true")
+        spark_ratings = spark.createDataFrame(pd.DataFrame({
+            'user_idx': ratings.user_idx,
+            'movie_idx': ratings.item_idx,
+            'rating': ratings.values,
+        }, copy=False))
         
         # 创建ALS模型
         als = ALS(
@@ -260,67 +298,22 @@ def build_als_model(min_similarity=0.1, no_prompt=False):
         print(f"[推荐系统] 拟合ALS模型...")
         model = als.fit(spark_ratings)
         
-        # 获取电影特征
+        # 获取电影特征，一次性转换为矩阵
         movie_factors = model.itemFactors.toPandas()
-        
-        # 获取电影对象
-        movie_objects = {m.id: m for m in Movie.objects.filter(id__in=movie_ids)}
-        
-        # 计算相似度
-        print(f"[推荐系统] 基于ALS模型计算电影相似度...")
-        similarities = []
-        total_pairs = 0
-        valid_pairs = 0
-        
-        for i in range(len(movie_factors)):
-            if i % 10 == 0:
-                print(f"[推荐系统] ALS相似度计算进度: {i}/{len(movie_factors)} ({i/len(movie_factors)*100:.2f}%)")
-            
-            movie1_idx = movie_factors.iloc[i]['id']
-            movie1_id = reverse_movie_map[movie1_idx]
-            
-            if movie1_id not in movie_objects:
-                continue
-                
-            movie1 = movie_objects[movie1_id]
-            vec1 = np.array(movie_factors.iloc[i]['features'])
-            
-            for j in range(i + 1, len(movie_factors)):
-                movie2_idx = movie_factors.iloc[j]['id']
-                movie2_id = reverse_movie_map[movie2_idx]
-                
-                if movie2_id not in movie_objects:
-                    continue
-                    
-                movie2 = movie_objects[movie2_id]
-                vec2 = np.array(movie_factors.iloc[j]['features'])
-                
-                # 计算余弦相似度
-                similarity = float(cosine_similarity([vec1], [vec2])[0][0])
-                
-                total_pairs += 1
-                
-                if similarity >= min_similarity:
-                    similarities.append(
-                        MovieSimilarity(
-                            movie1=movie1,
-                            movie2=movie2,
-                            similarity=similarity
-                        )
-                    )
-                    valid_pairs += 1
-                
-                # 批量插入
-                if len(similarities) >= 1000:
-                    MovieSimilarity.objects.bulk_create(similarities, ignore_conflicts=True)
-                    print(f"[推荐系统] 已保存 {valid_pairs} 条相似度数据 (共 {total_pairs} 对, 有效率: {valid_pairs/total_pairs*100:.2f}%)")
-                    similarities = []
-        
-        # 保存剩余数据
-        if similarities:
-            MovieSimilarity.objects.bulk_create(similarities, ignore_conflicts=True)
-        
-        print(f"[推荐系统] ALS电影相似度更新完成！总共处理了 {total_pairs} 对电影，保存了 {valid_pairs} 条相似度数据")
+        user_factors_df = model.userFactors.toPandas()
+        valid_pairs = _save_als_results(
+            user_ids=ratings.user_ids[user_factors_df['id'].to_numpy(dtype=np.int64)],
+            user_factors=np.asarray(user_factors_df['features'].tolist(), dtype=np.float32),
+            item_ids=ratings.item_ids[movie_factors['id'].to_numpy(dtype=np.int64)],
+            item_factors=np.asarray(movie_factors['features'].tolist(), dtype=np.float32),
+            meta={
+                'reg_param': als.getRegParam(),
+                'max_iter': als.getMaxIter(),
+                'nonnegative': als.getNonnegative(),
+                'ratings': len(ratings),
+            },
+            min_similarity=min_similarity, top_k=top_k, block_size=block_size,
+        )
         
         # 关闭Spark会话
         spark.stop()
@@ -332,6 +325,115 @@ def build_als_model(min_similarity=0.1, no_prompt=False):
         logger.error(f"ALS模型构建失败: {str(e)}", exc_info=True)
         return 0
 
+def build_implicit_als_model(min_similarity=0.1, no_prompt=False, top_k=DEFAULT_TOP_K, block_size=DEFAULT_FACTOR_BLOCK_SIZE, workers=None):
+    """
+    不依赖Spark，在本进程内用收藏、观看时长和评分训练隐式反馈ALS
+    
+    因子以与Spark路径相同的格式保存，电影相似度的计算和写入方式也相同。
+    训练参数见 settings.RECOMMENDER 中的 IMPLICIT_* 配置。
+    
+    参数:
+        workers: 训练使用的线程数，默认使用全部可用CPU核
+    """
+    print(f"[推荐系统] 开始构建隐式反馈ALS模型...")
+    config = settings.RECOMMENDER
+    factors = config.get('IMPLICIT_FACTORS', DEFAULT_FACTORS)
+    iterations = config.get('IMPLICIT_ITERATIONS', DEFAULT_ITERATIONS)
+    regularization = config.get('IMPLICIT_REGULARIZATION', DEFAULT_REGULARIZATION)
+    alpha = config.get('IMPLICIT_ALPHA', DEFAULT_ALPHA)
+    configured_weights = config.get('IMPLICIT_SIGNAL_WEIGHTS') or {}
+    weights = dict(SIGNAL_WEIGHTS)
+    for name, kind in (('rating', SIGNAL_RATING), ('favorite', SIGNAL_FAVORITE), ('history', SIGNAL_HISTORY)):
+        if name in configured_weights:
+            weights[kind] = float(configured_weights[name])
+    
+    try:
+        # 评分、收藏和观看历史一起流式读取
+        print(f"[推荐系统] 从数据库加载评分、收藏和观看历史...")
+        interactions = load_interactions(favorites=True, history=True)
+        if not len(interactions):
+            print(f"[推荐系统] 没有用户行为数据，无法构建ALS模型")
+            return 0
+        
+        # 检查是否已有相似度数据
+        similarity_count = MovieSimilarity.objects.count()
+        if similarity_count > 0 and not no_prompt:
+            if 'DJANGO_SETTINGS_MODULE' not in os.environ:
+                confirm = input(f'[推荐系统] 系统中已有 {similarity_count} 条相似度数据，继续操作将会删除所有已有数据! 是否确认? (y/n): ')
+                if confirm.lower() != 'y':
+                    print("[推荐系统] 用户取消了相似度计算操作")
+                    return 0
+        
+        # 相似度表被整体替换后，collectmovie增量更新的哈希基线随之失效
+        MovieContentHash.objects.all().delete()
+        
+        confidence = confidence_matrix(interactions, alpha=alpha, weights=weights)
+        print(f"[推荐系统] 拟合隐式ALS模型: {confidence.shape[0]} 个用户，{confidence.shape[1]} 部电影，{confidence.nnz} 个交互，rank={factors}...")
+        start_time = time.time()
+        user_factors, item_factors = train_implicit_als(
+            confidence, factors=factors, iterations=iterations, regularization=regularization,
+            cg_steps=DEFAULT_CG_STEPS, workers=workers,
+        )
+        print(f"[推荐系统] 隐式ALS训练完成，耗时 {time.time() - start_time:.2f}秒")
+        
+        return _save_als_results(
+            user_ids=interactions.user_ids,
+            user_factors=user_factors,
+            item_ids=interactions.item_ids,
+            item_factors=item_factors,
+            meta={
+                'implicit': True,
+                'reg_param': regularization,
+                'max_iter': iterations,
+                'nonnegative': False,
+                'alpha': alpha,
+                'rating_weight': weights[SIGNAL_RATING],
+                'favorite_weight': weights[SIGNAL_FAVORITE],
+                'history_weight': weights[SIGNAL_HISTORY],
+                'ratings': len(interactions),
+            },
+            min_similarity=min_similarity, top_k=top_k, block_size=block_size,
+        )
+    except Exception as e:
+        print(f"[推荐系统] 隐式ALS模型构建失败: {str(e)}")
+        logger.error(f"隐式ALS模型构建失败: {str(e)}", exc_info=True)
+        return 0
+
+def _save_als_results(user_ids, user_factors, item_ids, item_factors, meta, min_similarity, top_k, block_size):
+    """
+    保存ALS因子，并用电影因子计算相似度，写入影子表后替换线上表
+    
+    返回:
+        写入的相似度记录数
+    """
+    # 保存用户和电影因子，供Web进程内存映射后在线打分
+    try:
+        save_factors(user_ids=user_ids, user_factors=user_factors, item_ids=item_ids, item_factors=item_factors, meta=meta)
+    except Exception as e:
+        logger.error(f"[推荐系统] 保存ALS因子失败: {str(e)}", exc_info=True)
+    
+    # 只为movies_movie表中存在的电影计算相似度
+    existing_ids = set(Movie.objects.filter(id__in=item_ids.tolist()).values_list('id', flat=True))
+    keep = np.isin(item_ids, list(existing_ids))
+    factor_movie_ids = item_ids[keep]
+    factors = item_factors[keep]
+    
+    # 计算相似度
+    print(f"[推荐系统] 基于ALS模型计算 {len(factors)} 部电影的相似度，分块大小: {block_size}...")
+    movie1_ids, movie2_ids, similarities = factor_top_k_pairs(
+        factor_movie_ids, factors, min_similarity=min_similarity, top_k=top_k, block_size=block_size
+    )
+    total_pairs = len(factors) * (len(factors) - 1) // 2
+    valid_pairs = len(similarities)
+    
+    # 写入影子表，完成后替换线上表
+    with ShadowTableWriter() as writer:
+        for movie1_id, movie2_id, similarity in zip(movie1_ids.tolist(), movie2_ids.tolist(), similarities.tolist()):
+            writer.write(movie1_id, movie2_id, similarity)
+    
+    print(f"[推荐系统] ALS电影相似度更新完成！总共处理了 {total_pairs} 对电影，保存了 {valid_pairs} 条相似度数据")
+    return valid_pairs
+
 def get_movie_recommendations(movie, limit=6):
     """获取电影推荐"""
     print(f"[推荐系统] 开始为电影 ID:{movie.id} 标题:{movie.title} 生成推荐")
@@ -352,9 +454,47 @@ def get_movie_recommendations(movie, limit=6):
             similar_movies.append(similar_movie)
             print(f"[推荐系统] 添加内容相似电影: ID:{similar_movie.id} 标题:{similar_movie.title} 相似度:{sim.similarity:.4f}")
     
-    # 如果基于内容的推荐不足，补充协同过滤推荐
+    # 预计算的相似度不足时，用ALS因子的近似最近邻索引补充
     if len(similar_movies) < limit:
-        print(f"[推荐系统] 内容相似电影不足 ({len(similar_movies)}/{limit})，使用协同过滤补充推荐...")
+        try:
+            store = get_factor_store()
+            neighbors = store.similar(movie.id, limit * 2) if store is not None else []
+        except Exception as e:
+            logger.error(f"[推荐系统] ALS近似最近邻查询失败: {str(e)}")
+            neighbors = []
+        if neighbors:
+            seen_ids = {m.id for m in similar_movies}
+            neighbor_movies = Movie.objects.in_bulk([movie_id for movie_id, _ in neighbors])
+            for movie_id, similarity in neighbors:
+                neighbor = neighbor_movies.get(movie_id)
+                if neighbor is None or movie_id in seen_ids:
+                    continue
+                similar_movies.append(neighbor)
+                seen_ids.add(movie_id)
+                print(f"[推荐系统] 添加ALS近邻电影: ID:{neighbor.id} 标题:{neighbor.title} 相似度:{similarity:.4f}")
+                if len(similar_movies) >= limit:
+                    break
+    
+    # 如果基于内容的推荐不足，用用户行为的共现相似度补充
+    if len(similar_movies) < limit:
+        print(f"[推荐系统] 内容相似电影不足 ({len(similar_movies)}/{limit})，使用共现协同过滤补充推荐...")
+        seen_ids = {m.id for m in similar_movies}
+        cooccurring = MovieCooccurrence.objects.filter(
+            Q(movie1=movie) | Q(movie2=movie)
+        ).select_related('movie1', 'movie2').order_by('-similarity')[:limit*2]
+        for sim in cooccurring:
+            neighbor = sim.movie2 if sim.movie1_id == movie.id else sim.movie1
+            if neighbor.id in seen_ids:
+                continue
+            similar_movies.append(neighbor)
+            seen_ids.add(neighbor.id)
+            print(f"[推荐系统] 添加共现推荐电影: ID:{neighbor.id} 标题:{neighbor.title} 相似度:{sim.similarity:.4f}")
+            if len(similar_movies) >= limit:
+                break
+    
+    # 仍然不足时(新电影没有行为数据)，按类型补充高评分电影
+    if len(similar_movies) < limit:
+        print(f"[推荐系统] 共现推荐不足 ({len(similar_movies)}/{limit})，按类型补充高评分电影...")
         
         # 获取电影的类型
         movie_genres = list(movie.genres.all())
@@ -369,21 +509,111 @@ def get_movie_recommendations(movie, limit=6):
             rating_count=Count('user_ratings')
         ).order_by('-avg_rating', '-rating_count')[:limit-len(similar_movies)]
         
-        print(f"[推荐系统] 协同过滤找到 {collaborative_similar.count()} 部相似电影")
+        print(f"[推荐系统] 按类型找到 {collaborative_similar.count()} 部相似电影")
         
         for movie in collaborative_similar:
             similar_movies.append(movie)
-            print(f"[推荐系统] 添加协同过滤推荐电影: ID:{movie.id} 标题:{movie.title} 评分:{getattr(movie, 'avg_rating', 0)}")
+            print(f"[推荐系统] 添加同类型推荐电影: ID:{movie.id} 标题:{movie.title} 评分:{getattr(movie, 'avg_rating', 0)}")
     
     final_recommendations = similar_movies[:limit]
     print(f"[推荐系统] 最终推荐电影数量: {len(final_recommendations)}")
     return final_recommendations
 
+def _fold_in_recommendations(user, limit):
+    """
+    基于已保存的ALS电影因子，用用户当前的评分(隐式反馈模型还包括收藏和观看历史)在线求解用户因子并打分
+    
+    返回:
+        按预测评分排序的Movie列表；没有因子或用户没有可用交互时返回空列表
+    """
+    store = get_factor_store()
+    if store is None:
+        return []
+    
+    interactions = [
+        (movie_id, SIGNAL_RATING, rating)
+        for movie_id, rating in UserRating.objects.filter(user=user).values_list('movie_id', 'rating')
+    ]
+    if store.meta.get('implicit'):
+        # 隐式反馈模型由三类交互共同训练，折叠时使用同样的信号
+        interactions += [
+            (movie_id, SIGNAL_FAVORITE, 0)
+            for movie_id in UserFavorite.objects.filter(user=user).values_list('movie_id', flat=True)
+        ]
+        interactions += [
+            (movie_id, SIGNAL_HISTORY, watch_duration)
+            for movie_id, watch_duration in UserHistory.objects.filter(user=user).values_list('movie_id', 'watch_duration')
+        ]
+    if not interactions:
+        return []
+    movie_ids, kinds, values = zip(*interactions)
+    
+    user_vector = store.fold_in(movie_ids, values, kinds=kinds)
+    if user_vector is None:
+        return []
+    
+    # 多取一些候选，过滤掉movies_movie表中不存在的电影
+    scored = store.recommend(user_vector, limit=limit * 2, exclude_ids=set(movie_ids))
+    movies = Movie.objects.prefetch_related('genres').in_bulk([movie_id for movie_id, _ in scored])
+    recommended = []
+    for movie_id, score in scored:
+        movie = movies.get(movie_id)
+        if movie is None:
+            continue
+        movie.predicted_rating = score
+        recommended.append(movie)
+        if len(recommended) >= limit:
+            break
+    return recommended
+
+def _scored_movies(scored, limit):
+    """把 [(movie_id, score, source), ...] 按顺序换成Movie列表，附带推荐分数和来源"""
+    movies = Movie.objects.prefetch_related('genres').in_bulk([movie_id for movie_id, _, _ in scored])
+    recommended = []
+    for movie_id, score, source in scored:
+        movie = movies.get(movie_id)
+        if movie is None:
+            continue
+        movie.recommendation_score = score
+        movie.recommendation_source = source
+        recommended.append(movie)
+        if len(recommended) >= limit:
+            break
+    return recommended
+
 def get_user_recommendations(user, limit=10):
-    """获取用户推荐"""
+    """
+    获取用户推荐，依次使用: 离线预计算的推荐、ALS因子在线打分、相似度表和共现表的近邻、基于喜爱类型的推荐
+    """
     print(f"[推荐系统] 开始为用户 ID:{user.id} 用户名:{user.username} 生成个性化推荐")
     print(f"[推荐系统] 请求推荐数量: {limit}")
     
+    try:
+        start_time = time.time()
+        recommended_movies = _scored_movies(precomputed_recommendations(user.id, limit), limit)
+        if recommended_movies:
+            print(f"[推荐系统] 读取到 {len(recommended_movies)} 部预计算的推荐电影，耗时: {(time.time() - start_time) * 1000:.1f}毫秒")
+            return recommended_movies
+    except Exception as e:
+        logger.error(f"[推荐系统] 读取预计算推荐失败: {str(e)}", exc_info=True)
+    
+    try:
+        start_time = time.time()
+        recommended_movies = _fold_in_recommendations(user, limit)
+        if recommended_movies:
+            print(f"[推荐系统] ALS在线打分得到 {len(recommended_movies)} 部推荐电影，耗时: {(time.time() - start_time) * 1000:.1f}毫秒")
+            return recommended_movies
+    except Exception as e:
+        logger.error(f"[推荐系统] ALS在线打分失败: {str(e)}", exc_info=True)
+    
+    try:
+        recommended_movies = _scored_movies(neighbor_recommendations(user.id, limit * 2), limit)
+        if recommended_movies:
+            print(f"[推荐系统] 相似电影近邻得到 {len(recommended_movies)} 部推荐电影")
+            return recommended_movies
+    except Exception as e:
+        logger.error(f"[推荐系统] 相似电影近邻推荐失败: {str(e)}", exc_info=True)
+    
     # 获取用户已评分的电影
     rated_movies = set(user.ratings.values_list('movie_id', flat=True))
     print(f"[推荐系统] 用户已评分电影数量: {len(rated_movies)}")
@@ -525,44 +755,28 @@ def get_recommendation_system_status():
     
     return status 
 
-def update_similarity_from_collectmoviedb(limit=None, min_similarity=0.15, force_import=True, min_ratings=10, max_similarity_records=10000, no_prompt=False):
+def load_collect_movies(limit=None, min_ratings=10):
     """
-    从movie_collectmoviedb表计算电影相似度并更新数据库
+    读取电影特征，先增量刷新特征存储再从中读取，存储不可用时直接解析movie_collectmoviedb
     
-    参数:
-        limit: 限制处理的电影数量
-        min_similarity: 最小相似度阈值，默认提高到0.15
-        force_import: 是否强制导入电影数据
-        min_ratings: 最小评分人数，过滤冷门电影，默认10人
-        max_similarity_records: 最大保存的相似度记录数，默认10000条，设为None则不限制
-        no_prompt: 是否跳过确认提示
+    返回:
+        电影字典列表，按评分人数降序排列
     """
-    logger.info("[推荐系统] 开始从电影收集表计算相似度")
-    
-    # 记录开始时间
-    start_time = time.time()
-    
-    # 检查是否已有相似度数据
-    similarity_count = MovieSimilarity.objects.count()
-    if similarity_count > 0 and not no_prompt:
-        # 如果在命令行调用已有提示，这里不需要重复提示
-        # 该提示主要用于直接调用此函数时使用
-        if 'DJANGO_SETTINGS_MODULE' not in os.environ:
-            confirm = input(f'[推荐系统] 系统中已有 {similarity_count} 条相似度数据，继续操作将会删除所有已有数据! 是否确认? (y/n): ')
-            if confirm.lower() != 'y':
-                logger.info("[推荐系统] 用户取消了相似度计算操作")
-                return 0
-    
-    # 清除现有的相似度数据
-    MovieSimilarity.objects.all().delete()
-    logger.info("[推荐系统] 已清除旧的相似度数据")
-    
-    # 如果需要，强制导入电影
-    if force_import:
-        imported_count = import_movies_from_collectdb(limit)
-        logger.info(f"[推荐系统] 已导入 {imported_count} 部新电影")
+    try:
+        movies = load_movie_features(limit=limit, min_ratings=min_ratings)
+        if movies is not None:
+            return movies
+    except Exception as e:
+        logger.error(f"[推荐系统] 读取电影特征存储失败，改为直接解析: {str(e)}")
+    return _load_collect_movies(limit=limit, min_ratings=min_ratings)
+
+def _load_collect_movies(limit=None, min_ratings=10):
+    """
+    从movie_collectmoviedb读取并解析电影的类型、标签、导演和演员
     
-    # 查询电影数据 - 直接从CollectMovieDB获取，过滤冷门电影
+    返回:
+        电影字典列表，按评分人数降序排列
+    """
     with connection.cursor() as cursor:
         movie_query = """
             SELECT 
@@ -590,41 +804,12 @@ def update_similarity_from_collectmoviedb(limit=None, min_similarity=0.15, force
         movie_id, title, original_title, directors, actors, genres, tags, rating, year, ratings_count = row
             
         try:
-            # 解析JSON字段
-            try:
-                directors_data = json.loads(directors.replace("'", "\"")) if directors else []
-            except:
-                directors_data = []
-                
-            try:
-                actors_data = json.loads(actors.replace("'", "\"")) if actors else []
-            except:
-                actors_data = []
-                
-            # 提取导演和演员名字
-            directors_names = [d.get('name', '') for d in directors_data if isinstance(d, dict)]
-            actors_names = [a.get('name', '') for a in actors_data if isinstance(a, dict)]
-            
-            # 清理类型数据
-            if genres:
-                genres = genres.strip("[]").replace("'", "").split(", ")
-            else:
-                genres = []
-                
-            if tags:
-                tags = tags.strip("[]").replace("'", "").split(", ")
-            else:
-                tags = []
-            
-            # 提取评分
-            try:
-                if rating:
-                    rating_data = json.loads(rating.replace("'", "\""))
-                    avg_rating = rating_data.get('average', 0)
-                else:
-                    avg_rating = 0
-            except:
-                avg_rating = 0
+            # 解析导演、演员、类型、标签和评分字段
+            directors_names = parse_names(directors)
+            actors_names = parse_names(actors)
+            genres = parse_str_list(genres)
+            tags = parse_str_list(tags)
+            avg_rating = parse_rating_average(rating)
             
             # 过滤无类型和无标签的电影
             if not genres and not tags:
@@ -648,304 +833,164 @@ def update_similarity_from_collectmoviedb(limit=None, min_similarity=0.15, force
             logger.error(f"[推荐系统] 处理电影数据出错 (ID={movie_id}): {str(e)}")
     
     logger.info(f"[推荐系统] 成功处理 {len(movies)} 部电影数据")
+    return movies
+
+def _ensure_movies_exist(movies, batch_size=1000):
+    """
+    为尚未导入movies_movie表的电影一次性批量创建基础记录，
+    之后写入相似度时可以直接使用电影ID作为外键
+    
+    返回:
+        新创建的电影数量
+    """
+    existing_ids = set(Movie.objects.values_list('id', flat=True))
+    missing_movies = [
+        Movie(
+            id=m['movie_id'],
+            title=(m['title'] or '')[:200],
+            original_title=(m['original_title'] or '')[:200],
+            director=', '.join(m['directors'][:1])[:100],
+            actors=', '.join(m['actors'][:5])[:200],
+            rating=m['rating'] or 0
+        )
+        for m in movies if m['movie_id'] not in existing_ids
+    ]
+    if missing_movies:
+        Movie.objects.bulk_create(missing_movies, batch_size=batch_size, ignore_conflicts=True)
+        logger.info(f"[推荐系统] 预先创建了 {len(missing_movies)} 部缺失的电影记录")
+    return len(missing_movies)
+
+def _save_similarity_results(similarity_results, movies, writer, max_similarity_records=None, ordered=True):
+    """
+    通过writer保存 (movie1_id, movie2_id, similarity) 形式的相似度结果
+    
+    缺失的电影记录在写入前一次性创建，写入时直接使用电影ID，不再逐对查询数据库
+    
+    ordered 表示结果已按相似度降序排列，达到 max_similarity_records 后直接停止；
+    否则写入全部结果后由 writer.keep_top 只保留相似度最高的记录，writer不支持时
+    用容量为 max_similarity_records 的堆选出相似度最高的记录再写入
+    
+    返回:
+        写入的相似度记录数
+    """
+    _ensure_movies_exist(movies)
+    
+    if not ordered and max_similarity_records is not None:
+        if hasattr(writer, 'keep_top'):
+            for movie1_id, movie2_id, similarity in similarity_results:
+                writer.write(movie1_id, movie2_id, similarity)
+            return writer.keep_top(max_similarity_records)
+        similarity_results = heapq.nlargest(max_similarity_records, similarity_results, key=lambda pair: pair[2])
+    
+    valid_pairs = 0
+    for movie1_id, movie2_id, similarity in similarity_results:
+        # 如果已达到最大记录限制，则停止保存
+        if max_similarity_records is not None and valid_pairs >= max_similarity_records:
+            logger.info(f"[推荐系统] 已达到最大相似度记录限制 ({max_similarity_records})，停止保存")
+            break
+        
+        writer.write(movie1_id, movie2_id, similarity)
+        valid_pairs += 1
+    
+    return valid_pairs
+
+def update_similarity_from_collectmoviedb(limit=None, min_similarity=0.15, force_import=True, min_ratings=10, max_similarity_records=None, no_prompt=False, engine='spark', max_posting_size=MAX_POSTING_SIZE, top_k=DEFAULT_TOP_K, incremental=False, minhash_perm=MINHASH_PERMUTATIONS, minhash_bands=MINHASH_BANDS, workers=None):
+    """
+    从movie_collectmoviedb表计算电影相似度并更新数据库
+    
+    参数:
+        limit: 限制处理的电影数量
+        min_similarity: 最小相似度阈值，默认提高到0.15
+        force_import: 是否强制导入电影数据
+        min_ratings: 最小评分人数，过滤冷门电影，默认10人
+        max_similarity_records: 最大保存的相似度记录数，按相似度从高到低截断，默认None不限制
+        no_prompt: 是否跳过确认提示
+        engine: 计算引擎，spark=Spark按行分块计算并由各分区直接写库，sparse=多热稀疏矩阵分块计算，minhash=MinHash/LSH生成候选后精确计算，
+                local=多进程共享内存分块计算，不依赖Spark
+        max_posting_size: 候选生成时高频特征倒排列表的抽样上限，设为None则不限制
+        top_k: 每部电影保留的相似电影数量，设为None则保留所有超过阈值的电影对
+        incremental: 是否增量更新，只重新计算内容哈希变化的电影，没有哈希基线时执行全量重建；
+                     不能与limit同时使用，否则未读取的电影会被当作已移除
+        minhash_perm: minhash引擎的签名长度
+        minhash_bands: minhash引擎的LSH分段数，分段越多召回越高、候选越多
+        workers: local引擎的进程数，默认使用全部可用CPU核
+    """
+    if incremental and limit:
+        raise ValueError("增量更新需要读取全部电影才能判断哪些电影已移除，不能与limit同时使用")
+    if engine == 'spark' and not HAS_SPARK:
+        logger.warning("[推荐系统] 未安装pyspark，改用local引擎")
+        engine = 'local'
+    weights = similarity_weights()
+    logger.info(f"[推荐系统] 开始从电影收集表计算相似度，计算引擎: {engine}，权重: {weights}")
+    
+    # 记录开始时间
+    start_time = time.time()
+    
+    # 检查是否已有相似度数据
+    similarity_count = MovieSimilarity.objects.count()
+    if similarity_count > 0 and not no_prompt and not incremental:
+        # 如果在命令行调用已有提示，这里不需要重复提示
+        # 该提示主要用于直接调用此函数时使用
+        if 'DJANGO_SETTINGS_MODULE' not in os.environ:
+            confirm = input(f'[推荐系统] 系统中已有 {similarity_count} 条相似度数据，继续操作将会删除所有已有数据! 是否确认? (y/n): ')
+            if confirm.lower() != 'y':
+                logger.info("[推荐系统] 用户取消了相似度计算操作")
+                return 0
+    
+    # 如果需要，强制导入电影
+    if force_import:
+        imported_count = import_movies_from_collectdb(limit)
+        logger.info(f"[推荐系统] 已导入 {imported_count} 部新电影")
+    
+    # 读取电影特征，过滤冷门电影 - 优先使用预解析的特征存储，只有变化的行会被重新解析
+    movies = load_collect_movies(limit=limit, min_ratings=min_ratings)
+    
+    if incremental:
+        if not movies:
+            logger.warning("[推荐系统] 没有找到有效的电影数据，跳过增量更新")
+            return 0
+        valid_pairs = _incremental_similarity_update(movies, min_similarity, top_k, max_similarity_records, weights)
+        if valid_pairs is not None:
+            _finish_similarity_components(movies, min_similarity, top_k, weights)
+            logger.info(f"[推荐系统] 增量更新完成! 保存了 {valid_pairs} 条相似度数据，总耗时: {time.time() - start_time:.2f}秒")
+            return valid_pairs
+        logger.warning(f"[推荐系统] 无法增量更新，改为全量重建: 完成后将替换现有的全部 {similarity_count} 条相似度数据")
+    
+    valid_pairs = 0
     
-    # 使用Spark进行并行计算
     if len(movies) > 0:
-        valid_pairs = 0
         n = len(movies)
         max_pairs = n * (n-1) // 2  # 最大可能的电影对数量
-        logger.info(f"[推荐系统] 开始处理 {n} 部电影的相似度计算，共 {max_pairs} 对...")
-        
-        # 定义批处理大小，确保在所有代码路径中都可用
-        batch_size = 1000
-        similarity_batch = []
+        logger.info(f"[推荐系统] 开始处理 {n} 部电影的相似度计算，最多 {max_pairs} 对，每部电影保留 {top_k or '全部'} 个相似电影...")
         
-        # 创建Spark会话
-        try:
-            spark = get_spark_session()
-            logger.info("[推荐系统] 成功创建Spark会话")
+        # 写入影子表，完成后原子替换线上表，重建期间读取方仍使用旧数据
+        # Spark任务重试时会重复写入同一分区，保留唯一索引让重复的记录被忽略
+        with ShadowTableWriter(keep_unique=engine == 'spark') as writer:
+            valid_pairs = None
+            if engine == 'spark':
+                # Spark各分区直接写入影子表，计算结果不经过driver
+                _ensure_movies_exist(movies)
+                valid_pairs = _spark_write_similarities(movies, min_similarity, top_k, writer, max_similarity_records, weights=weights)
+                if valid_pairs is None:
+                    logger.info("[推荐系统] Spark计算失败，回退到local引擎...")
+                    engine = 'local'
             
-            # 准备数据，创建电影对列表
-            movie_pairs = []
-            for i in range(n):
-                for j in range(i+1, n):
-                    movie_pairs.append((i, j))
-                    
-            # 创建RDD并分区 - 控制分区数量以平衡内存使用和并行度
-            partition_count = min(200, max(20, len(movie_pairs) // 10000))
-            movie_pairs_rdd = spark.sparkContext.parallelize(movie_pairs, numSlices=partition_count)
-            logger.info(f"[推荐系统] 创建RDD，分区数: {partition_count}")
-            
-            # 使用广播变量传递电影数据，避免在每个任务中复制
-            broadcast_movies = spark.sparkContext.broadcast(movies)
-            
-            # 定义相似度计算函数
-            def calculate_similarity_pair(pair):
-                i, j = pair
-                movie1 = broadcast_movies.value[i]
-                movie2 = broadcast_movies.value[j]
-                
-                try:
-                    # 计算类型相似度
-                    genre_similarity = 0
-                    if movie1['genres'] and movie2['genres']:
-                        common_genres = set(movie1['genres']) & set(movie2['genres'])
-                        if common_genres:
-                            genre_similarity = len(common_genres) / max(len(movie1['genres']), len(movie2['genres']))
-                    
-                    # 计算导演相似度
-                    director_similarity = 0
-                    if movie1['directors'] and movie2['directors']:
-                        common_directors = set(movie1['directors']) & set(movie2['directors'])
-                        if common_directors:
-                            director_similarity = len(common_directors) / max(len(movie1['directors']), len(movie2['directors']))
-                    
-                    # 计算演员相似度
-                    actor_similarity = 0
-                    if movie1['actors'] and movie2['actors']:
-                        common_actors = set(movie1['actors']) & set(movie2['actors'])
-                        if common_actors:
-                            actor_similarity = len(common_actors) / max(len(movie1['actors']), len(movie2['actors']))
-                    
-                    # 标签相似度
-                    tag_similarity = 0
-                    if movie1['tags'] and movie2['tags']:
-                        common_tags = set(movie1['tags']) & set(movie2['tags'])
-                        if common_tags:
-                            tag_similarity = len(common_tags) / max(len(movie1['tags']), len(movie2['tags']))
-                    
-                    # 计算总相似度 - 各部分权重可调整
-                    similarity = (
-                        genre_similarity * 0.4 +  # 类型相似度权重
-                        director_similarity * 0.1 +  # 导演相似度权重
-                        actor_similarity * 0.1 +  # 演员相似度权重
-                        tag_similarity * 0.4  # 标签相似度权重
-                    )
-                    
-                    # 如果只有类型匹配也给一个基础分
-                    if genre_similarity > 0 and similarity < min_similarity:
-                        similarity = max(similarity, 0.05)
-                        
-                    # 返回符合条件的相似度
-                    if similarity >= min_similarity:
-                        return (movie1['movie_id'], movie2['movie_id'], similarity)
-                    else:
-                        return None
-                
-                except Exception as e:
-                    # 出错则返回None
-                    return None
-            
-            # 执行并行计算
-            logger.info("[推荐系统] 开始Spark并行计算相似度...")
-            similarity_results = movie_pairs_rdd.map(calculate_similarity_pair).filter(lambda x: x is not None).collect()
-            logger.info(f"[推荐系统] Spark计算完成，获得 {len(similarity_results)} 个有效相似度对")
-            
-            # 批量处理相似度结果
-            saved_records = 0  # 跟踪已保存的记录数
-            for result in similarity_results:
-                # 如果已达到最大记录限制，则停止保存
-                if max_similarity_records is not None and saved_records >= max_similarity_records:
-                    logger.info(f"[推荐系统] 已达到最大相似度记录限制 ({max_similarity_records})，停止保存")
-                    break
-                    
-                movie1_id, movie2_id, similarity = result
-                
-                try:
-                    # 尝试获取或创建Movie对象
-                    movie1_obj, created1 = Movie.objects.get_or_create(
-                        id=movie1_id, 
-                        defaults={
-                            'title': next((m['title'] for m in movies if m['movie_id'] == movie1_id), ''),
-                            'original_title': next((m['original_title'] for m in movies if m['movie_id'] == movie1_id), ''),
-                            'director': next((', '.join(m['directors'][:1]) if m['directors'] else '' for m in movies if m['movie_id'] == movie1_id), ''),
-                            'actors': next((', '.join(m['actors'][:5]) if m['actors'] else '' for m in movies if m['movie_id'] == movie1_id), ''),
-                            'rating': next((m['rating'] for m in movies if m['movie_id'] == movie1_id), 0)
-                        }
-                    )
-                    
-                    movie2_obj, created2 = Movie.objects.get_or_create(
-                        id=movie2_id, 
-                        defaults={
-                            'title': next((m['title'] for m in movies if m['movie_id'] == movie2_id), ''),
-                            'original_title': next((m['original_title'] for m in movies if m['movie_id'] == movie2_id), ''),
-                            'director': next((', '.join(m['directors'][:1]) if m['directors'] else '' for m in movies if m['movie_id'] == movie2_id), ''),
-                            'actors': next((', '.join(m['actors'][:5]) if m['actors'] else '' for m in movies if m['movie_id'] == movie2_id), ''),
-                            'rating': next((m['rating'] for m in movies if m['movie_id'] == movie2_id), 0)
-                        }
-                    )
-                    
-                    similarity_batch.append(
-                        MovieSimilarity(
-                            movie1=movie1_obj,
-                            movie2=movie2_obj,
-                            similarity=similarity
-                        )
-                    )
-                    valid_pairs += 1
-                    
-                    # 批量插入相似度记录
-                    if len(similarity_batch) >= batch_size:
-                        MovieSimilarity.objects.bulk_create(similarity_batch, ignore_conflicts=True)
-                        saved_records += len(similarity_batch)
-                        logger.info(f"[推荐系统] 已保存 {saved_records}/{max_similarity_records if max_similarity_records else '无限制'} 条相似度记录")
-                        similarity_batch = []
-                        
-                        # 如果已达到最大记录限制，则停止保存
-                        if max_similarity_records is not None and saved_records >= max_similarity_records:
-                            logger.info(f"[推荐系统] 已达到最大相似度记录限制 ({max_similarity_records})，停止保存")
-                            break
-                        
-                except Exception as e:
-                    logger.error(f"[推荐系统] 创建相似度记录时出错: {str(e)}")
-            
-            # 插入剩余的相似度记录，仍需检查限制
-            if similarity_batch and (max_similarity_records is None or saved_records < max_similarity_records):
-                # 如果有限制，可能需要截断batch
-                if max_similarity_records is not None:
-                    remaining_slots = max_similarity_records - saved_records
-                    if remaining_slots < len(similarity_batch):
-                        similarity_batch = similarity_batch[:remaining_slots]
-                        logger.info(f"[推荐系统] 最后批次截断至 {remaining_slots} 条记录以满足最大限制")
-                
-                MovieSimilarity.objects.bulk_create(similarity_batch, ignore_conflicts=True)
-                saved_records += len(similarity_batch)
-                logger.info(f"[推荐系统] 最终共保存 {saved_records} 条相似度记录")
-            
-            # 停止Spark会话以释放资源
-            spark.stop()
-            logger.info("[推荐系统] 已停止Spark会话")
-            
-        except Exception as e:
-            logger.error(f"[推荐系统] Spark处理出错: {str(e)}")
-            # 如果Spark处理失败，回退到非并行处理方法
-            logger.info("[推荐系统] 回退到非并行处理方法...")
-            
-            # 重置计数器和批处理列表，确保在回退路径中也是干净的状态
-            similarity_batch = []
-            valid_pairs = 0
-            total_pairs = 0
-            saved_records = 0  # 跟踪已保存的记录数
-            
-            # 逐对计算相似度
-            for i in range(n):
-                for j in range(i+1, n):  # 只计算上三角矩阵，避免重复
-                    movie1 = movies[i]
-                    movie2 = movies[j]
-                    
-                    total_pairs += 1
-                    
-                    # 计算相似度分数
-                    try:
-                        # 计算类型相似度
-                        genre_similarity = 0
-                        if movie1['genres'] and movie2['genres']:
-                            common_genres = set(movie1['genres']) & set(movie2['genres'])
-                            if common_genres:
-                                genre_similarity = len(common_genres) / max(len(movie1['genres']), len(movie2['genres']))
-                        
-                        # 计算导演相似度
-                        director_similarity = 0
-                        if movie1['directors'] and movie2['directors']:
-                            common_directors = set(movie1['directors']) & set(movie2['directors'])
-                            if common_directors:
-                                director_similarity = len(common_directors) / max(len(movie1['directors']), len(movie2['directors']))
-                        
-                        # 计算演员相似度
-                        actor_similarity = 0
-                        if movie1['actors'] and movie2['actors']:
-                            common_actors = set(movie1['actors']) & set(movie2['actors'])
-                            if common_actors:
-                                actor_similarity = len(common_actors) / max(len(movie1['actors']), len(movie2['actors']))
-                        
-                        # 标签相似度
-                        tag_similarity = 0
-                        if movie1['tags'] and movie2['tags']:
-                            common_tags = set(movie1['tags']) & set(movie2['tags'])
-                            if common_tags:
-                                tag_similarity = len(common_tags) / max(len(movie1['tags']), len(movie2['tags']))
-                        
-                        # 计算总相似度 - 各部分权重可调整
-                        similarity = (
-                            genre_similarity * 0.4 +  # 类型相似度权重
-                            director_similarity * 0.1 +  # 导演相似度权重
-                            actor_similarity * 0.1 +  # 演员相似度权重
-                            tag_similarity * 0.4  # 标签相似度权重
-                        )
-                        
-                        # 如果只有类型匹配也给一个基础分
-                        if genre_similarity > 0 and similarity < min_similarity:
-                            similarity = max(similarity, 0.05)
-                            
-                        # 保存符合条件的相似度
-                        if similarity >= min_similarity:
-                            # 先检查电影ID是否已存在于Movie表
-                            movie1_id = movie1['movie_id']
-                            movie2_id = movie2['movie_id']
-                            
-                            # 尝试获取或创建Movie对象
-                            movie1_obj, created1 = Movie.objects.get_or_create(
-                                id=movie1_id, 
-                                defaults={
-                                    'title': movie1['title'],
-                                    'original_title': movie1['original_title'] or movie1['title'],
-                                    'director': ', '.join(movie1['directors'][:1]) if movie1['directors'] else '',
-                                    'actors': ', '.join(movie1['actors'][:5]) if movie1['actors'] else '',
-                                    'rating': movie1['rating']
-                                }
-                            )
-                            
-                            movie2_obj, created2 = Movie.objects.get_or_create(
-                                id=movie2_id, 
-                                defaults={
-                                    'title': movie2['title'],
-                                    'original_title': movie2['original_title'] or movie2['title'],
-                                    'director': ', '.join(movie2['directors'][:1]) if movie2['directors'] else '',
-                                    'actors': ', '.join(movie2['actors'][:5]) if movie2['actors'] else '',
-                                    'rating': movie2['rating']
-                                }
-                            )
-                            
-                            similarity_batch.append(
-                                MovieSimilarity(
-                                    movie1=movie1_obj,
-                                    movie2=movie2_obj,
-                                    similarity=similarity
-                                )
-                            )
-                            valid_pairs += 1
-                    
-                    except Exception as e:
-                        logger.error(f"[推荐系统] 计算相似度时出错: {str(e)}")
-                    
-                    # 批量插入相似度记录
-                    if len(similarity_batch) >= batch_size:
-                        MovieSimilarity.objects.bulk_create(similarity_batch, ignore_conflicts=True)
-                        saved_records += len(similarity_batch)
-                        similarity_batch = []
-                        
-                        # 如果已达到最大记录限制，则停止保存
-                        if max_similarity_records is not None and saved_records >= max_similarity_records:
-                            logger.info(f"[推荐系统] 已达到最大相似度记录限制 ({max_similarity_records})，停止保存")
-                            break
-                    
-                    # 更新进度
-                    if total_pairs % (max_pairs // 10) == 0 or total_pairs == max_pairs:
-                        progress = (total_pairs / max_pairs) * 100
-                        logger.info(f"[推荐系统] 相似度计算进度: {progress:.2f}% 完成")
-            
-            # 插入剩余的相似度记录，仍需检查限制
-            if similarity_batch and (max_similarity_records is None or saved_records < max_similarity_records):
-                # 如果有限制，可能需要截断batch
-                if max_similarity_records is not None:
-                    remaining_slots = max_similarity_records - saved_records
-                    if remaining_slots < len(similarity_batch):
-                        similarity_batch = similarity_batch[:remaining_slots]
-                        logger.info(f"[推荐系统] 最后批次截断至 {remaining_slots} 条记录以满足最大限制")
-                
-                MovieSimilarity.objects.bulk_create(similarity_batch, ignore_conflicts=True)
-                saved_records += len(similarity_batch)
-                logger.info(f"[推荐系统] 最终共保存 {saved_records} 条相似度记录")
+            if valid_pairs is None:
+                # 限制top_k时各引擎按相似度降序产出结果，否则按分块顺序产出
+                ordered = bool(top_k) or engine == 'minhash'
+                if engine == 'sparse':
+                    # 使用稀疏矩阵引擎分块计算，不构造电影对列表
+                    similarity_results = _sparse_similarity_results(movies, min_similarity, top_k, weights)
+                elif engine == 'minhash':
+                    similarity_results = _minhash_similarity_results(movies, min_similarity, top_k, max_posting_size, minhash_perm, minhash_bands, weights)
+                else:
+                    # 多进程分块计算，特征数组通过共享内存传给工作进程
+                    similarity_results = _local_similarity_results(movies, min_similarity, top_k, workers, weights)
+                valid_pairs = _save_similarity_results(similarity_results, movies, writer, max_similarity_records, ordered)
+        
+        # 保存内容哈希，作为下次增量更新的基线
+        _replace_content_hashes(movies)
+        _finish_similarity_components(movies, min_similarity, top_k, weights)
         
         # 计算有效相似度比率和耗时
         total_time = time.time() - start_time
@@ -956,6 +1001,332 @@ def update_similarity_from_collectmoviedb(limit=None, min_similarity=0.15, force
     
     return valid_pairs
 
+def _finish_similarity_components(movies, min_similarity, top_k, weights):
+    """
+    保存相似度表中全部电影对的各维度分量，供之后调整权重时用 reblend_similarities 重新合成
+    
+    保存失败只记录日志，不影响已写入的相似度
+    """
+    try:
+        pairs = MovieSimilarity.objects.values_list('movie1_id', 'movie2_id').iterator(chunk_size=10000)
+        save_similarity_components(movies, pairs, meta={
+            'weights': weights, 'min_similarity': min_similarity, 'top_k': top_k,
+        })
+    except Exception as e:
+        logger.error(f"[推荐系统] 保存相似度分量失败: {str(e)}")
+
+def reblend_similarities(weights=None, min_similarity=0.15, top_k=DEFAULT_TOP_K, max_similarity_records=None):
+    """
+    按新的权重在已保存的相似度分量上重新合成相似度，并整体替换相似度表
+    
+    候选电影对为上次计算相似度时保存的电影对，只做一次向量化的加权求和和前K名重选，
+    不重新生成候选。上次计算时没有进入相似度表的电影对不会出现在结果中。
+    
+    参数:
+        weights: {维度: 权重}，默认读取 settings.RECOMMENDER['SIMILARITY_WEIGHTS']
+        min_similarity: 最小相似度阈值
+        top_k: 每部电影保留的相似电影数量，设为None则保留所有超过阈值的电影对
+        max_similarity_records: 最大保存的相似度记录数，按相似度从高到低截断
+    
+    返回:
+        写入的相似度记录数；没有相似度分量时返回None
+    """
+    start_time = time.time()
+    if weights is None:
+        weights = similarity_weights()
+    store = SimilarityComponents.current()
+    if store is None or not len(store):
+        logger.warning("[推荐系统] 没有找到相似度分量，请先运行 update_similarities 计算相似度")
+        return None
+    
+    logger.info(f"[推荐系统] 使用相似度分量版本 {store.version} 重新合成 {len(store)} 个电影对，权重: {weights}")
+    similarities = store.blend(weights, min_similarity)
+    movie1_ids, movie2_ids = np.asarray(store.movie1_ids), np.asarray(store.movie2_ids)
+    # 影子表替换后不检查外键，跳过期间已被删除的电影
+    existing_ids = np.fromiter(Movie.objects.values_list('id', flat=True).iterator(), dtype=np.int64)
+    exists = np.isin(movie1_ids, existing_ids) & np.isin(movie2_ids, existing_ids)
+    movie1_ids, movie2_ids, similarities = rerank_top_k_pairs(
+        movie1_ids[exists], movie2_ids[exists], similarities[exists],
+        min_similarity=min_similarity, top_k=top_k
+    )
+    if max_similarity_records is not None:
+        movie1_ids, movie2_ids, similarities = (
+            movie1_ids[:max_similarity_records], movie2_ids[:max_similarity_records], similarities[:max_similarity_records]
+        )
+    
+    with ShadowTableWriter() as writer:
+        for movie1_id, movie2_id, similarity in zip(movie1_ids.tolist(), movie2_ids.tolist(), similarities.tolist()):
+            writer.write(movie1_id, movie2_id, similarity)
+    
+    logger.info(f"[推荐系统] 相似度重新合成完成! 保存了 {len(similarities)} 条相似度数据，总耗时: {time.time() - start_time:.2f}秒")
+    return len(similarities)
+
+def update_cooccurrence_similarities(full=False, min_count=DEFAULT_MIN_COOCCURRENCE, min_similarity=0.0, top_k=DEFAULT_TOP_K):
+    """
+    刷新用户行为的共现次数，换算为余弦相似度后整体替换共现相似度表
+    
+    参数:
+        full: 忽略水位线，全量重算共现次数
+        min_count: 最小共现次数，低于此值的电影对不保存
+        min_similarity: 最小相似度阈值
+        top_k: 每部电影保留的共现电影数量，设为None则保留所有超过阈值的电影对
+    
+    返回:
+        (写入的记录数, refresh_cooccurrence 的统计信息)
+    """
+    start_time = time.time()
+    store, stats = refresh_cooccurrence(full=full)
+    
+    movie1_ids, movie2_ids, similarities = normalized_pairs(store.item_ids, store.counts, min_count)
+    # 影子表替换后不检查外键，跳过已被删除的电影
+    existing_ids = np.fromiter(Movie.objects.values_list('id', flat=True).iterator(), dtype=np.int64)
+    exists = np.isin(movie1_ids, existing_ids) & np.isin(movie2_ids, existing_ids)
+    movie1_ids, movie2_ids, similarities = rerank_top_k_pairs(
+        movie1_ids[exists], movie2_ids[exists], similarities[exists],
+        min_similarity=min_similarity, top_k=top_k
+    )
+    
+    with ShadowTableWriter(model=MovieCooccurrence) as writer:
+        for movie1_id, movie2_id, similarity in zip(movie1_ids.tolist(), movie2_ids.tolist(), similarities.tolist()):
+            writer.write(movie1_id, movie2_id, similarity)
+    
+    logger.info(f"[推荐系统] 共现相似度更新完成! 保存了 {len(similarities)} 条数据，总耗时: {time.time() - start_time:.2f}秒")
+    return len(similarities), stats
+
+def _id_chunks(ids, chunk_size=1000):
+    """把ID集合切分为较小的列表，避免IN子句过长"""
+    ids = list(ids)
+    for start in range(0, len(ids), chunk_size):
+        yield ids[start:start + chunk_size]
+
+def _replace_content_hashes(movies):
+    """全量重建后保存每部电影的内容哈希"""
+    MovieContentHash.objects.all().delete()
+    MovieContentHash.objects.bulk_create(
+        [MovieContentHash(movie_id=m['movie_id'], content_hash=movie_content_hash(m)) for m in movies],
+        batch_size=1000
+    )
+    logger.info(f"[推荐系统] 已保存 {len(movies)} 部电影的内容哈希")
+
+def _incremental_similarity_update(movies, min_similarity, top_k, max_similarity_records=None, weights=SIMILARITY_WEIGHTS):
+    """
+    增量更新相似度，只重新计算新增或内容变化的电影
+    
+    与上次保存的内容哈希比较找出变化的电影，删除涉及它们(以及已移除电影)的旧记录，
+    再计算这些电影与全部电影的相似度，并合并进未变化电影已有的邻居列表。
+    未变化电影被挤出前K名的旧记录会保留到下一次全量重建。
+    
+    返回:
+        写入的相似度记录数；没有哈希基线或权重与上次计算时不同时返回None，由调用方执行全量重建
+    """
+    stored_hashes = dict(MovieContentHash.objects.values_list('movie_id', 'content_hash'))
+    if not stored_hashes:
+        logger.warning("[推荐系统] 没有找到内容哈希基线，改为全量重建")
+        return None
+    components = SimilarityComponents.current()
+    if components is not None and components.meta.get('weights', weights) != weights:
+        # 未变化的电影对仍是按旧权重计算的，不能与新权重的结果混在一起
+        logger.warning("[推荐系统] 相似度权重与上次计算时不同，改为全量重建")
+        return None
+    
+    current_hashes = {m['movie_id']: movie_content_hash(m) for m in movies}
+    changed_rows = [i for i, m in enumerate(movies) if stored_hashes.get(m['movie_id']) != current_hashes[m['movie_id']]]
+    changed_ids = {movies[i]['movie_id'] for i in changed_rows}
+    removed_ids = set(stored_hashes) - set(current_hashes)
+    stale_ids = changed_ids | removed_ids
+    logger.info(f"[推荐系统] 增量更新: 新增或变化 {len(changed_ids)} 部，移除 {len(removed_ids)} 部，未变化 {len(movies) - len(changed_ids)} 部")
+    if not stale_ids:
+        logger.info("[推荐系统] 电影内容没有变化，无需更新相似度")
+        return 0
+    
+    # 删除涉及变化电影和已移除电影的旧相似度记录
+    deleted_count = 0
+    for chunk in _id_chunks(stale_ids):
+        deleted_count += MovieSimilarity.objects.filter(Q(movie1_id__in=chunk) | Q(movie2_id__in=chunk)).delete()[0]
+    logger.info(f"[推荐系统] 已删除 {deleted_count} 条过期的相似度记录")
+    
+    # 未变化电影当前第K名的相似度，新的电影对需达到该门槛才能进入其邻居列表
+    floors = {}
+    if top_k:
+        floors = neighbor_floors(
+            MovieSimilarity.objects.values_list('movie1_id', 'movie2_id', 'similarity').iterator(chunk_size=10000),
+            top_k
+        )
+    
+    movie1_ids, movie2_ids, similarities = incremental_top_k_pairs(
+        movies, changed_rows, floors, min_similarity=min_similarity, top_k=top_k, weights=weights
+    )
+    similarity_results = zip(movie1_ids.tolist(), movie2_ids.tolist(), similarities.tolist())
+    with SimilarityTableWriter() as writer:
+        valid_pairs = _save_similarity_results(similarity_results, movies, writer, max_similarity_records)
+    
+    # 最后更新哈希基线，中途失败时下次运行会重新处理这些电影
+    for chunk in _id_chunks(stale_ids):
+        MovieContentHash.objects.filter(movie_id__in=chunk).delete()
+    MovieContentHash.objects.bulk_create(
+        [MovieContentHash(movie_id=movie_id, content_hash=current_hashes[movie_id]) for movie_id in changed_ids],
+        batch_size=1000
+    )
+    return valid_pairs
+
+def _sparse_similarity_results(movies, min_similarity, top_k, weights=SIMILARITY_WEIGHTS):
+    """使用稀疏矩阵引擎计算相似度结果"""
+    logger.info(f"[推荐系统] 使用稀疏矩阵引擎计算 {len(movies)} 部电影的相似度...")
+    if top_k:
+        return iter_top_k_pairs(movies, min_similarity=min_similarity, top_k=top_k, weights=weights)
+    return iter_similarity_pairs(movies, min_similarity=min_similarity, weights=weights)
+
+def _local_similarity_results(movies, min_similarity, top_k, workers, weights=SIMILARITY_WEIGHTS):
+    """使用本地多进程引擎计算相似度结果"""
+    logger.info(f"[推荐系统] 使用本地多进程引擎计算 {len(movies)} 部电影的相似度...")
+    return iter_local_pairs(movies, min_similarity=min_similarity, top_k=top_k, workers=workers, weights=weights)
+
+def _minhash_similarity_results(movies, min_similarity, top_k, max_posting_size, num_perm, bands, weights=SIMILARITY_WEIGHTS):
+    """使用MinHash/LSH生成候选电影对，只对候选对精确计算相似度"""
+    logger.info(f"[推荐系统] 使用MinHash引擎计算 {len(movies)} 部电影的相似度，签名长度 {num_perm}，分段 {bands}...")
+    movie1_ids, movie2_ids, similarities = minhash_top_k_pairs(
+        movies, min_similarity=min_similarity, top_k=top_k, num_perm=num_perm,
+        bands=bands, max_bucket_size=max_posting_size, weights=weights
+    )
+    return zip(movie1_ids.tolist(), movie2_ids.tolist(), similarities.tolist())
+
+def _kernel_archive(directory):
+    """把recommender包的源码打成zip，通过 sc.addPyFile 分发给executor导入计算内核"""
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    path = os.path.join(directory, 'recommender.zip')
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for root, dirs, files in os.walk(package_dir):
+            dirs[:] = [d for d in dirs if d != '__pycache__']
+            for name in files:
+                if name.endswith('.py'):
+                    source = os.path.join(root, name)
+                    archive.write(source, os.path.join('recommender', os.path.relpath(source, package_dir)))
+    return path
+
+def _spark_write_similarities(movies, min_similarity, top_k, writer, max_similarity_records=None, block_size=SPARK_BLOCK_SIZE,
+                              weights=SIMILARITY_WEIGHTS):
+    """
+    使用Spark按行分块计算相似度，各分区通过foreachPartition直接写入writer的目标表
+    
+    分区即电影下标的行块，块号由executor上的 sc.range 生成；特征以紧凑的CSR数组广播，
+    driver既不构造电影对也不collect相似度结果。top_k 不为空时先跑一轮只取回每部电影
+    第K名邻居(每部电影两个数)，第二轮每个电影对只由一方写出，见 owned_top_k_entries。
+    
+    每个分区在一个事务中用 INSERT IGNORE 写入，失败时回滚；writer须以 keep_unique=True 创建，
+    Spark重试或推测执行重复写入的记录会被唯一索引忽略。写入的记录数在结束后从表中统计。
+    
+    返回:
+        写入的记录数；Spark处理失败时清空已写入的数据并返回None，由调用方改用其他引擎
+    """
+    try:
+        spark = get_spark_session()
+    except Exception as e:
+        logger.error(f"[推荐系统] 创建Spark会话失败: {str(e)}")
+        return None
+    logger.info("[推荐系统] 成功创建Spark会话")
+    
+    archive_dir = tempfile.mkdtemp(prefix='recommender_spark_')
+    try:
+        sc = spark.sparkContext
+        # executor的Python进程从分发的zip中导入计算内核(不依赖Django)
+        sc.addPyFile(_kernel_archive(archive_dir))
+        n = len(movies)
+        block_count = (n + block_size - 1) // block_size
+        features = build_feature_matrices(movies)
+        broadcast_data = sc.broadcast({
+            'arrays': feature_arrays(features),
+            'movie_ids': np.asarray([m['movie_id'] for m in movies], dtype=np.int64),
+        })
+        db_config = dict(connection_config(), autocommit=False)
+        table = writer.table
+        batch_size = writer.batch_size
+        
+        def kernel():
+            from recommender import content_similarity, local_engine
+            return content_similarity, local_engine
+        
+        def load_block(block_index):
+            content_similarity, local_engine = kernel()
+            data = broadcast_data.value
+            # 广播值在每个Python worker中只反序列化一次，重建的矩阵缓存在其中供后续分区复用
+            if '_features' not in data:
+                data['_features'] = local_engine.features_from_arrays(data['arrays'])
+            start = block_index * block_size
+            end = min(start + block_size, n)
+            return data, start, end, content_similarity.score_block(data['_features'], start, end, min_similarity, weights)
+        
+        floors = None
+        if top_k:
+            def block_floors(block_indexes):
+                content_similarity, _ = kernel()
+                for block_index in block_indexes:
+                    _, start, end, block = load_block(block_index)
+                    floor_sims, floor_cols = content_similarity.row_floors(block, np.arange(start, end), top_k, min_similarity)
+                    yield start, floor_sims, floor_cols
+            
+            # 第一轮只取回每部电影第K名邻居的相似度和下标
+            floor_sims = np.full(n, -np.inf)
+            floor_cols = np.full(n, -1, dtype=np.int64)
+            for start, sims, cols in sc.range(0, block_count, numSlices=block_count).mapPartitions(block_floors).collect():
+                floor_sims[start:start + len(sims)] = sims
+                floor_cols[start:start + len(cols)] = cols
+            floors = sc.broadcast((floor_sims, floor_cols))
+            logger.info(f"[推荐系统] Spark第一轮完成，已确定 {n} 部电影的第{top_k}名邻居")
+        
+        def write_partition(block_indexes):
+            import pymysql
+            from scipy.sparse import triu
+            content_similarity, _ = kernel()
+            
+            conn = pymysql.connect(**db_config)
+            sql = f"INSERT IGNORE INTO `{table}` (movie1_id, movie2_id, similarity) VALUES (%s, %s, %s)"
+            try:
+                for block_index in block_indexes:
+                    data, start, end, block = load_block(block_index)
+                    if floors is not None:
+                        rows, cols, sims = content_similarity.owned_top_k_entries(block, np.arange(start, end), *floors.value, min_similarity)
+                    else:
+                        block = triu(block, k=start + 1, format='coo')
+                        keep = block.data >= min_similarity
+                        rows, cols, sims = block.row[keep] + start, block.col[keep], block.data[keep]
+                    
+                    movie_ids = data['movie_ids']
+                    low = np.minimum(movie_ids[rows], movie_ids[cols]).tolist()
+                    high = np.maximum(movie_ids[rows], movie_ids[cols]).tolist()
+                    values = sims.astype(np.float64).tolist()
+                    with conn.cursor() as cursor:
+                        for offset in range(0, len(values), batch_size):
+                            cursor.executemany(sql, list(zip(
+                                low[offset:offset + batch_size],
+                                high[offset:offset + batch_size],
+                                values[offset:offset + batch_size],
+                            )))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                conn.close()
+        
+        logger.info(f"[推荐系统] 开始Spark分块计算相似度，{block_count} 个分区，每个分区 {block_size} 部电影...")
+        sc.range(0, block_count, numSlices=block_count).foreachPartition(write_partition)
+        writer.count_rows()
+        logger.info(f"[推荐系统] Spark计算完成，各分区共写入 {writer.rows_written} 条相似度记录")
+        
+        if max_similarity_records is not None and writer.rows_written > max_similarity_records:
+            writer.keep_top(max_similarity_records)
+        return writer.rows_written
+    
+    except Exception as e:
+        logger.error(f"[推荐系统] Spark处理出错: {str(e)}")
+        writer.truncate()
+        return None
+    finally:
+        # 停止Spark会话以释放资源
+        spark.stop()
+        shutil.rmtree(archive_dir, ignore_errors=True)
+        logger.info("[推荐系统] 已停止Spark会话")
+
 def import_movies_from_collectdb(limit=None):
     """
     从movie_collectmoviedb表导入电影数据到movies_movie表
@@ -1002,35 +1373,11 @@ def import_movies_from_collectdb(limit=None):
         try:
             movie_id, title, original_title, year, rating_json, genres_str, directors_json, actors_json, tags_str, images_json, durations, summary = movie_data
             
-            # 解析评分
-            rating = 0
-            try:
-                if rating_json:
-                    rating_data = json.loads(rating_json.replace("'", "\""))
-                    rating = float(rating_data.get('average', 0))
-            except Exception as e:
-                logger.error(f"[推荐系统] 解析评分出错(ID={movie_id}): {str(e)}")
-            
-            # 提取导演
-            director = ''
-            try:
-                if directors_json:
-                    directors_data = json.loads(directors_json.replace("'", "\""))
-                    if directors_data and isinstance(directors_data, list) and len(directors_data) > 0:
-                        director = directors_data[0].get('name', '')
-            except Exception as e:
-                logger.warning(f"[推荐系统] 解析导演出错(ID={movie_id}): {str(e)}")
-            
-            # 提取演员
-            actors = ''
-            try:
-                if actors_json:
-                    actors_data = json.loads(actors_json.replace("'", "\""))
-                    if actors_data and isinstance(actors_data, list):
-                        actor_names = [actor.get('name', '') for actor in actors_data if actor.get('name')]
-                        actors = ', '.join(actor_names[:5])  # 只取前5个演员
-            except Exception as e:
-                logger.warning(f"[推荐系统] 解析演员出错(ID={movie_id}): {str(e)}")
+            # 解析评分、导演和演员
+            rating = parse_rating_average(rating_json)
+            director_names = parse_names(directors_json)
+            director = director_names[0] if director_names else ''
+            actors = ', '.join(parse_names(actors_json)[:5])  # 只取前5个演员
             
             # 提取时长
             duration = None
@@ -1142,5 +1489,13 @@ def import_movies_from_collectdb(limit=None):
         except Exception as e:
             logger.error(f"[推荐系统] 处理电影类型数据出错: {str(e)}")
     
+    # 第三步：为新增或 record_time 变化的电影重新生成电影卡片，再重建类型榜单和类型、标签对应表
+    try:
+        refresh_movie_cards()
+        build_genre_toplists()
+        sync_movie_memberships()
+    except Exception as e:
+        logger.error(f"[推荐系统] 刷新电影卡片、类型榜单和对应表出错: {str(e)}")
+    
     logger.info(f"[推荐系统] 电影导入完成，成功导入 {imported_count} 部电影")
     return imported_count 
\ No newline at end of file
@@ -0,0 +1,328 @@
+"""
+离线预计算的用户推荐
+
+首页和 /recommender/recommendations/ 原本在请求中实时计算个性化推荐，其中首页要把整张
+movie_collectmoviedb 与相似度表做带OR条件的连接和分组。这里改为由批处理为每个活跃用户
+按优先级合并各推荐引擎的结果:
+
+    als           ALS因子打分，用户在因子模型中时可用
+    cooccurrence  用户喜欢的电影的共现近邻相似度之和
+    content       用户喜欢的电影的内容相似电影相似度之和
+    popular       收藏人数最多的电影，用于补足N部
+
+每个来源内部按分数排序，前面的来源不足N部时才用后面的来源补充，同一部电影只保留优先级最高的来源，
+用户评分、收藏或看过的电影被排除。结果通过影子表整体替换 recommender_userrecommendation，
+在线请求只按 (user_id, rank) 唯一索引读取。
+
+还没有预计算结果的用户(新用户或上次批处理之后才活跃的用户)使用 neighbor_recommendations，
+只按电影ID读取相似度表和共现表。
+"""
+import itertools
+import logging
+import time
+from datetime import timedelta
+import numpy as np
+from scipy.sparse import csr_matrix
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+from movies.models import Movie
+from users.models import User, UserRating, UserFavorite, UserHistory
+from .models import MovieSimilarity, MovieCooccurrence, UserRecommendation
+from .similarity_store import ShadowTableWriter
+from .factor_store import get_factor_store
+from .rating_loader import load_interactions, SIGNAL_RATING
+from .cooccurrence import MIN_POSITIVE_RATING, binary_matrix
+
+logger = logging.getLogger('django')
+
+SOURCE_ALS = 'als'
+SOURCE_COOCCURRENCE = 'cooccurrence'
+SOURCE_CONTENT = 'content'
+SOURCE_POPULAR = 'popular'
+
+# 合并时的优先级，靠前的来源先占用名次
+SOURCES = (SOURCE_ALS, SOURCE_COOCCURRENCE, SOURCE_CONTENT, SOURCE_POPULAR)
+
+# 每个用户预计算的推荐数量
+DEFAULT_TOP_N = 30
+
+# 最近多少天内登录过或有交互的用户算作活跃用户
+DEFAULT_ACTIVE_DAYS = 90
+
+# 每块同时计算的用户数
+USER_BLOCK_SIZE = 1024
+
+# 热门电影候选为 top_n 的倍数，给已看过的热门电影留出余量
+POPULAR_CANDIDATE_FACTOR = 3
+
+# 在线回退时参考的用户最近喜欢的电影数量
+NEIGHBOR_SEED_MOVIES = 10
+
+
+def active_user_ids(active_days=DEFAULT_ACTIVE_DAYS):
+    """最近 active_days 天内登录过或有评分、收藏、观看记录的用户ID(升序)"""
+    cutoff = timezone.now() - timedelta(days=active_days)
+    user_ids = set(User.objects.filter(last_login__gte=cutoff).values_list('id', flat=True))
+    for model, time_field in ((UserRating, 'created_time'), (UserFavorite, 'created_time'), (UserHistory, 'watch_time')):
+        user_ids.update(
+            model.objects.filter(**{f'{time_field}__gte': cutoff}).values_list('user_id', flat=True).distinct()
+        )
+    return np.asarray(sorted(user_ids), dtype=np.int64)
+
+
+def _load_pairs(model):
+    """读取相似度表(或共现表)的全部 (movie1_id, movie2_id, similarity)"""
+    rows = model.objects.values_list('movie1_id', 'movie2_id', 'similarity').iterator(chunk_size=10000)
+    pairs = np.fromiter(itertools.chain.from_iterable(rows), dtype=np.float64).reshape(-1, 3)
+    return pairs[:, 0].astype(np.int64), pairs[:, 1].astype(np.int64), pairs[:, 2].astype(np.float32)
+
+
+def _symmetric_matrix(pairs, item_ids):
+    """把无序电影对展开为对称的 电影数×电影数 CSR矩阵，行列顺序与 item_ids 一致"""
+    movie1_ids, movie2_ids, similarities = pairs
+    rows, cols = np.searchsorted(item_ids, movie1_ids), np.searchsorted(item_ids, movie2_ids)
+    return csr_matrix(
+        (np.concatenate([similarities, similarities]), (np.concatenate([rows, cols]), np.concatenate([cols, rows]))),
+        shape=(len(item_ids), len(item_ids)),
+    )
+
+
+def _popular_movie_ids(limit):
+    """收藏人数最多的电影ID及其收藏人数"""
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            SELECT movie_id, collect_count
+            FROM movie_collectmoviedb
+            ORDER BY collect_count DESC
+            LIMIT %s
+        """, [limit])
+        rows = cursor.fetchall()
+    return (
+        np.asarray([row[0] for row in rows], dtype=np.int64),
+        np.asarray([row[1] or 0 for row in rows], dtype=np.float32),
+    )
+
+
+def _allowed(rows, cols, seen, valid):
+    """(行, 列) 既不是用户看过的电影、也在电影表中存在时为True"""
+    width = seen.shape[1]
+    seen = seen.tocoo()
+    seen_keys = seen.row.astype(np.int64) * width + seen.col
+    return valid[cols] & ~np.isin(rows.astype(np.int64) * width + cols, seen_keys)
+
+
+def _top_n_sparse(scores, seen, valid, top_n):
+    """稀疏分数矩阵每行去掉不可推荐的电影后分数最高的 top_n 个，返回 (行, 列, 分数, 行内名次)"""
+    scores = scores.tocoo()
+    keep = _allowed(scores.row, scores.col, seen, valid)
+    rows, cols, data = scores.row[keep], scores.col[keep], scores.data[keep]
+    order = np.lexsort((cols, -data, rows))
+    rows, cols, data = rows[order], cols[order], data[order]
+    ranks = np.arange(len(rows)) - np.searchsorted(rows, rows, side='left')
+    keep = ranks < top_n
+    return rows[keep], cols[keep], data[keep], ranks[keep]
+
+
+def _top_n_factors(user_factors, item_factors, seen, valid, top_n):
+    """
+    ALS因子打分后每行分数最高的 top_n 部电影
+
+    参数:
+        seen: 与打分矩阵同形状的稀疏矩阵，非零位置不参与排序
+        valid: 每列是否可以推荐
+    """
+    scores = user_factors @ item_factors.T
+    seen = seen.tocoo()
+    scores[seen.row, seen.col] = -np.inf
+    scores[:, ~valid] = -np.inf
+    top_n = min(top_n, scores.shape[1])
+    top = np.argpartition(-scores, top_n - 1, axis=1)[:, :top_n]
+    top_scores = np.take_along_axis(scores, top, axis=1)
+    order = np.argsort(-top_scores, axis=1, kind='stable')
+    top, top_scores = np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+    rows = np.repeat(np.arange(scores.shape[0]), top_n)
+    ranks = np.tile(np.arange(top_n), scores.shape[0])
+    top, top_scores = top.ravel(), top_scores.ravel()
+    keep = np.isfinite(top_scores)
+    return rows[keep], top[keep], top_scores[keep], ranks[keep]
+
+
+def merge_candidates(candidates, top_n):
+    """
+    按来源优先级合并各来源的候选
+
+    参数:
+        candidates: [(来源序号, 行, 列, 分数, 来源内名次), ...]
+
+    返回:
+        (行, 列, 分数, 来源序号, 名次)，按行和名次排序，每行最多 top_n 个，名次从0开始
+    """
+    parts = [
+        (rows, cols, scores, np.full(len(rows), source, dtype=np.int8), ranks)
+        for source, rows, cols, scores, ranks in candidates
+    ]
+    if not parts:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int8), empty
+    rows, cols, scores, sources, ranks = (np.concatenate(columns) for columns in zip(*parts))
+    rows, cols, ranks = rows.astype(np.int64), cols.astype(np.int64), ranks.astype(np.int64)
+
+    # 同一部电影只保留优先级最高的来源
+    order = np.lexsort((ranks, sources, cols, rows))
+    rows, cols, scores, sources, ranks = rows[order], cols[order], scores[order], sources[order], ranks[order]
+    first = np.ones(len(rows), dtype=bool)
+    first[1:] = (rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1])
+    rows, cols, scores, sources, ranks = rows[first], cols[first], scores[first], sources[first], ranks[first]
+
+    order = np.lexsort((ranks, sources, rows))
+    rows, cols, scores, sources = rows[order], cols[order], scores[order], sources[order]
+    positions = np.arange(len(rows)) - np.searchsorted(rows, rows, side='left')
+    keep = positions < top_n
+    return rows[keep], cols[keep], scores[keep], sources[keep], positions[keep]
+
+
+def refresh_user_recommendations(top_n=None, active_days=None, block_size=USER_BLOCK_SIZE):
+    """
+    为活跃用户预计算推荐并整体替换用户推荐表
+
+    参数:
+        top_n: 每个用户保存的推荐数量，默认读取 settings.RECOMMENDER['USER_RECOMMENDATION_TOP_N']
+        active_days: 活跃用户的天数，默认读取 settings.RECOMMENDER['ACTIVE_USER_DAYS']，为0时计算全部有交互的用户
+        block_size: 每块同时计算的用户数
+
+    返回:
+        {'users', 'rows', 'sources': {来源: 条数}}
+    """
+    start_time = time.time()
+    config = settings.RECOMMENDER
+    top_n = top_n or config.get('USER_RECOMMENDATION_TOP_N', DEFAULT_TOP_N)
+    if active_days is None:
+        active_days = config.get('ACTIVE_USER_DAYS', DEFAULT_ACTIVE_DAYS)
+
+    interactions = load_interactions(favorites=True, history=True)
+    engines = {SOURCE_COOCCURRENCE: _load_pairs(MovieCooccurrence), SOURCE_CONTENT: _load_pairs(MovieSimilarity)}
+    store = get_factor_store()
+    popular_ids, popular_counts = _popular_movie_ids(top_n * POPULAR_CANDIDATE_FACTOR)
+
+    # 所有来源的电影统一编码，不在电影表中的电影不会被推荐
+    id_parts = [interactions.item_ids, popular_ids]
+    id_parts += [ids for pairs in engines.values() for ids in pairs[:2]]
+    if store is not None:
+        id_parts.append(np.asarray(store.item_ids))
+    item_ids = np.unique(np.concatenate(id_parts))
+    existing_ids = np.fromiter(Movie.objects.values_list('id', flat=True).iterator(), dtype=np.int64)
+    valid = np.isin(item_ids, existing_ids)
+
+    item_cols = np.searchsorted(item_ids, interactions.item_ids)[interactions.item_idx]
+    shape = (interactions.n_users, len(item_ids))
+    seen = binary_matrix(interactions.user_idx, item_cols, *shape)
+    liked = (interactions.kinds != SIGNAL_RATING) | (interactions.values >= MIN_POSITIVE_RATING)
+    liked = binary_matrix(interactions.user_idx[liked], item_cols[liked], *shape).astype(np.float32)
+    neighbors = {source: _symmetric_matrix(pairs, item_ids) for source, pairs in engines.items() if len(pairs[0])}
+    popular_cols = np.searchsorted(item_ids, popular_ids)
+    if store is not None:
+        als_cols = np.searchsorted(item_ids, np.asarray(store.item_ids))
+        als_factors = np.asarray(store.item_factors, dtype=np.float32)
+
+    user_ids = interactions.user_ids
+    if active_days:
+        user_ids = np.intersect1d(user_ids, active_user_ids(active_days))
+    user_rows = np.searchsorted(interactions.user_ids, user_ids)
+    available = ([SOURCE_ALS] if store is not None else []) + list(neighbors) + [SOURCE_POPULAR]
+    logger.info(f"[推荐系统] 开始预计算用户推荐: {len(user_ids)} 个活跃用户，每人 {top_n} 部，可用来源: {', '.join(available)}")
+
+    source_counts = dict.fromkeys(SOURCES, 0)
+    with ShadowTableWriter(model=UserRecommendation) as writer:
+        for start in range(0, len(user_rows), block_size):
+            rows = user_rows[start:start + block_size]
+            block_seen = seen[rows]
+            candidates = []
+
+            if store is not None:
+                factor_rows = store.user_rows(interactions.user_ids[rows])
+                in_model = np.flatnonzero(factor_rows >= 0)
+                if len(in_model):
+                    r, c, s, k = _top_n_factors(
+                        np.asarray(store.user_factors[factor_rows[in_model]], dtype=np.float32), als_factors,
+                        block_seen[in_model][:, als_cols], valid[als_cols], top_n
+                    )
+                    candidates.append((SOURCES.index(SOURCE_ALS), in_model[r], als_cols[c], s, k))
+
+            block_liked = liked[rows]
+            for source in (SOURCE_COOCCURRENCE, SOURCE_CONTENT):
+                if source not in neighbors:
+                    continue
+                r, c, s, k = _top_n_sparse(block_liked @ neighbors[source], block_seen, valid, top_n)
+                candidates.append((SOURCES.index(source), r, c, s, k))
+
+            r = np.repeat(np.arange(len(rows)), len(popular_cols))
+            c = np.tile(popular_cols, len(rows))
+            k = np.tile(np.arange(len(popular_cols)), len(rows))
+            s = np.tile(popular_counts, len(rows))
+            keep = _allowed(r, c, block_seen, valid)
+            candidates.append((SOURCES.index(SOURCE_POPULAR), r[keep], c[keep], s[keep], k[keep]))
+
+            r, c, s, sources, ranks = merge_candidates(candidates, top_n)
+            block_user_ids = interactions.user_ids[rows]
+            for user_id, movie_id, score, source, rank in zip(
+                block_user_ids[r].tolist(), item_ids[c].tolist(), s.tolist(), sources.tolist(), ranks.tolist()
+            ):
+                writer.write(user_id, rank + 1, movie_id, score, SOURCES[source])
+            for source, count in zip(*np.unique(sources, return_counts=True)):
+                source_counts[SOURCES[source]] += int(count)
+
+    stats = {'users': int(len(user_ids)), 'rows': int(sum(source_counts.values())), 'sources': source_counts}
+    logger.info(
+        f"[推荐系统] 用户推荐预计算完成: {stats['users']} 个用户，{stats['rows']} 条推荐，"
+        f"来源分布 {source_counts}，耗时 {time.time() - start_time:.2f}秒"
+    )
+    return stats
+
+
+def precomputed_recommendations(user_id, limit=DEFAULT_TOP_N):
+    """按名次读取预计算的推荐 [(movie_id, score, source), ...]，没有预计算结果时返回空列表"""
+    return list(
+        UserRecommendation.objects.filter(user_id=user_id).order_by('rank')
+        .values_list('movie_id', 'score', 'source')[:limit]
+    )
+
+
+def neighbor_recommendations(user_id, limit=10, seeds=NEIGHBOR_SEED_MOVIES):
+    """
+    没有预计算结果时的在线推荐
+
+    取用户最近评分(>= 7)和收藏的 seeds 部电影，按电影ID读取它们的共现近邻和内容相似电影，
+    同一来源的相似度相加后排序，排除用户评分、收藏或看过的电影。只做按用户和按电影ID的索引查询。
+
+    返回:
+        [(movie_id, score, source), ...]；用户没有喜欢的电影时返回空列表
+    """
+    liked = list(
+        UserRating.objects.filter(user_id=user_id, rating__gte=MIN_POSITIVE_RATING)
+        .order_by('-created_time').values_list('movie_id', flat=True)[:seeds]
+    )
+    liked += list(
+        UserFavorite.objects.filter(user_id=user_id).order_by('-created_time').values_list('movie_id', flat=True)[:seeds]
+    )
+    if not liked:
+        return []
+    excluded = set(UserRating.objects.filter(user_id=user_id).values_list('movie_id', flat=True))
+    excluded.update(UserFavorite.objects.filter(user_id=user_id).values_list('movie_id', flat=True))
+    excluded.update(UserHistory.objects.filter(user_id=user_id).values_list('movie_id', flat=True))
+
+    recommendations = []
+    for source, model in ((SOURCE_COOCCURRENCE, MovieCooccurrence), (SOURCE_CONTENT, MovieSimilarity)):
+        scores = {}
+        # 两个方向分别查询，各自走 movie1_id 和 movie2_id 上的索引
+        for seed_field, neighbor_field in (('movie1_id', 'movie2_id'), ('movie2_id', 'movie1_id')):
+            rows = model.objects.filter(**{f'{seed_field}__in': liked}).values_list(neighbor_field, 'similarity')
+            for movie_id, similarity in rows:
+                if movie_id not in excluded:
+                    scores[movie_id] = scores.get(movie_id, 0.0) + similarity
+        for movie_id, score in sorted(scores.items(), key=lambda item: (-item[1], item[0])):
+            recommendations.append((movie_id, score, source))
+            excluded.add(movie_id)
+        if len(recommendations) >= limit:
+            break
+    return recommendations[:limit]
@@ -0,0 +1,261 @@
+"""
+电影相似度表的批量写入
+
+全量重建时先把数据写入影子表，装载完成后再建立二级索引，最后用一条
+RENAME TABLE 原子地替换线上表。重建期间读取方始终看到完整的旧数据，
+不会出现空表或只写了一部分的表。
+
+写入使用独立的pymysql连接：多行INSERT和建索引可能超过Django连接的
+read_timeout，且不需要经过ORM。
+"""
+import logging
+import time
+import pymysql
+from django.db import connection
+from mvrecommend.db_pool import DB_CONFIG
+from .models import MovieSimilarity
+
+logger = logging.getLogger('django')
+
+# 每次发送给MySQL的行数，pymysql的executemany会把它们改写为多行INSERT
+INSERT_BATCH_SIZE = 5000
+
+# 每写入多少行输出一次写入速度
+REPORT_INTERVAL = 100000
+
+
+def connection_config():
+    """写入连接的pymysql参数，不受读写超时限制；Spark executor也用它直接连接数据库"""
+    config = dict(DB_CONFIG)
+    config.update({
+        'cursorclass': pymysql.cursors.Cursor,
+        'autocommit': True,
+        'read_timeout': None,
+        'write_timeout': None,
+    })
+    return config
+
+
+def _connect():
+    """创建写入连接"""
+    return pymysql.connect(**connection_config())
+
+
+class SimilarityTableWriter:
+    """
+    向相似度表追加 (movie1_id, movie2_id, similarity) 记录，已存在的电影对会被忽略
+
+    model 为要写入的表模型，默认写入内容相似度表；每条记录按模型字段顺序给出除主键外的各列
+
+    用法:
+        with SimilarityTableWriter() as writer:
+            writer.write(movie1_id, movie2_id, similarity)
+    """
+
+    def __init__(self, batch_size=INSERT_BATCH_SIZE, model=MovieSimilarity):
+        self.model = model
+        self.live_table = model._meta.db_table
+        self.table = self.live_table
+        self.batch_size = batch_size
+        self.rows_written = 0
+        self._batch = []
+        self._started = time.time()
+        self._next_report = REPORT_INTERVAL
+        self._conn = _connect()
+        self.columns = [field.column for field in model._meta.concrete_fields if not field.primary_key]
+        self._insert_sql = self._build_insert_sql('INSERT IGNORE')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                self.finish()
+            else:
+                self.abort()
+        finally:
+            self.close()
+        return False
+
+    def _build_insert_sql(self, verb):
+        columns = ', '.join(f'`{column}`' for column in self.columns)
+        placeholders = ', '.join(['%s'] * len(self.columns))
+        return f"{verb} INTO `{self.table}` ({columns}) VALUES ({placeholders})"
+
+    def _execute(self, *statements):
+        with self._conn.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(sql)
+
+    def write(self, *values):
+        """写入一条记录，如 (movie1_id, movie2_id, similarity)，攒够一批后发送"""
+        self._batch.append(values)
+        if len(self._batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """发送当前批次"""
+        if not self._batch:
+            return
+        with self._conn.cursor() as cursor:
+            cursor.executemany(self._insert_sql, self._batch)
+        self.rows_written += len(self._batch)
+        self._batch = []
+        if self.rows_written >= self._next_report:
+            logger.info(f"[推荐系统] 相似度表 {self.table} 已写入 {self.rows_written} 条记录，{self.rows_per_second():.0f} 条/秒")
+            self._next_report += REPORT_INTERVAL
+
+    def rows_per_second(self):
+        """从创建writer开始计算的平均写入速度"""
+        elapsed = time.time() - self._started
+        return self.rows_written / elapsed if elapsed > 0 else 0.0
+
+    def finish(self):
+        """写入剩余数据"""
+        self.flush()
+        logger.info(f"[推荐系统] 相似度表 {self.table} 共写入 {self.rows_written} 条记录，{self.rows_per_second():.0f} 条/秒")
+
+    def abort(self):
+        """丢弃未发送的数据"""
+        self._batch = []
+
+    def close(self):
+        try:
+            self._conn.close()
+        except Exception:
+            pass
+
+
+class ShadowTableWriter(SimilarityTableWriter):
+    """
+    全量重建相似度表: 写入影子表，完成后原子替换线上表
+
+    影子表由 CREATE TABLE ... LIKE 创建，装载前删除其二级索引，装载后一次性重建；
+    外键在替换后以 foreign_key_checks=0 重新添加，不会扫描已写入的数据。
+    写入过程中出错时删除影子表，线上表保持不变。
+
+    keep_unique=True 时保留唯一索引，其他写入方(如Spark executor)可以用 INSERT IGNORE
+    重复写入同一批记录而不产生重复行，代价是装载时需要维护该索引。
+    """
+
+    def __init__(self, batch_size=INSERT_BATCH_SIZE, model=MovieSimilarity, keep_unique=False):
+        super().__init__(batch_size, model)
+        self.table = f'{self.live_table}_new'
+        self.old_table = f'{self.live_table}_old'
+        self.keep_unique = keep_unique
+        self._insert_sql = self._build_insert_sql('INSERT')
+        self._indexes = []
+        self._foreign_keys = []
+        self._prepare()
+
+    def _prepare(self):
+        """创建不带二级索引的影子表，并记录需要重建的索引和外键"""
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, self.live_table)
+
+        fk_names = {}
+        for name, info in constraints.items():
+            if info['primary_key']:
+                continue
+            if info['foreign_key']:
+                fk_names[tuple(info['columns'])] = name
+            if info.get('index') and not (self.keep_unique and info['unique']):
+                self._indexes.append((name, list(info['columns']), info['unique']))
+
+        # 外键定义以模型为准，线上表缺失外键时也能补上
+        for field in self.model._meta.concrete_fields:
+            if not field.is_relation:
+                continue
+            target = field.target_field
+            name = fk_names.get((field.column,), f'{self.live_table}_{field.column}_fk')
+            self._foreign_keys.append((name, field.column, target.model._meta.db_table, target.column))
+
+        self._execute(
+            f"DROP TABLE IF EXISTS `{self.table}`",
+            f"DROP TABLE IF EXISTS `{self.old_table}`",
+            f"CREATE TABLE `{self.table}` LIKE `{self.live_table}`",
+        )
+        if self._indexes:
+            drops = ', '.join(f"DROP INDEX `{name}`" for name, _, _ in self._indexes)
+            self._execute(f"ALTER TABLE `{self.table}` {drops}")
+        logger.info(f"[推荐系统] 已创建影子表 {self.table}，装载完成后重建 {len(self._indexes)} 个索引")
+
+    def finish(self):
+        """建立索引并原子替换线上表"""
+        # 装载、建索引或替换失败时线上表仍是旧表，删除影子表后再抛出异常
+        try:
+            self.flush()
+            logger.info(f"[推荐系统] 影子表装载完成，共 {self.rows_written} 条记录，{self.rows_per_second():.0f} 条/秒，开始建立索引...")
+
+            if self._indexes:
+                adds = ', '.join(
+                    f"ADD {'UNIQUE ' if unique else ''}INDEX `{name}` ({', '.join(f'`{c}`' for c in columns)})"
+                    for name, columns, unique in self._indexes
+                )
+                self._execute(f"ALTER TABLE `{self.table}` {adds}")
+
+            # 一条RENAME TABLE同时完成两次重命名，读取方不会看到表缺失的中间状态
+            self._execute(f"RENAME TABLE `{self.live_table}` TO `{self.old_table}`, `{self.table}` TO `{self.live_table}`")
+        except Exception:
+            self.abort()
+            raise
+        self._execute(f"DROP TABLE `{self.old_table}`")
+        logger.info(f"[推荐系统] 已用影子表替换线上相似度表 {self.live_table}")
+
+        # 旧表删除后外键名称才可复用；写入的电影均已存在，跳过外键检查
+        if self._foreign_keys:
+            adds = ', '.join(
+                f"ADD CONSTRAINT `{name}` FOREIGN KEY (`{column}`) REFERENCES `{ref_table}` (`{ref_column}`)"
+                for name, column, ref_table, ref_column in self._foreign_keys
+            )
+            self._execute("SET foreign_key_checks = 0")
+            try:
+                self._execute(f"ALTER TABLE `{self.live_table}` {adds}")
+            finally:
+                # 添加外键失败时也恢复外键检查
+                self._execute("SET foreign_key_checks = 1")
+
+    def count_rows(self):
+        """重新统计影子表中的记录数，用于其他连接直接写入影子表之后"""
+        self.flush()
+        with self._conn.cursor() as cursor:
+            cursor.execute(f"SELECT COUNT(*) FROM `{self.table}`")
+            self.rows_written = cursor.fetchone()[0]
+        return self.rows_written
+
+    def truncate(self):
+        """清空影子表中已写入的数据，用于换一种方式重新装载"""
+        self._batch = []
+        self._execute(f"TRUNCATE TABLE `{self.table}`")
+        self.rows_written = 0
+
+    def keep_top(self, max_records):
+        """
+        只保留影子表中相似度最高的 max_records 条记录，与有序写入时的截断规则一致，
+        第 max_records 名的同分记录会一并保留
+
+        返回:
+            保留的记录数
+        """
+        self.flush()
+        with self._conn.cursor() as cursor:
+            cursor.execute(
+                f"SELECT similarity FROM `{self.table}` ORDER BY similarity DESC LIMIT 1 OFFSET %s",
+                (max_records - 1,)
+            )
+            row = cursor.fetchone()
+            if row is not None:
+                cursor.execute(f"DELETE FROM `{self.table}` WHERE similarity < %s", (row[0],))
+                self.rows_written -= cursor.rowcount
+                logger.info(f"[推荐系统] 已按最大记录数 {max_records} 删除 {cursor.rowcount} 条低相似度记录")
+        return self.rows_written
+
+    def abort(self):
+        """删除影子表，保留线上表"""
+        super().abort()
+        try:
+            self._execute(f"DROP TABLE IF EXISTS `{self.table}`")
+            logger.warning(f"[推荐系统] 相似度重建失败，已删除影子表 {self.table}，线上数据保持不变")
+        except Exception as e:
+            logger.error(f"[推荐系统] 删除影子表 {self.table} 失败: {str(e)}")
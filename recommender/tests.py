@@ -1,3 +1,953 @@
-from django.test import TestCase
+import os
+import random
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.conf import settings
+from django.test import SimpleTestCase, TestCase, override_settings
+from scipy.sparse import csr_matrix
+
+from movies.models import Movie
+from users.models import User, UserFavorite, UserHistory, UserRating
+
+from . import content_similarity
+from .ann_index import LSHIndex, measure_recall
+from .component_store import SimilarityComponents, save_similarity_components, similarity_weights
+from .content_similarity import (
+    SIMILARITY_WEIGHTS, build_feature_matrices, build_inverted_index, build_pair_features, incremental_top_k_pairs,
+    iter_candidate_pairs, iter_similarity_pairs, iter_top_k_pairs, minhash_accuracy_report, minhash_top_k_pairs,
+    movie_content_hash, neighbor_floors, neighbors_to_pairs, owned_top_k_entries, popcount, push_top_k, row_floors,
+    score_block, score_movie_pair, score_pairs,
+)
+from .cooccurrence import binary_matrix, cooccurrence_counts, cooccurrence_delta
+from .factor_similarity import factor_top_k_pairs
+from .factor_store import FactorStore, current_version, save_factors
+from .feature_store import MovieFeatureStore, refresh_feature_store
+from .implicit_als import confidence_matrix, implicit_loss, least_squares_cg, signal_strengths, train_implicit_als
+from .local_engine import iter_local_pairs
+from .models import MovieContentHash, MovieCooccurrence, MovieSimilarity
+from .rating_loader import SIGNAL_FAVORITE, SIGNAL_HISTORY, SIGNAL_RATING, Interactions, _ColumnBuffer, _encode, _stream_table
+from .recommendation import (
+    _ensure_movies_exist, _incremental_similarity_update, _save_similarity_results, update_similarity_from_collectmoviedb,
+)
+from .recommendation_store import _top_n_factors, _top_n_sparse, merge_candidates, neighbor_recommendations
+from .similarity_store import ShadowTableWriter, SimilarityTableWriter
+
+
+def random_movies(n, seed=0, tags=80, people=60):
+    """生成带类型、标签、导演、演员的随机电影，电影ID不连续"""
+    rng = random.Random(seed)
+    genres = [f'类型{i}' for i in range(8)]
+    tag_names = [f'标签{i}' for i in range(tags)]
+    names = [f'演员{i}' for i in range(people)]
+    return [{
+        'movie_id': i * 7 + 3,
+        'genres': rng.sample(genres, rng.randint(0, 3)),
+        'tags': rng.sample(tag_names, rng.randint(0, 6)),
+        'directors': rng.sample(names, rng.randint(0, 2)),
+        'actors': rng.sample(names, rng.randint(0, 5)),
+    } for i in range(n)]
+
+
+def brute_force_pairs(movies, min_similarity, weights=SIMILARITY_WEIGHTS):
+    """逐对计算全部电影对，返回 {(movie1_id, movie2_id): similarity}"""
+    pairs = {}
+    for i, movie1 in enumerate(movies):
+        for movie2 in movies[i + 1:]:
+            similarity = score_movie_pair(movie1, movie2, min_similarity, weights)
+            if similarity >= min_similarity:
+                pairs[(movie1['movie_id'], movie2['movie_id'])] = similarity
+    return pairs
+
+
+def top_k_similarities(pairs, top_k):
+    """每部电影在 pairs 中最高的 top_k 个相似度(降序)，pairs 为 {(movie1_id, movie2_id): similarity}"""
+    by_movie = {}
+    for (movie1_id, movie2_id), similarity in pairs.items():
+        by_movie.setdefault(movie1_id, []).append(similarity)
+        by_movie.setdefault(movie2_id, []).append(similarity)
+    return {movie_id: sorted(similarities, reverse=True)[:top_k] for movie_id, similarities in by_movie.items()}
+
+
+class _NumpyWithoutBitwiseCount:
+    """模拟numpy 2.0之前没有 bitwise_count 的numpy"""
+
+    def __getattr__(self, name):
+        if name == 'bitwise_count':
+            raise AttributeError(name)
+        return getattr(np, name)
+
+
+class ContentSimilarityTests(SimpleTestCase):
+    """内容相似度各计算内核与逐对计算的一致性"""
+
+    def setUp(self):
+        self.movies = random_movies(150)
+
+    def assertSamePairs(self, actual, expected):
+        self.assertEqual(set(actual), set(expected))
+        for key, similarity in expected.items():
+            self.assertAlmostEqual(actual[key], similarity, places=5)
+
+    def assertTopKNeighbors(self, actual, movies, top_k, min_similarity=0.15):
+        """
+        每部电影在 actual 中的前K个相似度与逐对计算的前K个相同，且 actual 中的每个电影对
+        都位于至少一方的前K名；相似度相同的邻居可以任选其一
+        """
+        expected = brute_force_pairs(movies, min_similarity)
+        for key, similarity in actual.items():
+            self.assertAlmostEqual(similarity, expected[key], places=5)
+        expected_top = top_k_similarities(expected, top_k)
+        actual_top = top_k_similarities(actual, top_k)
+        self.assertEqual(set(actual_top), set(expected_top))
+        for movie_id, similarities in expected_top.items():
+            np.testing.assert_allclose(actual_top[movie_id], similarities, atol=1e-6)
+        for (movie1_id, movie2_id), similarity in actual.items():
+            floors = [expected_top[movie_id][-1] if len(expected_top[movie_id]) == top_k else 0.0
+                      for movie_id in (movie1_id, movie2_id)]
+            self.assertGreaterEqual(similarity, min(floors) - 1e-6)
+
+    def test_sparse_engine_matches_pairwise_scoring(self):
+        expected = brute_force_pairs(self.movies, 0.15)
+        for block_size in (40, 2000):
+            with self.subTest(block_size=block_size):
+                actual = {(m1, m2): s for m1, m2, s in iter_similarity_pairs(self.movies, 0.15, block_size=block_size)}
+                self.assertSamePairs(actual, expected)
+
+    def test_sparse_engine_uses_given_weights(self):
+        weights = {'genres': 0.1, 'directors': 0.5, 'actors': 0.3, 'tags': 0.1}
+        expected = brute_force_pairs(self.movies, 0.15, weights)
+        actual = {(m1, m2): s for m1, m2, s in iter_similarity_pairs(self.movies, 0.15, weights=weights)}
+        self.assertSamePairs(actual, expected)
+        self.assertNotEqual(set(expected), set(brute_force_pairs(self.movies, 0.15)))
+
+    def test_empty_catalogue(self):
+        self.assertEqual(list(iter_similarity_pairs([], 0.15)), [])
+
+    def test_candidate_pairs_are_exactly_the_pairs_sharing_a_feature(self):
+        shared = {
+            (i, j) for i, movie1 in enumerate(self.movies) for j in range(i + 1, len(self.movies))
+            if any(set(movie1[field]) & set(self.movies[j][field]) for field in SIMILARITY_WEIGHTS)
+        }
+        self.assertEqual(set(iter_candidate_pairs(self.movies, max_posting_size=None)), shared)
+
+        # 候选对覆盖了全部超过阈值的电影对
+        index_of = {movie['movie_id']: i for i, movie in enumerate(self.movies)}
+        self.assertLessEqual({(index_of[m1], index_of[m2]) for m1, m2 in brute_force_pairs(self.movies, 0.15)}, shared)
+
+    def test_long_postings_are_sampled(self):
+        index = build_inverted_index(self.movies, max_posting_size=10)
+        self.assertTrue(all(len(postings) <= 10 for postings in index.values()))
+        self.assertEqual(index, build_inverted_index(self.movies, max_posting_size=10))
+        self.assertGreater(max(len(postings) for postings in build_inverted_index(self.movies, max_posting_size=None).values()), 10)
+
+    def test_top_k_pairs_keep_each_movies_best_neighbors(self):
+        for top_k, block_size in ((1, 2000), (5, 40), (20, 64)):
+            with self.subTest(top_k=top_k, block_size=block_size):
+                actual = {(m1, m2): s for m1, m2, s in iter_top_k_pairs(self.movies, 0.15, top_k, block_size=block_size)}
+                self.assertTopKNeighbors(actual, self.movies, top_k)
+
+    def test_neighbor_heaps_keep_each_movies_best_neighbors(self):
+        # Spark和倒排列表路径逐对产出相似度后用堆保留每部电影的前K个邻居
+        neighbors = {}
+        for (movie1_id, movie2_id), similarity in brute_force_pairs(self.movies, 0.15).items():
+            push_top_k(neighbors.setdefault(movie1_id, []), (similarity, movie2_id), 5)
+            push_top_k(neighbors.setdefault(movie2_id, []), (similarity, movie1_id), 5)
+        pairs = neighbors_to_pairs(neighbors)
+        self.assertEqual([s for _, _, s in pairs], sorted((s for _, _, s in pairs), reverse=True))
+        self.assertTopKNeighbors({(m1, m2): s for m1, m2, s in pairs}, self.movies, 5)
+
+    def test_incremental_pairs_merge_into_stored_neighbors(self):
+        top_k = 5
+        stored = list(iter_top_k_pairs(self.movies, 0.15, top_k))
+
+        # 修改部分电影的标签，移除部分电影，再加入几部新电影
+        rng = random.Random(1)
+        movies = [dict(movie) for movie in self.movies if movie['movie_id'] % 11 != 0]
+        for movie in movies[::9]:
+            movie['tags'] = rng.sample([f'标签{i}' for i in range(80)], 4)
+        movies += random_movies(8, seed=2)
+        for i, movie in enumerate(movies[-8:]):
+            movie['movie_id'] = 10000 + i
+
+        old_hashes = {movie['movie_id']: movie_content_hash(movie) for movie in self.movies}
+        changed_rows = [i for i, movie in enumerate(movies) if old_hashes.get(movie['movie_id']) != movie_content_hash(movie)]
+        changed_ids = {movies[i]['movie_id'] for i in changed_rows}
+        stale_ids = changed_ids | (set(old_hashes) - {movie['movie_id'] for movie in movies})
+        self.assertTrue(changed_ids and stale_ids - changed_ids)
+
+        kept = [(m1, m2, s) for m1, m2, s in stored if m1 not in stale_ids and m2 not in stale_ids]
+        floors = neighbor_floors(kept, top_k)
+        movie1_ids, movie2_ids, similarities = incremental_top_k_pairs(movies, changed_rows, floors, 0.15, top_k, block_size=7)
+        actual = dict(zip(zip(movie1_ids.tolist(), movie2_ids.tolist()), similarities.tolist()))
+
+        expected = brute_force_pairs(movies, 0.15)
+        expected_top = top_k_similarities(expected, top_k)
+        for (movie1_id, movie2_id), similarity in actual.items():
+            self.assertTrue({movie1_id, movie2_id} & changed_ids)
+            self.assertAlmostEqual(similarity, expected[(movie1_id, movie2_id)], places=5)
+
+        # 变化电影的邻居列表与全量计算一致
+        actual_top = top_k_similarities(actual, top_k)
+        for movie_id in changed_ids & set(expected_top):
+            np.testing.assert_allclose(actual_top[movie_id], expected_top[movie_id], atol=1e-6)
+
+        # 达到未变化电影当前第K名的新电影对都进入了它的邻居列表
+        for (movie1_id, movie2_id), similarity in expected.items():
+            for changed, other in ((movie1_id, movie2_id), (movie2_id, movie1_id)):
+                if changed in changed_ids and other not in changed_ids and similarity >= floors.get(other, 0.0) + 1e-6:
+                    self.assertIn((movie1_id, movie2_id), actual)
+
+        self.assertEqual(incremental_top_k_pairs(movies, [], floors, 0.15, top_k)[0].size, 0)
+
+    def test_minhash_candidates_are_scored_exactly(self):
+        movies = random_movies(300)
+        movie1_ids, movie2_ids, similarities = minhash_top_k_pairs(movies, 0.15, top_k=10)
+        expected = brute_force_pairs(movies, 0.15)
+        self.assertGreater(len(similarities), 0)
+        for key, similarity in zip(zip(movie1_ids.tolist(), movie2_ids.tolist()), similarities.tolist()):
+            self.assertAlmostEqual(similarity, expected[key], places=5)
+
+        # 候选对是近似的，固定种子下召回率有下限
+        report = minhash_accuracy_report(movies, sample_size=300, top_k=10)
+        self.assertGreaterEqual(report['recall'], 0.6)
+        self.assertEqual(report['samples'], 300)
+
+    def test_owned_top_k_entries_write_each_top_k_pair_once(self):
+        top_k, block_size = 5, 32
+        features = build_feature_matrices(self.movies)
+        n = len(self.movies)
+        blocks = [(start, min(start + block_size, n)) for start in range(0, n, block_size)]
+
+        # 与Spark路径相同的两轮: 先求每行第K名，再由各分块独立写出自己负责的电影对
+        floor_sims = np.full(n, -np.inf)
+        floor_cols = np.full(n, -1, dtype=np.int64)
+        for start, end in blocks:
+            block = score_block(features, start, end, 0.15)
+            floor_sims[start:end], floor_cols[start:end] = row_floors(block, np.arange(start, end), top_k, 0.15)
+        written = []
+        for start, end in blocks:
+            block = score_block(features, start, end, 0.15)
+            rows, cols, _ = owned_top_k_entries(block, np.arange(start, end), floor_sims, floor_cols, 0.15)
+            written.extend(tuple(sorted((self.movies[r]['movie_id'], self.movies[c]['movie_id'])))
+                           for r, c in zip(rows.tolist(), cols.tolist()))
+
+        expected = {(m1, m2) for m1, m2, _ in iter_top_k_pairs(self.movies, 0.15, top_k)}
+        self.assertEqual(len(written), len(set(written)))
+        self.assertEqual(set(written), expected)
+
+    def test_local_engine_matches_sparse_engine(self):
+        expected = {(m1, m2): s for m1, m2, s in iter_top_k_pairs(self.movies, 0.15, 5)}
+        actual = {(m1, m2): s for m1, m2, s in iter_local_pairs(self.movies, 0.15, 5, block_size=20, workers=2)}
+        self.assertSamePairs(actual, expected)
+
+        expected = brute_force_pairs(self.movies, 0.15)
+        actual = {(m1, m2): s for m1, m2, s in iter_local_pairs(self.movies, 0.15, None, block_size=20, workers=2)}
+        self.assertSamePairs(actual, expected)
+
+    def test_genre_only_floor(self):
+        # 十个类型中只有一个相同: 加权和为 0.04，低于阈值时提升到基础分 0.05
+        movies = [
+            {'movie_id': 1, 'genres': [f'g{i}' for i in range(10)], 'directors': [], 'actors': [], 'tags': []},
+            {'movie_id': 2, 'genres': ['g0'] + [f'h{i}' for i in range(9)], 'directors': [], 'actors': [], 'tags': []},
+        ]
+        self.assertAlmostEqual(score_movie_pair(movies[0], movies[1], 0.15), 0.05)
+        block = score_block(build_feature_matrices(movies), 0, 1, 0.15)
+        self.assertAlmostEqual(block[0, 1], 0.05, places=6)
+        pair_features = build_pair_features(build_feature_matrices(movies))
+        np.testing.assert_allclose(score_pairs(pair_features, np.array([0]), np.array([1]), 0.15), [0.05])
+
+    def test_score_pairs_matches_pairwise_scoring(self):
+        movies = random_movies(80, seed=1, tags=200)
+        rows, cols = np.triu_indices(len(movies), k=1)
+        expected = [score_movie_pair(movies[i], movies[j], 0.15) for i, j in zip(rows.tolist(), cols.tolist())]
+
+        # 默认参数，以及位图放不下全部标签、ID数组超过定长宽度的情况
+        for max_bits, max_width in ((content_similarity.BITSET_MAX_BITS, content_similarity.PADDED_MAX_WIDTH), (70, 2)):
+            with self.subTest(max_bits=max_bits, max_width=max_width), \
+                    mock.patch.object(content_similarity, 'BITSET_MAX_BITS', max_bits), \
+                    mock.patch.object(content_similarity, 'PADDED_MAX_WIDTH', max_width):
+                pair_features = build_pair_features(build_feature_matrices(movies))
+                np.testing.assert_allclose(score_pairs(pair_features, rows, cols, 0.15), expected, atol=1e-9)
+
+    def test_popcount_fallback_without_bitwise_count(self):
+        rng = np.random.default_rng(0)
+        words = rng.integers(0, np.iinfo(np.int64).max, size=(50, 3), dtype=np.int64).astype(np.uint64)
+        words[0, 0] = np.uint64(0xFFFFFFFFFFFFFFFF)
+        expected = np.array([[bin(int(word)).count('1') for word in row] for row in words])
+        with mock.patch.object(content_similarity, 'np', _NumpyWithoutBitwiseCount()), \
+                mock.patch.object(content_similarity, '_POPCOUNT16', None):
+            np.testing.assert_array_equal(popcount(words), expected)
+        np.testing.assert_array_equal(popcount(words), expected)
+
+class FactorSimilarityTests(SimpleTestCase):
+    """ALS因子余弦相似度与逐对计算的一致性"""
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.factors = rng.normal(size=(60, 8))
+        self.factors[7] = 0
+        self.movie_ids = np.arange(60) * 5 + 1
+        normalized = self.factors / np.maximum(np.linalg.norm(self.factors, axis=1, keepdims=True), 1e-12)
+        sims = normalized @ normalized.T
+        self.expected = {
+            (int(self.movie_ids[i]), int(self.movie_ids[j])): sims[i, j]
+            for i in range(60) for j in range(i + 1, 60) if sims[i, j] >= 0.1
+        }
+
+    def test_top_k_pairs_match_exact_cosine(self):
+        movie1_ids, movie2_ids, similarities = factor_top_k_pairs(self.movie_ids, self.factors, 0.1, top_k=5, block_size=16)
+        actual = dict(zip(zip(movie1_ids.tolist(), movie2_ids.tolist()), similarities.tolist()))
+        for key, similarity in actual.items():
+            self.assertAlmostEqual(similarity, self.expected[key], places=5)
+        self.assertNotIn(36, {movie_id for pair in actual for movie_id in pair})
+
+        actual_top = top_k_similarities(actual, 5)
+        for movie_id, similarities in top_k_similarities(self.expected, 5).items():
+            np.testing.assert_allclose(actual_top[movie_id], similarities, atol=1e-5)
+
+    def test_without_top_k_every_pair_above_threshold_is_kept(self):
+        movie1_ids, movie2_ids, similarities = factor_top_k_pairs(self.movie_ids, self.factors, 0.1, top_k=None, block_size=16)
+        self.assertEqual(set(zip(movie1_ids.tolist(), movie2_ids.tolist())), set(self.expected))
+        self.assertTrue(np.all(np.diff(similarities) <= 0))
+
+
+class CooccurrenceTests(SimpleTestCase):
+
+    def test_delta_matches_full_recompute(self):
+        rng = np.random.default_rng(0)
+        n_users, n_items = 40, 30
+        cells = rng.permutation(n_users * n_items)[:300]
+        old_cells, new_cells = cells[:200], cells[200:]
+        old = binary_matrix(old_cells // n_items, old_cells % n_items, n_users, n_items)
+        new = binary_matrix(new_cells // n_items, new_cells % n_items, n_users, n_items)
+
+        full = cooccurrence_counts(binary_matrix(cells // n_items, cells % n_items, n_users, n_items))
+        incremental = cooccurrence_counts(old) + cooccurrence_delta(old, new)
+        np.testing.assert_array_equal(incremental.toarray(), full.toarray())
+
+
+class FactorStoreTests(SimpleTestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        override = override_settings(RECOMMENDER=dict(settings.RECOMMENDER, ARTIFACT_DIR=self.tmp_dir.name))
+        override.enable()
+        self.addCleanup(override.disable)
+
+        rng = np.random.default_rng(0)
+        self.item_ids = np.arange(100, 130)
+        self.item_factors = rng.normal(size=(len(self.item_ids), 4)).astype(np.float32)
+
+    def store(self, **meta):
+        save_factors([1], np.ones((1, 4), dtype=np.float32), self.item_ids, self.item_factors, meta=meta)
+        return FactorStore('als', current_version('als'))
+
+    def test_saved_factors_are_sorted_and_mapped(self):
+        self.assertIsNone(current_version('als'))
+        order = np.random.default_rng(1).permutation(len(self.item_ids))
+        user_factors = np.arange(12, dtype=np.float32).reshape(3, 4)
+        save_factors([30, 10, 20], user_factors, self.item_ids[order], self.item_factors[order], meta={'reg_param': 0.1})
+        store = FactorStore('als', current_version('als'))
+
+        self.assertEqual(store.item_ids.tolist(), self.item_ids.tolist())
+        self.assertEqual(store.item_rows([129, 100, 999]).tolist(), [29, 0, -1])
+        self.assertEqual(store.user_rows([20, 5, 30, 40]).tolist(), [1, -1, 2, -1])
+        np.testing.assert_array_equal(store.user_vector(10), user_factors[1])
+        self.assertIsNone(store.user_vector(40))
+        np.testing.assert_allclose(store.score_items(user_factors[1]), self.item_factors @ user_factors[1], rtol=1e-5)
+        self.assertEqual((store.rank, store.meta['items'], store.meta['reg_param']), (4, 30, 0.1))
+
+    def test_explicit_fold_in_matches_least_squares(self):
+        store = self.store(reg_param=0.1)
+        movie_ids, ratings = [103, 110, 125, 999], [8.0, 6.0, 9.0, 7.0]
+        # 不在模型中的电影(999)被忽略，收藏不参与显式模型的求解
+        actual = store.fold_in(movie_ids + [104], ratings + [0.0], kinds=[SIGNAL_RATING] * 4 + [SIGNAL_FAVORITE])
+
+        factors = self.item_factors[[3, 10, 25]]
+        lam = 0.1 * len(factors)
+        a = np.vstack([factors, np.sqrt(lam) * np.eye(4)])
+        b = np.concatenate([ratings[:3], np.zeros(4)])
+        np.testing.assert_allclose(actual, np.linalg.lstsq(a, b, rcond=None)[0], rtol=1e-4, atol=1e-5)
+
+    def test_implicit_fold_in_matches_weighted_least_squares(self):
+        store = self.store(implicit=True, reg_param=0.05, alpha=10.0,
+                           rating_weight=1.0, favorite_weight=2.0, history_weight=0.5)
+        movie_ids = [103, 103, 110, 125, 999]
+        kinds = [SIGNAL_RATING, SIGNAL_FAVORITE, SIGNAL_HISTORY, SIGNAL_RATING, SIGNAL_RATING]
+        values = [8.0, 0.0, 45.0, 0.0, 9.0]
+        actual = store.fold_in(movie_ids, values, kinds=kinds)
+
+        # 最小化 Σ c_i (p_i - x·y_i)² + λ|x|²，同一电影的交互相加，置信度为0的电影偏好为0
+        strengths = np.zeros(len(self.item_ids))
+        weights = {SIGNAL_RATING: 1.0, SIGNAL_FAVORITE: 2.0, SIGNAL_HISTORY: 0.5}
+        for movie_id, strength in zip(movie_ids[:4], signal_strengths(kinds[:4], values[:4], weights)):
+            strengths[movie_id - 100] += 10.0 * strength
+        confidence = 1.0 + strengths
+        preference = (strengths > 0).astype(np.float64)
+        a = np.vstack([np.sqrt(confidence)[:, None] * self.item_factors, np.sqrt(0.05) * np.eye(4)])
+        b = np.concatenate([np.sqrt(confidence) * preference, np.zeros(4)])
+        np.testing.assert_allclose(actual, np.linalg.lstsq(a, b, rcond=None)[0], rtol=1e-4, atol=1e-5)
+
+    def test_fold_in_without_known_movies_returns_none(self):
+        self.assertIsNone(self.store().fold_in([999], [8.0]))
+        self.assertIsNone(self.store(implicit=True).fold_in([103], [0.0]))
+
+    def test_recommend_skips_excluded_movies(self):
+        store = self.store()
+        user_vector = np.array([1.0, -0.5, 0.2, 0.0], dtype=np.float32)
+        ranked = self.item_ids[np.argsort(-(self.item_factors @ user_vector), kind='stable')].tolist()
+        recommended = store.recommend(user_vector, limit=5, exclude_ids=[ranked[1], 999])
+        self.assertEqual([movie_id for movie_id, _ in recommended], [ranked[0]] + ranked[2:6])
+        self.assertEqual(len(store.recommend(user_vector, limit=100)), len(self.item_ids))
+
+    def test_versions_saved_within_one_second_are_distinct(self):
+        with mock.patch('time.strftime', return_value='20260101000000'), \
+                override_settings(RECOMMENDER=dict(settings.RECOMMENDER, KEEP_VERSIONS=2)):
+            versions = [self.store().version for _ in range(4)]
+        # 同一秒内发布的版本依次递增序号，清理旧版本后序号也不会重复
+        self.assertEqual(versions, sorted(set(versions)))
+        self.assertEqual(current_version('als'), versions[-1])
+        self.assertEqual(sorted(os.listdir(os.path.join(self.tmp_dir.name, 'als'))), versions[-2:] + ['CURRENT'])
+
+
+class MergeCandidatesTests(SimpleTestCase):
+
+    def test_higher_priority_source_wins_and_comes_first(self):
+        candidates = [
+            # (来源序号, 行, 列, 分数, 来源内名次)
+            (2, np.array([0, 0, 0]), np.array([5, 6, 7]), np.array([0.9, 0.8, 0.7]), np.array([0, 1, 2])),
+            (0, np.array([0, 0, 1]), np.array([6, 8, 5]), np.array([3.0, 2.0, 1.0]), np.array([0, 1, 0])),
+            (1, np.array([0, 1]), np.array([5, 9]), np.array([0.5, 0.4]), np.array([0, 0])),
+        ]
+        rows, cols, scores, sources, ranks = merge_candidates(candidates, top_n=4)
+
+        self.assertEqual(list(zip(rows.tolist(), cols.tolist(), sources.tolist(), ranks.tolist())), [
+            (0, 6, 0, 0), (0, 8, 0, 1), (0, 5, 1, 2), (0, 7, 2, 3),
+            (1, 5, 0, 0), (1, 9, 1, 1),
+        ])
+        np.testing.assert_allclose(scores, [3.0, 2.0, 0.5, 0.7, 1.0, 0.4])
+
+    def test_top_n_and_empty_input(self):
+        candidates = [(0, np.zeros(5, dtype=np.int64), np.arange(5), np.ones(5), np.arange(5))]
+        rows, cols, _, _, ranks = merge_candidates(candidates, top_n=3)
+        self.assertEqual(cols.tolist(), [0, 1, 2])
+        self.assertEqual(ranks.tolist(), [0, 1, 2])
+        self.assertEqual(len(merge_candidates([], top_n=3)[0]), 0)
+
+    def test_top_n_factors_skips_seen_and_invalid_movies(self):
+        user_factors = np.array([[1.0, 0.0], [0.0, 1.0]])
+        item_factors = np.array([[5.0, 0.0], [4.0, 1.0], [3.0, 2.0], [2.0, 3.0], [1.0, 4.0]])
+        seen = csr_matrix(([1.0, 1.0], ([0, 1], [0, 4])), shape=(2, 5))
+        valid = np.array([True, True, False, True, True])
+        rows, cols, scores, ranks = _top_n_factors(user_factors, item_factors, seen, valid, top_n=3)
+        self.assertEqual(list(zip(rows.tolist(), cols.tolist(), ranks.tolist())), [
+            (0, 1, 0), (0, 3, 1), (0, 4, 2),
+            (1, 3, 0), (1, 1, 1), (1, 0, 2),
+        ])
+        np.testing.assert_allclose(scores, [4.0, 2.0, 1.0, 3.0, 1.0, 0.0])
+
+    def test_top_n_sparse_breaks_ties_by_column(self):
+        scores = csr_matrix(np.array([[0.0, 0.5, 0.9, 0.5, 0.7], [0.2, 0.0, 0.0, 0.0, 0.3]]))
+        seen = csr_matrix(([1.0], ([0], [2])), shape=(2, 5))
+        valid = np.array([True, True, True, True, False])
+        rows, cols, data, ranks = _top_n_sparse(scores, seen, valid, top_n=2)
+        self.assertEqual(list(zip(rows.tolist(), cols.tolist(), ranks.tolist())), [(0, 1, 0), (0, 3, 1), (1, 0, 0)])
+        np.testing.assert_allclose(data, [0.5, 0.5, 0.2])
+
+
+class NeighborRecommendationsTests(TestCase):
+    """没有预计算结果时按近邻表的在线推荐"""
+
+    def setUp(self):
+        for movie_id in range(1, 9):
+            Movie.objects.create(id=movie_id, title=f'电影{movie_id}')
+        self.user = User.objects.create(username='viewer')
+        UserRating.objects.create(user=self.user, movie_id=1, rating=9.0)
+        UserRating.objects.create(user=self.user, movie_id=2, rating=3.0)
+        UserFavorite.objects.create(user=self.user, movie_id=3)
+        UserHistory.objects.create(user=self.user, movie_id=4)
+
+        for movie1_id, movie2_id, similarity in ((1, 5, 0.5), (3, 5, 0.2), (1, 4, 0.9), (3, 6, 0.3)):
+            MovieCooccurrence.objects.create(movie1_id=movie1_id, movie2_id=movie2_id, similarity=similarity)
+        for movie1_id, movie2_id, similarity in ((1, 5, 0.8), (1, 7, 0.4), (2, 8, 0.9)):
+            MovieSimilarity.objects.create(movie1_id=movie1_id, movie2_id=movie2_id, similarity=similarity)
+
+    def test_cooccurrence_comes_before_content(self):
+        recommendations = neighbor_recommendations(self.user.id, limit=10)
+        # 低分评分的电影2不作为种子，但和看过的电影4一样被排除；电影5两个种子的共现相似度相加
+        self.assertEqual([(movie_id, source) for movie_id, _, source in recommendations], [
+            (5, 'cooccurrence'), (6, 'cooccurrence'), (7, 'content'),
+        ])
+        self.assertAlmostEqual(recommendations[0][1], 0.7)
+        self.assertEqual([movie_id for movie_id, _, _ in neighbor_recommendations(self.user.id, limit=2)], [5, 6])
+
+    def test_user_without_liked_movies(self):
+        other = User.objects.create(username='newcomer')
+        UserRating.objects.create(user=other, movie_id=1, rating=4.0)
+        self.assertEqual(neighbor_recommendations(other.id), [])
+
+
+class LSHIndexTests(SimpleTestCase):
+
+    def test_recall_floor_on_clustered_factors(self):
+        rng = np.random.default_rng(0)
+        centers = rng.normal(size=(40, 16))
+        vectors = centers[rng.integers(0, 40, 3000)] + 0.3 * rng.normal(size=(3000, 16))
+        index = LSHIndex.build(rng.permutation(100000)[:3000], vectors)
+
+        report = measure_recall(index, k=10, sample_size=200)
+        self.assertGreaterEqual(report['recall'], 0.9)
+        # 只对少量候选精确排序，不退化为全量扫描
+        self.assertLess(report['avg_candidates'], len(index.ids) / 10)
+        self.assertGreaterEqual(report['recall'], measure_recall(index, k=10, sample_size=200, probe_neighbors=False)['recall'])
+
+    def test_similar_excludes_query_and_survives_save(self):
+        rng = np.random.default_rng(1)
+        index = LSHIndex.build(np.arange(200), rng.normal(size=(200, 8)))
+        with tempfile.TemporaryDirectory() as path:
+            index.save(path)
+            loaded = LSHIndex.load(path)
+            self.assertEqual(loaded.similar(7, k=5), index.similar(7, k=5))
+        self.assertNotIn(7, [movie_id for movie_id, _ in index.similar(7, k=5)])
+
+
+def parsed_movie(title, genres, tags, ratings_count, directors=(), actors=()):
+    """_fetch_parsed_rows 返回的单行解析结果"""
+    return {
+        'title': title, 'original_title': '', 'directors': list(directors), 'actors': list(actors),
+        'genres': list(genres), 'tags': list(tags), 'rating': 8.0, 'year': 2000, 'ratings_count': ratings_count,
+    }
+
+
+class FeatureStoreTests(SimpleTestCase):
+    """电影特征存储的增量刷新"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        override = override_settings(RECOMMENDER=dict(settings.RECOMMENDER, ARTIFACT_DIR=self.tmp_dir.name))
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def refresh(self, rows, hashes):
+        """用给定的原始行刷新特征存储，返回 (统计, 被重新解析的电影ID)"""
+        movie_ids = sorted(rows)
+        fetch_hashes = mock.patch(
+            'recommender.feature_store._fetch_row_hashes',
+            return_value=(np.asarray(movie_ids, dtype=np.int64), np.asarray([hashes[i] for i in movie_ids], dtype=np.uint64)),
+        )
+        fetch_rows = mock.patch(
+            'recommender.feature_store._fetch_parsed_rows',
+            side_effect=lambda ids: {movie_id: rows[movie_id] for movie_id in ids},
+        )
+        with fetch_hashes, fetch_rows as fetched:
+            stats = refresh_feature_store()
+        return stats, [movie_id for call in fetched.call_args_list for movie_id in call.args[0]]
+
+    def test_only_changed_rows_are_parsed(self):
+        rows = {
+            1: parsed_movie('甲', ['剧情'], ['经典'], 50, directors=['导演甲'], actors=['演员甲', '演员乙']),
+            2: parsed_movie('乙', ['喜剧'], [], 30),
+            3: parsed_movie('丙', ['剧情', '爱情'], ['经典'], 40),
+        }
+        stats, fetched = self.refresh(rows, {1: 11, 2: 12, 3: 13})
+        self.assertEqual((stats['parsed'], stats['reused'], stats['removed'], fetched), (3, 0, 0, [1, 2, 3]))
+        first = MovieFeatureStore.current()
+        first_vocab = {name: list(values) for name, values in first.vocab.items()}
+
+        # 修改电影3的标签，删除电影2，新增电影4
+        rows[3] = parsed_movie('丙', ['剧情', '爱情'], ['新标签', '经典'], 40)
+        rows[4] = parsed_movie('丁', [], [], 90)
+        del rows[2]
+        stats, fetched = self.refresh(rows, {1: 11, 3: 99, 4: 14})
+        self.assertEqual((stats['total'], stats['parsed'], stats['reused'], stats['removed']), (3, 2, 1, 1))
+        self.assertEqual(sorted(fetched), [3, 4])
+
+        store = MovieFeatureStore.current()
+        self.assertEqual(store.version, stats['version'])
+        for name, values in first_vocab.items():
+            self.assertEqual(store.vocab[name][:len(values)], values)
+        self.assertEqual(store.codes('tags', 0), first.codes('tags', 0))
+
+        # 没有类型和标签的电影4被过滤，其余按评分人数降序
+        movies = store.movies(min_ratings=0)
+        self.assertEqual([movie['movie_id'] for movie in movies], [1, 3])
+        self.assertEqual((movies[0]['directors'], movies[0]['actors']), (['导演甲'], ['演员甲', '演员乙']))
+        self.assertEqual((movies[1]['genres'], movies[1]['tags'], movies[1]['ratings_count']), (['剧情', '爱情'], ['新标签', '经典'], 40))
+        self.assertEqual([movie['movie_id'] for movie in store.movies(min_ratings=45)], [1])
+
+        # 没有变化时沿用当前版本，不读取原始行
+        unchanged, fetched = self.refresh(rows, {1: 11, 3: 99, 4: 14})
+        self.assertEqual((unchanged['version'], unchanged['parsed'], fetched), (stats['version'], 0, []))
+
+
+class SimilarityComponentsTests(SimpleTestCase):
+    """相似度分量的保存与按新权重重新合成"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        override = override_settings(RECOMMENDER=dict(settings.RECOMMENDER, ARTIFACT_DIR=self.tmp_dir.name))
+        override.enable()
+        self.addCleanup(override.disable)
+        self.movies = random_movies(60)
+
+    def test_blend_reproduces_stored_similarities(self):
+        expected = brute_force_pairs(self.movies, 0.15)
+        # 电影对的方向不影响保存结果，不在本次特征中的电影对被跳过
+        pairs = [(m2, m1) if i % 2 else (m1, m2) for i, (m1, m2) in enumerate(expected)] + [(3, 99999)]
+        save_similarity_components(self.movies, pairs, meta={'top_k': 5})
+        store = SimilarityComponents.current()
+        self.assertEqual(len(store), len(expected))
+        self.assertEqual(store.meta['top_k'], 5)
+
+        keys = list(zip(store.movie1_ids.tolist(), store.movie2_ids.tolist()))
+        np.testing.assert_allclose(store.blend(SIMILARITY_WEIGHTS), [expected[key] for key in keys], atol=2e-3)
+
+        # 只看类型时总分即类型重叠度
+        by_id = {movie['movie_id']: movie for movie in self.movies}
+        genre_only = store.blend({'genres': 1.0, 'directors': 0.0, 'actors': 0.0, 'tags': 0.0}, min_similarity=0.0)
+        for (movie1_id, movie2_id), similarity in zip(keys, genre_only.tolist()):
+            genres1, genres2 = set(by_id[movie1_id]['genres']), set(by_id[movie2_id]['genres'])
+            overlap = len(genres1 & genres2) / max(len(genres1), len(genres2), 1)
+            self.assertAlmostEqual(similarity, overlap, delta=2e-3)
+
+    def test_configured_weights_are_validated(self):
+        with override_settings(RECOMMENDER=dict(settings.RECOMMENDER, SIMILARITY_WEIGHTS={'tags': 0.5})):
+            self.assertEqual(similarity_weights(), dict(SIMILARITY_WEIGHTS, tags=0.5))
+        for weights in ({'plot': 0.5}, {'tags': -1}):
+            with self.subTest(weights=weights), \
+                    override_settings(RECOMMENDER=dict(settings.RECOMMENDER, SIMILARITY_WEIGHTS=weights)):
+                with self.assertRaises(ValueError):
+                    similarity_weights()
+
+
+class FakeStreamCursor:
+    """按 fetchmany 的块大小依次返回给定行的服务端游标"""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.remaining = list(conn.rows)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        self.conn.executed.append(sql)
+
+    def fetchmany(self, size):
+        chunk, self.remaining = self.remaining[:size], self.remaining[size:]
+        return chunk
+
+
+class FakeStreamConnection:
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.executed = []
+
+    def cursor(self, cursor_class=None):
+        return FakeStreamCursor(self)
+
+
+class RatingLoaderTests(SimpleTestCase):
+    """交互数据的流式读取与编码"""
+
+    def test_encode_matches_np_unique(self):
+        rng = np.random.default_rng(0)
+        for ids in (rng.integers(1, 500, size=2000).astype(np.int32),
+                    rng.integers(1, 500, size=2000).astype(np.int64) * 10_000_000_000,
+                    np.zeros(0, dtype=np.int32)):
+            with self.subTest(dtype=ids.dtype, size=len(ids)):
+                expected_ids, expected_idx = np.unique(ids, return_inverse=True)
+                # int32的输入会被原地改写为下标
+                unique_ids, idx = _encode(ids.copy())
+                np.testing.assert_array_equal(unique_ids, expected_ids)
+                np.testing.assert_array_equal(idx, expected_idx)
+                self.assertEqual((unique_ids.dtype, idx.dtype), (np.int64, np.int32))
+
+    def test_column_buffer_widens_ids_beyond_int32(self):
+        buffer = _ColumnBuffer(2)
+        buffer.append(np.array([[1, 10, 8.0], [2, 20, 6.0]]), SIGNAL_RATING)
+        big = np.iinfo(np.int32).max + 5
+        buffer.append(np.array([[big, 30], [3, big]], dtype=np.float64), SIGNAL_FAVORITE)
+
+        users, items, values, kinds = buffer.trimmed()
+        self.assertEqual((users.dtype, items.dtype), (np.int64, np.int64))
+        self.assertEqual(users.tolist(), [1, 2, big, 3])
+        self.assertEqual(items.tolist(), [10, 20, 30, big])
+        self.assertEqual(values.tolist(), [8.0, 6.0, 1.0, 1.0])
+        self.assertEqual(kinds.tolist(), [SIGNAL_RATING] * 2 + [SIGNAL_FAVORITE] * 2)
+
+    def test_streamed_rows_build_summed_matrix(self):
+        conn = FakeStreamConnection([(7, 100, 8.0), (9, 100, 6.0), (7, 300, 4.0), (7, 100, 1.0), (9, 200, 2.0)])
+        buffer = _ColumnBuffer(1)
+        self.assertEqual(_stream_table(conn, 'SELECT ...', 3, buffer, SIGNAL_RATING, fetch_size=2), 5)
+
+        users, items, values, kinds = buffer.trimmed()
+        user_ids, user_idx = _encode(users)
+        item_ids, item_idx = _encode(items)
+        interactions = Interactions(user_ids, item_ids, user_idx, item_idx, values, kinds)
+        self.assertEqual((len(interactions), interactions.n_users, interactions.n_items), (5, 2, 3))
+        np.testing.assert_array_equal(interactions.to_csr().toarray(), [[9.0, 0.0, 4.0], [6.0, 2.0, 0.0]])
+        np.testing.assert_array_equal(interactions.to_csr({SIGNAL_RATING: 0.5}).toarray(), [[4.5, 0.0, 2.0], [3.0, 1.0, 0.0]])
+
+
+class ImplicitALSTests(SimpleTestCase):
+    """隐式反馈ALS的置信度矩阵和共轭梯度求解"""
+
+    weights = {SIGNAL_RATING: 1.0, SIGNAL_FAVORITE: 2.0, SIGNAL_HISTORY: 0.5}
+
+    def test_signal_strengths(self):
+        kinds = np.array([SIGNAL_RATING, SIGNAL_FAVORITE, SIGNAL_HISTORY, SIGNAL_RATING])
+        strengths = signal_strengths(kinds, [8.0, 1.0, 45.0, 0.0], self.weights)
+        np.testing.assert_allclose(strengths, [0.8, 2.0, 0.5 * (1 + np.log1p(45.0)), 0.0], rtol=1e-6)
+
+    def test_confidence_matrix_sums_signals_and_drops_zeros(self):
+        interactions = Interactions(
+            user_ids=np.array([7, 9]), item_ids=np.array([100, 200, 300]),
+            user_idx=np.array([0, 0, 1, 1, 0], dtype=np.int32), item_idx=np.array([0, 0, 1, 2, 2], dtype=np.int32),
+            values=np.array([8.0, 1.0, 0.0, 30.0, 5.0], dtype=np.float32),
+            kinds=np.array([SIGNAL_RATING, SIGNAL_FAVORITE, SIGNAL_RATING, SIGNAL_HISTORY, SIGNAL_RATING], dtype=np.int8),
+        )
+        matrix = confidence_matrix(interactions, alpha=10.0, weights=self.weights)
+        # 同一用户对同一电影的评分和收藏相加，0分评分不进入矩阵
+        self.assertEqual(matrix.nnz, 3)
+        np.testing.assert_allclose(matrix.toarray(), [
+            [10.0 * (0.8 + 2.0), 0.0, 5.0],
+            [0.0, 0.0, 10.0 * 0.5 * (1 + np.log1p(30.0))],
+        ], rtol=1e-6)
+
+    def test_least_squares_cg_matches_exact_solve(self):
+        rng = np.random.default_rng(0)
+        n_users, n_items, rank, reg = 12, 20, 4, 0.1
+        dense = np.where(rng.random((n_users, n_items)) < 0.3, rng.random((n_users, n_items)) * 5, 0.0)
+        dense[5] = 0
+        confidence = csr_matrix(dense)
+        factors = rng.normal(size=(n_items, rank))
+
+        # rank 步共轭梯度即得到精确解；分块并用线程池求解
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            actual = least_squares_cg(confidence, np.zeros((n_users, rank)), factors, reg,
+                                      cg_steps=rank, executor=executor, block_size=5)
+
+        for user in range(n_users):
+            a = factors.T @ factors + factors.T @ (dense[user][:, None] * factors) + reg * np.eye(rank)
+            b = factors.T @ ((dense[user] + 1.0) * (dense[user] > 0))
+            np.testing.assert_allclose(actual[user], np.linalg.solve(a, b), rtol=1e-6, atol=1e-8)
+        np.testing.assert_array_equal(actual[5], np.zeros(rank))
+
+    def test_training_reduces_loss(self):
+        rng = np.random.default_rng(1)
+        confidence = csr_matrix(np.where(rng.random((30, 25)) < 0.2, 10.0, 0.0).astype(np.float32))
+        losses = [
+            implicit_loss(confidence, *train_implicit_als(confidence, factors=4, iterations=iterations, workers=2), 0.05)
+            for iterations in (1, 8)
+        ]
+        self.assertLess(losses[1], losses[0])
+
+
+class FakeCursor:
+    """记录执行的SQL，fail_on 中的语句片段会抛出异常"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        if any(fragment in sql for fragment in self.conn.fail_on):
+            raise RuntimeError(f'failed: {sql}')
+        self.conn.statements.append(sql)
+
+    def executemany(self, sql, rows):
+        self.conn.statements.append((sql, list(rows)))
+
+
+class FakeConnection:
+
+    def __init__(self, fail_on=()):
+        self.statements = []
+        self.fail_on = fail_on
+        self.closed = False
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def close(self):
+        self.closed = True
+
+
+# 线上相似度表在MySQL上的约束：主键、联合唯一索引、外键以及外键自带的索引
+SIMILARITY_CONSTRAINTS = {
+    'PRIMARY': {'columns': ['id'], 'primary_key': True, 'unique': True, 'foreign_key': None, 'index': True},
+    'pair_uniq': {'columns': ['movie1_id', 'movie2_id'], 'primary_key': False, 'unique': True, 'foreign_key': None, 'index': True},
+    'movie1_fk': {'columns': ['movie1_id'], 'primary_key': False, 'unique': False, 'foreign_key': ('movies_movie', 'id'), 'index': False},
+    'movie2_idx': {'columns': ['movie2_id'], 'primary_key': False, 'unique': False, 'foreign_key': None, 'index': True},
+}
+
+
+class SimilarityStoreTests(SimpleTestCase):
+    """相似度表写入器生成的SQL"""
+
+    def setUp(self):
+        self.conn = FakeConnection()
+        connect = mock.patch('recommender.similarity_store._connect', side_effect=lambda: self.conn)
+        django_connection = mock.patch('recommender.similarity_store.connection')
+        connect.start()
+        django_connection.start().introspection.get_constraints.return_value = SIMILARITY_CONSTRAINTS
+        self.addCleanup(mock.patch.stopall)
+
+    def test_table_writer_batches_insert_ignore(self):
+        with SimilarityTableWriter(batch_size=2) as writer:
+            for row in [(1, 2, 0.5), (1, 3, 0.4), (2, 3, 0.3)]:
+                writer.write(*row)
+        sql = "INSERT IGNORE INTO `recommender_moviesimilarity` (`movie1_id`, `movie2_id`, `similarity`) VALUES (%s, %s, %s)"
+        self.assertEqual(self.conn.statements, [(sql, [(1, 2, 0.5), (1, 3, 0.4)]), (sql, [(2, 3, 0.3)])])
+        self.assertEqual(writer.rows_written, 3)
+        self.assertTrue(self.conn.closed)
+
+    def test_shadow_writer_swaps_in_loaded_table(self):
+        with ShadowTableWriter() as writer:
+            writer.write(1, 2, 0.5)
+        self.assertEqual(self.conn.statements, [
+            "DROP TABLE IF EXISTS `recommender_moviesimilarity_new`",
+            "DROP TABLE IF EXISTS `recommender_moviesimilarity_old`",
+            "CREATE TABLE `recommender_moviesimilarity_new` LIKE `recommender_moviesimilarity`",
+            "ALTER TABLE `recommender_moviesimilarity_new` DROP INDEX `pair_uniq`, DROP INDEX `movie2_idx`",
+            ("INSERT INTO `recommender_moviesimilarity_new` (`movie1_id`, `movie2_id`, `similarity`) VALUES (%s, %s, %s)", [(1, 2, 0.5)]),
+            "ALTER TABLE `recommender_moviesimilarity_new` ADD UNIQUE INDEX `pair_uniq` (`movie1_id`, `movie2_id`), "
+            "ADD INDEX `movie2_idx` (`movie2_id`)",
+            "RENAME TABLE `recommender_moviesimilarity` TO `recommender_moviesimilarity_old`, "
+            "`recommender_moviesimilarity_new` TO `recommender_moviesimilarity`",
+            "DROP TABLE `recommender_moviesimilarity_old`",
+            "SET foreign_key_checks = 0",
+            "ALTER TABLE `recommender_moviesimilarity` "
+            "ADD CONSTRAINT `movie1_fk` FOREIGN KEY (`movie1_id`) REFERENCES `movies_movie` (`id`), "
+            "ADD CONSTRAINT `recommender_moviesimilarity_movie2_id_fk` FOREIGN KEY (`movie2_id`) REFERENCES `movies_movie` (`id`)",
+            "SET foreign_key_checks = 1",
+        ])
+        self.assertTrue(self.conn.closed)
+
+    def test_shadow_writer_targets_given_model(self):
+        with ShadowTableWriter(model=MovieCooccurrence) as writer:
+            writer.write(1, 2, 0.5)
+        self.assertIn("CREATE TABLE `recommender_moviecooccurrence_new` LIKE `recommender_moviecooccurrence`", self.conn.statements)
+        self.assertIn(
+            "RENAME TABLE `recommender_moviecooccurrence` TO `recommender_moviecooccurrence_old`, "
+            "`recommender_moviecooccurrence_new` TO `recommender_moviecooccurrence`",
+            self.conn.statements,
+        )
+
+    def test_shadow_writer_drops_table_on_error(self):
+        with self.assertRaises(ValueError):
+            with ShadowTableWriter() as writer:
+                writer.write(1, 2, 0.5)
+                raise ValueError('计算失败')
+        self.assertEqual(self.conn.statements[-1], "DROP TABLE IF EXISTS `recommender_moviesimilarity_new`")
+        self.assertFalse(any('RENAME' in sql for sql in self.conn.statements if isinstance(sql, str)))
+        self.assertTrue(self.conn.closed)
+
+
+    def test_shadow_writer_drops_table_when_swap_fails(self):
+        for step in ('ADD UNIQUE INDEX', 'RENAME TABLE'):
+            with self.subTest(step=step):
+                self.conn = FakeConnection(fail_on=(step,))
+                with self.assertRaises(RuntimeError):
+                    with ShadowTableWriter() as writer:
+                        writer.write(1, 2, 0.5)
+                self.assertEqual(self.conn.statements[-1], "DROP TABLE IF EXISTS `recommender_moviesimilarity_new`")
+                self.assertFalse(any('RENAME' in sql or 'ADD CONSTRAINT' in sql for sql in self.conn.statements if isinstance(sql, str)))
+                self.assertTrue(self.conn.closed)
+
+    def test_foreign_key_checks_are_restored_on_error(self):
+        self.conn = FakeConnection(fail_on=('ADD CONSTRAINT',))
+        with self.assertRaises(RuntimeError):
+            with ShadowTableWriter() as writer:
+                writer.write(1, 2, 0.5)
+        # 线上表已经替换完成，不再删除
+        self.assertEqual(self.conn.statements[-2:], ["SET foreign_key_checks = 0", "SET foreign_key_checks = 1"])
+        self.assertIn("DROP TABLE `recommender_moviesimilarity_old`", self.conn.statements)
+
+
+class SaveSimilarityResultsTests(TestCase):
+    """相似度结果写入前补齐电影记录"""
+
+    def setUp(self):
+        Movie.objects.create(id=3, title='已导入')
+        self.movies = [{
+            'movie_id': movie_id, 'title': f'电影{movie_id}', 'original_title': '', 'rating': 8.0,
+            'directors': ['导演甲', '导演乙'], 'actors': [f'演员{i}' for i in range(7)],
+        } for movie_id in (3, 10, 17)]
+
+    def test_missing_movies_are_created_once(self):
+        writer = mock.Mock()
+        results = iter([(3, 10, 0.9), (3, 17, 0.8), (10, 17, 0.7)])
+        self.assertEqual(_save_similarity_results(results, self.movies, writer, max_similarity_records=2), 2)
+        self.assertEqual(writer.write.call_args_list, [mock.call(3, 10, 0.9), mock.call(3, 17, 0.8)])
+
+        self.assertEqual(set(Movie.objects.values_list('id', flat=True)), {3, 10, 17})
+        self.assertEqual(Movie.objects.get(id=3).title, '已导入')
+        created = Movie.objects.get(id=10)
+        self.assertEqual((created.title, created.director, created.actors.count(',')), ('电影10', '导演甲', 4))
+        self.assertEqual(_ensure_movies_exist(self.movies), 0)
+
+
+class IncrementalSimilarityUpdateTests(TestCase):
+    """按内容哈希增量更新相似度"""
+
+    def setUp(self):
+        features = {
+            1: (['剧情', '爱情'], ['经典']), 2: (['剧情', '爱情'], ['经典']),
+            3: (['喜剧'], ['搞笑']), 4: (['剧情', '爱情'], ['经典']),
+        }
+        self.movies = [{
+            'movie_id': movie_id, 'title': f'电影{movie_id}', 'original_title': '', 'rating': 8.0,
+            'genres': genres, 'directors': [], 'actors': [], 'tags': tags,
+        } for movie_id, (genres, tags) in features.items()]
+        for movie_id in (1, 2, 3, 9):
+            Movie.objects.create(id=movie_id, title=f'电影{movie_id}')
+        # 电影4是新增的，电影9已不在电影表中
+        for movie in self.movies[:3]:
+            MovieContentHash.objects.create(movie_id=movie['movie_id'], content_hash=movie_content_hash(movie))
+        MovieContentHash.objects.create(movie_id=9, content_hash='0' * 40)
+        for movie1_id, movie2_id, similarity in ((1, 2, 0.8), (1, 9, 0.6), (3, 9, 0.5)):
+            MovieSimilarity.objects.create(movie1_id=movie1_id, movie2_id=movie2_id, similarity=similarity)
+
+        patcher = mock.patch('recommender.recommendation.SimilarityComponents.current', return_value=None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_changed_and_removed_movies_are_replaced(self):
+        with mock.patch('recommender.recommendation.SimilarityTableWriter') as writer_class:
+            self.assertEqual(_incremental_similarity_update(self.movies, 0.15, 50), 2)
+        writer = writer_class.return_value.__enter__.return_value
+        written = {tuple(sorted(c.args[:2])): c.args[2] for c in writer.write.call_args_list}
+        self.assertEqual(set(written), {(1, 4), (2, 4)})
+        self.assertAlmostEqual(written[(1, 4)], 0.8, places=6)
+
+        # 涉及已移除电影的记录被删除，未变化电影之间的记录保留
+        self.assertEqual(list(MovieSimilarity.objects.values_list('movie1_id', 'movie2_id')), [(1, 2)])
+        self.assertEqual(set(MovieContentHash.objects.values_list('movie_id', flat=True)), {1, 2, 3, 4})
+        self.assertEqual(_incremental_similarity_update(self.movies, 0.15, 50), 0)
+
+    def test_no_baseline_falls_back_to_full_rebuild(self):
+        MovieContentHash.objects.all().delete()
+        self.assertIsNone(_incremental_similarity_update(self.movies, 0.15, 50))
+        self.assertEqual(MovieSimilarity.objects.count(), 3)
+
+    def test_limit_is_rejected(self):
+        with self.assertRaises(ValueError):
+            update_similarity_from_collectmoviedb(limit=10, incremental=True, no_prompt=True)
+        self.assertEqual(MovieSimilarity.objects.count(), 3)
@@ -30,4 +30,57 @@ def parse_image_data(image_str):
                     'medium': urls[0],
                     'small': urls[0]
                 }
-    return None 
\ No newline at end of file
+    return None 
+
+
+def parse_literal(text):
+    """
+    解析以JSON或Python repr形式保存的字段，无法解析时返回None
+
+    依次尝试: 标准JSON、把单引号替换为双引号后的JSON、ast.literal_eval
+    """
+    if not text:
+        return None
+    try:
+        return json.loads(text)
+    except ValueError:
+        pass
+    try:
+        return json.loads(text.replace("'", "\""))
+    except ValueError:
+        pass
+    try:
+        return ast.literal_eval(text)
+    except (ValueError, SyntaxError):
+        return None
+
+
+def unique_values(values):
+    """去除空值和重复值，保持原有顺序"""
+    return list(dict.fromkeys(v for v in values if v))
+
+
+def parse_names(text):
+    """从导演、演员等字段中提取不重复的人名列表"""
+    data = parse_literal(text)
+    if not isinstance(data, list):
+        return []
+    return unique_values(item.get('name', '') for item in data if isinstance(item, dict))
+
+
+def parse_str_list(text):
+    """解析 "['剧情', '爱情']" 形式的类型、标签字段，返回不重复的字符串列表"""
+    if not text:
+        return []
+    return unique_values(text.strip("[]").replace("'", "").split(", "))
+
+
+def parse_rating_average(text):
+    """从评分字段中提取平均分，无法解析时返回0"""
+    data = parse_literal(text)
+    if not isinstance(data, dict):
+        return 0
+    try:
+        return float(data.get('average', 0) or 0)
+    except (TypeError, ValueError):
+        return 0
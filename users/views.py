@@ -8,6 +8,7 @@ from django.core.paginator import Paginator
 from .forms import UserRegistrationForm, UserProfileForm
 from .models import User, UserFavorite, UserHistory
 from movies.models import Movie
+from movies.home_cache import invalidate_user_sections
 from django.db import connection
 from datetime import datetime
 
@@ -260,6 +261,9 @@ def toggle_favorite(request, movie_id):
                 # 恢复外键检查
                 cursor.execute("SET FOREIGN_KEY_CHECKS = 1")
         
+        # 首页的个人推荐需要重新查询
+        invalidate_user_sections(user_id)
+        
         return JsonResponse({
             'success': True,
             'is_favorite': is_favorite